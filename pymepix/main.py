@@ -85,6 +85,7 @@ def post_process(args):
         args.number_of_processes,
         args.timewalk_file,
         args.cent_timewalk_file,
+        block_size=args.block_size,
     )
 
 
@@ -203,7 +204,15 @@ def main():
         dest="number_of_processes",
         type=int,
         default=-1,
-        help="The number of processes used for the centroiding (default: None which ensures all existing system cores are used')",
+        help="The number of processes used for decoding and centroiding (default: -1 which ensures all existing system cores are used)",
+    )
+    parser_post_process.add_argument(
+        "-b",
+        "--block_size",
+        dest="block_size",
+        type=int,
+        default=1 << 22,
+        help="Number of 64 bit words read from the raw file at once, limits the memory used for reading (default: 4194304, i.e. 32 MB)",
     )
 
     args = parser.parse_args()
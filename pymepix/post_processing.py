@@ -6,12 +6,15 @@ class ProgressBar(tqdm):
     gui_bar_fun = None
 
     def update_to(self, progress):
-        self.gui_bar_fun(self.n)
+        if self.gui_bar_fun is not None:
+            self.gui_bar_fun(self.n)
         return self.update(progress - self.n)
 
 
-def run_post_processing(input_file_name, output_file, number_processes, timewalk_file, cent_timewalk_file, progress_callback):
+def run_post_processing(input_file_name, output_file, number_processes, timewalk_file, cent_timewalk_file, progress_callback=None,
+                        block_size=1 << 22):
     with ProgressBar(total=1.0, dynamic_ncols=True) as progress_bar:
         progress_bar.gui_bar_fun = progress_callback
-        file_sampler = RawFileSampler(input_file_name, output_file, number_processes, timewalk_file, cent_timewalk_file, progress_bar.update_to)
+        file_sampler = RawFileSampler(input_file_name, output_file, number_processes, timewalk_file, cent_timewalk_file, progress_bar.update_to,
+                                      block_size)
         file_sampler.run()
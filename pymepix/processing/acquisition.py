@@ -23,8 +23,11 @@
 from pymepix.processing.logic.centroid_calculator import CentroidCalculator
 from pymepix.processing.logic.packet_processor import PacketProcessor
 from .baseacquisition import AcquisitionPipeline
+from .bounded_queue import OverflowPolicy
 from .pipeline_centroid_calculator import PipelineCentroidCalculator
+from .pipeline_event_builder import PipelineEventBuilder
 from .pipeline_packet_processor import PipelinePacketProcessor
+from .udp_statistics import UdpStatistics
 from .udpsampler import UdpSampler
 
 
@@ -33,25 +36,83 @@ class PixelPipeline(AcquisitionPipeline):
 
     A pipeline that will read from a UDP address and decode the pixels a useable form.
     This class can be used as a base for all acqusition pipelines.
+
+    With use_event the packet processors only decode the chunks and the events are built by a
+    PipelineEventBuilder stage, which gets the chunks in the order of the data.
     """
 
-    def __init__(self, data_queue, address, longtime, use_event=False, name="Pixel", event_window=(0, 1E-3)):
+    def __init__(
+        self,
+        data_queue,
+        address,
+        longtime,
+        use_event=False,
+        name="Pixel",
+        event_window=(0, 1E-3),
+        recv_batch=1,
+        compact=False,
+        transport=None,
+        latency_tracing=False,
+    ):
         """ 
         Parameters:
-        use_event (boolean): If packets are forwarded to the centroiding. If True centroids are calculated."""
+        use_event (boolean): If packets are forwarded to the centroiding. If True centroids are calculated.
+        recv_batch (int): Maximum number of UDP datagrams received per system call by the UdpSampler, see UdpSampler.
+        compact (boolean): If the UdpSampler forwards only pixel and trigger words to the packet processors.
+        transport (QueueTransport or SharedMemoryTransport): How the stages pass their results on, the
+            default QueueTransport pickles them. The receivers of the data_queue have to use transport.receive.
+        latency_tracing (boolean): If the messages in the data_queue carry the sequence number and receive
+            time of their UDP chunk as third element (see LatencyTracker)."""
         AcquisitionPipeline.__init__(self, name, data_queue)
         self.info("Initializing Pixel pipeline")
         self.packet_processor = PacketProcessor(handle_events=use_event, event_window=event_window)
 
-        self.addStage(0, UdpSampler, address, longtime)
+        # shared by the samplers of all acquisitions of this pipeline
+        self.udp_statistics = UdpStatistics()
+        self.addStage(
+            0,
+            UdpSampler,
+            address,
+            longtime,
+            recv_batch=recv_batch,
+            statistics=self.udp_statistics,
+            compact=compact,
+        )
+        self._use_event = use_event
+        self._transport = transport
+        self._latency_tracing = latency_tracing
         self.addStage(2, PipelinePacketProcessor, num_processes=2)
+        if use_event:
+            self.addStage(3, PipelineEventBuilder)
         self._reconfigureProcessor()
 
     def _reconfigureProcessor(self):
         self.getStage(2).configureStage(
             PipelinePacketProcessor,
-            packet_processor=self.packet_processor
+            packet_processor=self.packet_processor,
+            decode_only=self._use_event,
+            transport=self._transport,
+            trace=self._latency_tracing,
         )
+        if self._use_event:
+            self.getStage(3).configureStage(
+                PipelineEventBuilder,
+                packet_processor=self.packet_processor,
+                transport=self._transport,
+                trace=self._latency_tracing,
+            )
+
+    @property
+    def numPacketProcesses(self):
+        """Number of python processes to spawn for decoding the packets
+
+        Changes take effect on next acquisition.
+        """
+        return self.getStage(2).numProcess
+
+    @numPacketProcesses.setter
+    def numPacketProcesses(self, value):
+        self.getStage(2).numProcess = max(1, value)
 
 
 class CentroidPipeline(PixelPipeline):
@@ -59,14 +120,45 @@ class CentroidPipeline(PixelPipeline):
 
     Same as the pixel pipeline but also includes centroid processing, note that this can be extremely slow
     when dealing with a huge number of objects
+
+    If centroiding falls behind, the queue of events can be bounded with queue_size and overflow_policy
+    (see OverflowPolicy), and max_triggers_processed lets the centroiding skip more triggers while events
+    are waiting (see PipelineCentroidCalculator). With batch_size up to that many EventData messages are
+    centroided with one call.
     """
 
-    def __init__(self, data_queue, address, longtime):
+    def __init__(
+        self,
+        data_queue,
+        address,
+        longtime,
+        recv_batch=1,
+        compact=False,
+        transport=None,
+        latency_tracing=False,
+        queue_size=0,
+        overflow_policy=OverflowPolicy.Block,
+        max_triggers_processed=None,
+        batch_size=1,
+    ):
         PixelPipeline.__init__(
-            self, data_queue, address, longtime, use_event=True, name="Centroid"
+            self,
+            data_queue,
+            address,
+            longtime,
+            use_event=True,
+            name="Centroid",
+            recv_batch=recv_batch,
+            compact=compact,
+            transport=transport,
+            latency_tracing=latency_tracing,
         )
         self.info("Initializing Centroid pipeline")
         self.centroid_calculator=CentroidCalculator()
+        self._max_triggers_processed = max_triggers_processed
+        self._batch_size = batch_size
+        self.getStage(3).queueSize = queue_size
+        self.getStage(3).overflowPolicy = overflow_policy
 
         self.addStage(4, PipelineCentroidCalculator, num_processes=6)
 
@@ -76,7 +168,11 @@ class CentroidPipeline(PixelPipeline):
         self._reconfigureProcessor()
         self.getStage(4).configureStage(
             PipelineCentroidCalculator,
-            centroid_calculator=self.centroid_calculator
+            centroid_calculator=self.centroid_calculator,
+            transport=self._transport,
+            max_triggers_processed=self._max_triggers_processed,
+            batch_size=self._batch_size,
+            trace=self._latency_tracing,
         )
 
     @property
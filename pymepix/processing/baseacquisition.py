@@ -20,12 +20,19 @@
 
 """Module deals with managing processing objects to form a data pipeline"""
 
+import csv
+import json
+import os
+import threading
+import time
 from multiprocessing import Queue
 
 import zmq
 
 import pymepix.config.load_config as cfg
 from pymepix.core.log import Logger
+from pymepix.processing.bounded_queue import BoundedQueue, OverflowPolicy
+from pymepix.processing.stage_metrics import StageMetrics
 from pymepix.processing.usbtrainid import USBTrainID
 
 
@@ -42,19 +49,28 @@ class AcquisitionStage(Logger):
     ------------
     stage: int
         Initial position in the pipeline, lower stages are executed first
+    num_processes: int
+        Number of processes to spawn when built
+    queue_size: int
+        Maximum number of messages in the output queue, 0 for an unbounded queue
+    overflow_policy: :class:`OverflowPolicy`
+        What is done with messages for a full output queue
 
     """
 
-    def __init__(self, stage, num_processes=1):
+    def __init__(self, stage, num_processes=1, queue_size=0, overflow_policy=OverflowPolicy.Block):
         Logger.__init__(self, "AcqStage-{}".format(stage))
         self._stage_number = stage
 
         self._pipeline_objects = []
         self._pipeline_klass = None
         self._num_processes = num_processes
+        self._queue_size = queue_size
+        self._overflow_policy = overflow_policy
         self._running = False
         self._input_queue = None
         self._output_queue = None
+        self._metrics = []
 
         self._args = []
         self._kwargs = {}
@@ -90,6 +106,39 @@ class AcquisitionStage(Logger):
     def numProcess(self, value):
         self._num_processes = max(1, value)
 
+    @property
+    def queueSize(self):
+        """Maximum number of messages in the output queue, 0 if it is unbounded
+
+        Changes take effect on next acquisition. Not used for the last stage, which puts its
+        results into the data queue of the pipeline.
+        """
+        return self._queue_size
+
+    @queueSize.setter
+    def queueSize(self, value):
+        self._queue_size = max(0, value)
+
+    @property
+    def overflowPolicy(self):
+        """What is done with messages for a full output queue, see :class:`OverflowPolicy`"""
+        return self._overflow_policy
+
+    @overflowPolicy.setter
+    def overflowPolicy(self, value):
+        self._overflow_policy = OverflowPolicy(value)
+
+    @property
+    def queueStatistics(self):
+        """Dropped messages and triggers of a bounded output queue, None if the queue is unbounded"""
+        if not isinstance(self._output_queue, BoundedQueue):
+            return None
+        return {
+            "dropped_messages": self._output_queue.dropped_messages,
+            "dropped_triggers": self._output_queue.dropped_triggers,
+            "decimation": self._output_queue.decimation,
+        }
+
     def configureStage(self, pipeline_klass, *args, **kwargs):
         """Configures the stage with a particular processing class
 
@@ -140,7 +189,10 @@ class AcquisitionStage(Logger):
 
         if self._output_queue is None:
             self.debug("I am creating the queue")
-            self._output_queue = Queue()
+            if self._queue_size > 0:
+                self._output_queue = BoundedQueue(self._queue_size, self._overflow_policy)
+            else:
+                self._output_queue = Queue()
         else:
             self.debug("Recieved the queue {}".format(output_queue))
         self.debug("Building stage {} ".format(self._stage_number))
@@ -157,6 +209,13 @@ class AcquisitionStage(Logger):
             self._pipeline_objects.append(p)
             if self._output_queue is None:
                 self._output_queue = p.outputQueues()[-1]
+        # kept after stop for the final values
+        self._metrics = [getattr(p, "metrics", None) for p in self._pipeline_objects]
+
+    @property
+    def metrics(self):
+        """Snapshots of the StageMetrics of the processes of the last build, None for processes without"""
+        return [None if metrics is None else metrics.snapshot() for metrics in self._metrics]
 
     @property
     def outputQueue(self):
@@ -236,10 +295,20 @@ class AcquisitionPipeline(Logger):
         self._data_queue = data_queue
 
         self._running = False
-
-    def addStage(self, stage_number, pipeline_klass, *args, num_processes=1, **kwargs):
-        """Adds a stage to the pipeline"""
-        stage = AcquisitionStage(stage_number, num_processes)
+        self._metrics_dump = None
+
+    def addStage(
+        self,
+        stage_number,
+        pipeline_klass,
+        *args,
+        num_processes=1,
+        queue_size=0,
+        overflow_policy=OverflowPolicy.Block,
+        **kwargs
+    ):
+        """Adds a stage to the pipeline, see :class:`AcquisitionStage` for the queue settings"""
+        stage = AcquisitionStage(stage_number, num_processes, queue_size, overflow_policy)
         self.info("Adding stage {} with klass {}".format(stage_number, pipeline_klass))
         stage.configureStage(pipeline_klass, *args, **kwargs)
         self._stages.append(stage)
@@ -289,6 +358,64 @@ class AcquisitionPipeline(Logger):
             s.start()
         self._running = True
 
+    def getMetrics(self):
+        """Metrics of all pipeline processes as list of dicts with stage, process and name added to the
+        StageMetrics snapshot, see StageMetrics.rates and StageMetrics.quantile for the evaluation"""
+        rows = []
+        for stage in self._stages:
+            for index, snapshot in enumerate(stage.metrics):
+                if snapshot is not None:
+                    row = {"stage": stage.stage, "process": index, "name": stage._pipeline_klass.__name__}
+                    row.update(snapshot)
+                    rows.append(row)
+        return rows
+
+    def startMetricsDump(self, file_name, interval=1.0):
+        """Append the metrics to file_name every interval seconds until stopMetricsDump
+
+        Files ending with .json get one JSON object per line, all others CSV rows with a column for
+        each histogram bucket.
+        """
+        self.stopMetricsDump()
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.__dump_metrics, args=(file_name, interval, stop_event))
+        thread.daemon = True
+        thread.start()
+        self._metrics_dump = thread, stop_event
+
+    def stopMetricsDump(self):
+        """Stop the periodic dump of the metrics after writing them a last time"""
+        if self._metrics_dump is not None:
+            thread, stop_event = self._metrics_dump
+            stop_event.set()
+            thread.join()
+            self._metrics_dump = None
+
+    def __dump_metrics(self, file_name, interval, stop_event):
+        as_json = file_name.endswith(".json")
+        columns = ["time", "stage", "process", "name"] + list(StageMetrics.FIELDS)
+        write_header = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+        with open(file_name, "a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header and not as_json:
+                writer.writerow(columns)
+            while True:
+                stopped = stop_event.wait(interval)
+                now = time.time()
+                rows = self.getMetrics()
+                if as_json:
+                    f.write(json.dumps({"time": now, "metrics": rows}) + "\n")
+                else:
+                    for row in rows:
+                        values = dict(row, time=now)
+                        values.update(
+                            ("histogram_{}".format(bucket), count) for bucket, count in enumerate(row["histogram"])
+                        )
+                        writer.writerow([values[column] for column in columns])
+                f.flush()
+                if stopped:
+                    break
+
     @property
     def isRunning(self):
         return self._running
@@ -21,12 +21,23 @@
 """Base implementation of objects relating to the processing pipeline"""
 
 import multiprocessing
+import queue
 import time
 from multiprocessing import Queue
 from multiprocessing.sharedctypes import Value
 import traceback
 
+import numpy as np
+
 from pymepix.core.log import ProcessLogger
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.stage_metrics import StageMetrics, nbytes
+from pymepix.processing.transport import QueueTransport, discard, receive
+
+# messages whose columns can be concatenated
+_MERGEABLE = (MessageType.PixelData, MessageType.EventData)
+# seconds between two samples of the input queue depth
+_QUEUE_SAMPLE_INTERVAL = 0.1
 
 
 class BasePipelineObject(multiprocessing.Process, ProcessLogger):
@@ -47,6 +58,17 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
         queue (such as results from centroiding). Ignored if create_output is True (Default: None)
     propogate_input: bool
         Whether the input data should be propgated further down the chain
+    transport: :obj:`QueueTransport` or :obj:`SharedMemoryTransport`, optional
+        How the outputs are passed to the queues, the inputs are received with any transport
+        (Default: QueueTransport)
+    batch_size: int, optional
+        Maximum number of messages taken from the input queue at once. Consecutive PixelData or
+        EventData messages of a batch are concatenated and processed with one call. (Default: 1)
+    batch_timeout: float, optional
+        Time in seconds to wait for more messages after the first one of a batch (Default: 0.01)
+    trace: bool, optional
+        Whether the outputs carry the latency trace (sequence, receive time) of the UDP chunk they
+        were computed from as third element, see :obj:`LatencyTracker` (Default: False)
     """
 
     @classmethod
@@ -70,6 +92,10 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
         num_outputs=1,
         shared_output=None,
         propogate_input=True,
+        transport=None,
+        batch_size=1,
+        batch_timeout=0.01,
+        trace=False,
     ):
         ProcessLogger.__init__(self, name)
         multiprocessing.Process.__init__(self)
@@ -77,6 +103,16 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
 
         self.output_queue = []
         self._propgate_input = propogate_input
+        self._transport = transport if transport is not None else QueueTransport()
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._metrics = StageMetrics()
+        self._process_start = 0
+        self._input_bytes = 0
+        self._queue_sampled = 0.0
+        self._trace_enabled = trace
+        # (sequence, time.monotonic() of the reception) of the chunk currently processed
+        self._trace = None
         if shared_output is not None:
             self.debug("Queue is shared")
             if type(shared_output) is list:
@@ -131,6 +167,34 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
         self.debug("Setting enabled flag to {}".format(value))
         self._enable.value = int(value)
 
+    @property
+    def metrics(self):
+        """Processing time, queue depth and throughput of the process, see StageMetrics"""
+        return self._metrics
+
+    def input_received(self, nbytes=0, trace=None):
+        """Objects without input queue call this once the input of process arrived, so the time waiting
+        for it is not counted as processing time. trace is the (sequence, receive time) of the input."""
+        self._process_start = time.perf_counter_ns()
+        self._input_bytes = nbytes
+        self._trace = trace
+
+    def __start_processing(self, value=None):
+        data = None
+        if value is not None:
+            data = value[1]
+            self._trace = value[2] if len(value) > 2 else None
+        self._process_start = time.perf_counter_ns()
+        self._input_bytes = nbytes(data)
+        now = time.monotonic()
+        if self.input_queue is not None and now - self._queue_sampled > _QUEUE_SAMPLE_INTERVAL:
+            self._queue_sampled = now
+            try:
+                self._metrics.sample_queue(self.input_queue.qsize())
+            except NotImplementedError:
+                # not available on macOS
+                self._queue_sampled = float("inf")
+
     def pushOutput(self, data_type, data):
         """Pushes results to output queue (if available)
 
@@ -144,9 +208,12 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
 
         """
         # self.debug('Pushing output {} {} to {}'.format(data_type,data,self.output_queue))
+        self._metrics.record_output(nbytes(data))
+        trace = (self._trace,) if self._trace_enabled and self._trace is not None else ()
         for x in self.output_queue:
             if x is not None:
-                x.put((data_type, data))
+                # each queue gets its own copy with the shared memory transport
+                x.put((data_type, self._transport.encode(data)) + trace)
 
     def process(self, data_type=None, data=None):
         """Main processing function, override this do perform work
@@ -167,8 +234,53 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
         """Function called after main processing loop, override to """
         return None, None
 
-    def run(self):
-        self.pre_run()
+    def __get_batch(self):
+        """Messages of the input queue, up to batch_size or as many as arrive within batch_timeout
+        after the first one. A None ends the batch."""
+        batch = [self.input_queue.get()]
+        deadline = time.perf_counter() + self._batch_timeout
+        while batch[-1] is not None and len(batch) < self._batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self.input_queue.get(timeout=remaining))
+                else:
+                    batch.append(self.input_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __run_batches(self):
+        while True:
+            batch = self.__get_batch()
+            end = batch[-1] is None
+            if end:
+                # Put it back in the queue and leave
+                self.input_queue.put(None)
+                batch = batch[:-1]
+            enabled = self.enable
+            try:
+                if not enabled:
+                    for value in batch:
+                        discard(value)
+                else:
+                    for value in _merge([receive(value) for value in batch]):
+                        self.__start_processing(value)
+                        output_type, result = self.process(value[0], value[1])
+                        self._metrics.record(self._process_start, self._input_bytes)
+                        if self._propgate_input:
+                            self.pushOutput(value[0], value[1])
+                        if output_type is not None and result is not None:
+                            self.pushOutput(output_type, result)
+            except Exception as e:
+                self.error("Exception occured!!!")
+                self.error(e, exc_info=True)
+                self.error(traceback.format_exc())
+                break
+            if end:
+                break
+
+    def __run_messages(self):
         while True:
             enabled = self.enable
             try:
@@ -181,15 +293,22 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
                         # Put it back in the queue and leave
                         self.input_queue.put(None)
                         break
-                    data_type, data = value
-
-                    if enabled:
-                        output_type, result = self.process(data_type, data)
-                        if self._propgate_input:
-                            self.pushOutput(*value)
+                    if not enabled:
+                        discard(value)
+                        continue
+                    value = receive(value)
+                    data_type, data = value[:2]
+
+                    self.__start_processing(value)
+                    output_type, result = self.process(data_type, data)
+                    self._metrics.record(self._process_start, self._input_bytes)
+                    if self._propgate_input:
+                        self.pushOutput(data_type, data)
                 else:
                     if enabled:
+                        self.__start_processing()
                         output_type, result = self.process()
+                        self._metrics.record(self._process_start, self._input_bytes)
                     else:
                         self.debug("I AM LEAVING")
                         break
@@ -200,13 +319,40 @@ class BasePipelineObject(multiprocessing.Process, ProcessLogger):
                 self.error(e, exc_info=True)
                 self.error(traceback.format_exc())
                 break
+
+    def run(self):
+        self.pre_run()
+        if self.input_queue is not None and self._batch_size > 1:
+            self.__run_batches()
+        else:
+            self.__run_messages()
         output_type, result = self.post_run()
         if output_type is not None and result is not None:
             self.pushOutput(output_type, result)
+        self._metrics.store()
 
         self.info("Job complete")
 
 
+def _merge(values):
+    """Concatenate the columns of consecutive PixelData or EventData messages
+
+    A merged message keeps the trace of its first, i.e. oldest, part."""
+    merged = []  # data type, data of the messages, whether they can be merged, trace
+    for value in values:
+        data_type, data = value[:2]
+        mergeable = data_type in _MERGEABLE and isinstance(data, tuple)
+        if mergeable and merged and merged[-1][2] and merged[-1][0] == data_type:
+            merged[-1][1].append(data)
+        else:
+            merged.append((data_type, [data], mergeable, tuple(value[2:])))
+    return [
+        (data_type, parts[0] if len(parts) == 1 else tuple(np.concatenate(columns) for columns in zip(*parts)))
+        + trace
+        for data_type, parts, _, trace in merged
+    ]
+
+
 def main():
     import logging
     import time
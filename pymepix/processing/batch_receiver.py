@@ -0,0 +1,271 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Receiving UDP datagrams, several with one system call (Linux recvmmsg), and counting kernel drops"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import sys
+
+_MSG_DONTWAIT = 0x40
+_MSG_TRUNC = 0x20
+# Linux socket option adding the number of datagrams dropped by the kernel to the received messages
+_SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+_DROP_COUNTER_SIZE = ctypes.sizeof(ctypes.c_uint32)
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IoVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class _CMsgHdr(ctypes.Structure):
+    _fields_ = [("cmsg_len", ctypes.c_size_t), ("cmsg_level", ctypes.c_int), ("cmsg_type", ctypes.c_int)]
+
+
+def _load_recvmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+_recvmmsg = _load_recvmmsg()
+
+
+def recvmmsg_available():
+    """Whether the C library provides recvmmsg"""
+    return _recvmmsg is not None
+
+
+def enable_drop_counter(sock):
+    """Let the kernel report the datagrams it dropped for the socket (SO_RXQ_OVFL), returns if supported"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, _SO_RXQ_OVFL, 1)
+    except OSError:
+        return False
+    return True
+
+
+class DatagramReceiver:
+    """Receives one datagram per call into a buffer like socket.recv_into
+
+    Counts the received datagrams and reads the number of datagrams dropped by the kernel if
+    enable_drop_counter was used for the socket. The kernel reports the total number of drops with
+    the next datagram queued after them. Reading it needs the slower recvmsg_into, so it is only
+    read with every drop_check_interval-th datagram and with the first one after a timeout. The
+    other datagrams are received with plain recv_into.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Bound UDP socket
+    drop_counter : bool
+        Whether enable_drop_counter succeeded for the socket, otherwise kernel_drops stays 0
+    drop_check_interval : int
+        Number of datagrams after which the drop counter is read again
+    """
+
+    def __init__(self, sock, drop_counter=True, drop_check_interval=64):
+        self._sock = sock
+        self._drop_counter = drop_counter
+        self._drop_check_interval = drop_check_interval
+        self._next_drop_check = 0
+        self.datagrams = 0
+        self.kernel_drops = 0
+
+    def recv_into(self, buffer):
+        if self._drop_counter and self.datagrams >= self._next_drop_check:
+            size, ancillary_data, _, _ = self._sock.recvmsg_into([buffer], socket.CMSG_SPACE(_DROP_COUNTER_SIZE))
+            for level, kind, data in ancillary_data:
+                if level == socket.SOL_SOCKET and kind == _SO_RXQ_OVFL:
+                    self.kernel_drops = int.from_bytes(data[:_DROP_COUNTER_SIZE], sys.byteorder)
+            self.datagrams += 1
+            self._next_drop_check = self.datagrams + self._drop_check_interval
+            return size
+        try:
+            size = self._sock.recv_into(buffer)
+        except socket.timeout:
+            # the drops of a burst are reported once the socket was idle
+            self._next_drop_check = self.datagrams
+            raise
+        self.datagrams += 1
+        return size
+
+
+class BatchReceiver:
+    """Receives up to batch_size datagrams of a UDP socket into a buffer with one recvmmsg call
+
+    Waits for the first datagram with the timeout of the socket and takes all further datagrams
+    which are already queued in the kernel without waiting. The datagrams are stored back to back
+    in the buffer, as by consecutive recv_into calls. Counts the datagrams and the datagrams dropped
+    by the kernel as DatagramReceiver.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Bound UDP socket
+    batch_size : int
+        Maximum number of datagrams per call
+    max_datagram_size : int
+        Maximum size of a datagram in bytes. Longer datagrams are truncated and raise an OSError.
+    """
+
+    def __init__(self, sock, batch_size=64, max_datagram_size=9_000):
+        if _recvmmsg is None:
+            raise OSError(errno.ENOSYS, "recvmmsg is not available")
+        self._sock = sock
+        self._batch_size = batch_size
+        self._max_datagram_size = max_datagram_size
+        self._iovecs = (_IoVec * batch_size)()
+        self._messages = (_MMsgHdr * batch_size)()
+        self._control_size = socket.CMSG_SPACE(_DROP_COUNTER_SIZE)
+        self._control = ctypes.create_string_buffer(batch_size * self._control_size)
+        for index in range(batch_size):
+            self._messages[index].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[index])
+            self._messages[index].msg_hdr.msg_iovlen = 1
+            self._messages[index].msg_hdr.msg_control = ctypes.addressof(self._control) + index * self._control_size
+        self.datagrams = 0
+        self.kernel_drops = 0
+        self._poll = select.poll()
+        self._poll.register(sock.fileno(), select.POLLIN)
+
+    def recv_into(self, buffer):
+        """Receive datagrams into the writable buffer, returns the number of bytes
+
+        Raises
+        ------
+        socket.timeout
+            If no datagram arrives within the timeout of the socket
+        """
+        timeout = self._sock.gettimeout()
+        if not self._poll.poll(None if timeout is None else timeout * 1_000):
+            raise socket.timeout("timed out")
+
+        size = len(buffer)
+        count = min(self._batch_size, size // self._max_datagram_size)
+        if count == 0:
+            # not enough space left for a full batch
+            self.datagrams += 1
+            return self._sock.recv_into(buffer)
+
+        base = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+        for index in range(count):
+            self._iovecs[index].iov_base = base + index * self._max_datagram_size
+            self._iovecs[index].iov_len = self._max_datagram_size
+            self._messages[index].msg_hdr.msg_controllen = self._control_size
+        received = _recvmmsg(self._sock.fileno(), self._messages, count, _MSG_DONTWAIT, None)
+        if received < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise socket.timeout("timed out")
+            raise OSError(error, os.strerror(error))
+
+        # move the datagrams together, they were received at multiples of max_datagram_size
+        position = 0
+        for index in range(received):
+            message = self._messages[index]
+            if message.msg_hdr.msg_flags & _MSG_TRUNC:
+                raise OSError(errno.EMSGSIZE, "Datagram longer than {} bytes".format(self._max_datagram_size))
+            length = message.msg_len
+            start = index * self._max_datagram_size
+            if start != position:
+                ctypes.memmove(base + position, base + start, length)
+            position += length
+        self.datagrams += received
+        self.__read_drop_counter(self._messages[received - 1].msg_hdr)
+        return position
+
+    def __read_drop_counter(self, header):
+        # the kernel only adds the counter once datagrams have been dropped
+        if header.msg_controllen < ctypes.sizeof(_CMsgHdr) + _DROP_COUNTER_SIZE:
+            return
+        cmsg = _CMsgHdr.from_address(header.msg_control)
+        if cmsg.cmsg_level == socket.SOL_SOCKET and cmsg.cmsg_type == _SO_RXQ_OVFL:
+            self.kernel_drops = ctypes.c_uint32.from_address(header.msg_control + ctypes.sizeof(_CMsgHdr)).value
+
+
+def main():
+    """Time per datagram of the receivers, with and without reading the kernel drop counter
+
+    The datagrams are queued in the socket before they are received, so only the receiving is timed.
+
+    Usage: python -m pymepix.processing.batch_receiver [number of datagrams]
+    """
+    import sys
+    import time
+
+    datagrams = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    datagram_size, queued = 139 * 8, 50
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1.0)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = bytes(datagram_size)
+    buffer = bytearray(queued * datagram_size)
+    drop_counter = enable_drop_counter(sock)
+
+    receivers = {
+        "recv_into": DatagramReceiver(sock, drop_counter=False),
+        "drop counter every datagram": DatagramReceiver(sock, drop_counter, drop_check_interval=1),
+        "drop counter every 64 datagrams": DatagramReceiver(sock, drop_counter),
+    }
+    if recvmmsg_available():
+        receivers[f"recvmmsg, up to {queued} per call"] = BatchReceiver(sock, queued, datagram_size)
+    for name, receiver in receivers.items():
+        elapsed = 0.0
+        while receiver.datagrams < datagrams:
+            for _ in range(queued):
+                sender.sendto(payload, sock.getsockname())
+            target = receiver.datagrams + queued
+            start = time.perf_counter()
+            while receiver.datagrams < target:
+                receiver.recv_into(buffer)
+            elapsed += time.perf_counter() - start
+        print(f"{name:32s}: {elapsed / receiver.datagrams * 1e9:6.0f} ns per datagram")
+    sender.close()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
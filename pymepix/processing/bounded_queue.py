@@ -0,0 +1,183 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Queue between pipeline stages with a maximum size and a policy for a full queue"""
+import queue
+from ctypes import c_int, c_uint64
+from enum import IntEnum
+from multiprocessing import Queue, Value
+
+import numpy as np
+
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.transport import SharedColumns, discard
+
+
+class OverflowPolicy(IntEnum):
+    """What is done with a message for a full BoundedQueue"""
+
+    Block = 0
+    """Wait until there is space, the slowdown propagates back to the UDP socket"""
+    DropOldest = 1
+    """Drop the oldest message of the queue"""
+    DropNewest = 2
+    """Drop the new message"""
+    DecimateTriggers = 3
+    """Keep the events of only every n-th trigger, n is doubled every time the queue is full and halved
+    once the queue has not been full for maxsize messages. Other messages block.
+
+    This makes the EventData messages smaller, so the consumer processes them faster, but not fewer.
+    If the consumer is limited by the number of messages rather than their size, combine it with the
+    batch_size of the consuming stage or use DropOldest."""
+
+
+class BoundedQueue:
+    """multiprocessing.Queue with a maximum size which handles full queues according to an OverflowPolicy
+
+    The None message ending a stage always blocks. The counters of dropped messages and triggers are shared
+    by all processes using the queue.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of messages in the queue
+    policy : OverflowPolicy
+    max_decimation : int
+        Largest trigger decimation for OverflowPolicy.DecimateTriggers
+    """
+
+    def __init__(self, maxsize, policy=OverflowPolicy.Block, max_decimation=64):
+        self._queue = Queue(maxsize)
+        self._maxsize = maxsize
+        self._policy = OverflowPolicy(policy)
+        self._max_decimation = max_decimation
+        self._dropped_messages = Value(c_uint64, 0)
+        self._dropped_triggers = Value(c_uint64, 0)
+        self._decimation = Value(c_int, 1)
+        self._puts_since_full = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def dropped_messages(self):
+        """Number of messages dropped because the queue was full"""
+        return self._dropped_messages.value
+
+    @property
+    def dropped_triggers(self):
+        """Number of triggers whose events were removed by the trigger decimation"""
+        return self._dropped_triggers.value
+
+    @property
+    def decimation(self):
+        """Current trigger decimation, 1 if all triggers are kept"""
+        return self._decimation.value
+
+    def put(self, value, block=True, timeout=None):
+        if value is None or self._policy == OverflowPolicy.Block:
+            self._queue.put(value, block, timeout)
+        elif self._policy == OverflowPolicy.DecimateTriggers:
+            self._queue.put(self.__decimate(value), block, timeout)
+        else:
+            self.__put_or_drop(value)
+
+    def put_nowait(self, value):
+        self._queue.put_nowait(value)
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def empty(self):
+        return self._queue.empty()
+
+    def full(self):
+        return self._queue.full()
+
+    def close(self):
+        self._queue.close()
+
+    def join_thread(self):
+        self._queue.join_thread()
+
+    def __count_dropped(self, counter, number):
+        with counter.get_lock():
+            counter.value += number
+
+    def __put_or_drop(self, value):
+        while True:
+            try:
+                self._queue.put_nowait(value)
+                return
+            except queue.Full:
+                pass
+            if self._policy == OverflowPolicy.DropNewest:
+                discard(value)
+                self.__count_dropped(self._dropped_messages, 1)
+                return
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            if oldest is None:
+                # the stage is ending, its end marker must not be lost
+                self._queue.put(None)
+                discard(value)
+                self.__count_dropped(self._dropped_messages, 1)
+                return
+            discard(oldest)
+            self.__count_dropped(self._dropped_messages, 1)
+
+    def __decimate(self, value):
+        decimation = self._decimation.value
+        if self._queue.full():
+            self._puts_since_full = 0
+            decimation = min(2 * decimation, self._max_decimation)
+        else:
+            self._puts_since_full += 1
+            if self._puts_since_full >= self._maxsize and decimation > 1:
+                self._puts_since_full = 0
+                decimation //= 2
+        self._decimation.value = decimation
+
+        data_type = value[0]
+        if decimation == 1 or data_type != MessageType.EventData:
+            return value
+        shared = isinstance(value[1], SharedColumns)
+        event_data = value[1].load() if shared else value[1]
+        shot = event_data[0]
+        keep = shot % decimation == 0
+        self.__count_dropped(self._dropped_triggers, np.unique(shot[~keep]).shape[0])
+        event_data = tuple(column[keep] for column in event_data)
+        if shared:
+            # as sent by the stage, the columns are not pickled when the queue is full
+            event_data = SharedColumns.store(event_data)
+        # the latency trace, if any, stays with the message
+        return (data_type, event_data) + tuple(value[2:])
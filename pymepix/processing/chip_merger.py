@@ -0,0 +1,166 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Merging the hits of several Timepix chips into one time-ordered stream"""
+import heapq
+
+import numpy as np
+
+from .logic.packet_processor import PacketProcessor, PixelOrientation
+from .raw_compression import open_raw
+from .raw_index import HeartbeatIndex
+
+# longest time in 25 ns units decoded with the time of one heartbeat, well within the range which
+# PacketProcessor.correct_global_time can unwrap
+_MAX_SPAN = 0x4000000
+
+
+def _heartbeat_groups(index, block_size):
+    """Ranges [first, last) of heartbeats whose data is decoded together"""
+    first = 0
+    while first < len(index):
+        last = first + 1
+        while (
+            last < len(index)
+            and index.offsets[last] - index.offsets[first] < block_size
+            and abs(int(index.longtimes[last]) - int(index.longtimes[first])) < _MAX_SPAN
+        ):
+            last += 1
+        yield first, last
+        first = last
+
+
+def raw_file_hits(file_name, block_size=1 << 20, orientation=PixelOrientation.Up, timewalk_lut=None):
+    """Decoded hits (x, y, toa, tot) of a raw file in blocks of about block_size words
+
+    The data of consecutive heartbeats is decoded together with the time of the first heartbeat.
+    Data before the first heartbeat is dropped as in RawFileSampler. The hits of each block are
+    sorted by toa. Uses the heartbeat index of the file, see HeartbeatIndex.
+    """
+    packet_processor = PacketProcessor(handle_events=False, orientation=orientation, timewalk_lut=timewalk_lut)
+    index = HeartbeatIndex.load(file_name)
+    with open_raw(file_name) as file:
+        for first, last in _heartbeat_groups(index, block_size):
+            file.seek(8 + int(index.offsets[first]) * 8)
+            size = (int(index.offsets[last]) - int(index.offsets[first])) * 8 if last < len(index) else -1
+            data = file.read(size)
+            words = np.frombuffer(data, dtype="<u8", count=len(data) // 8)
+            pixel_data, _ = packet_processor.decode(np.append(words, np.uint64(index.longtimes[first])).tobytes())
+            if pixel_data is not None:
+                order = np.argsort(pixel_data[2], kind="stable")
+                yield tuple(column[order] for column in pixel_data)
+
+
+class ChipMerger:
+    """Merges the hit blocks of several chips into blocks of hits ordered by time of arrival
+
+    Each chip provides an iterable of hit blocks (x, y, toa, tot), e.g. raw_file_hits of its raw file
+    or the PixelData of its pipeline, in which the hits arrive in order up to max_disorder seconds.
+    The position offset of each chip (TimepixDevice.pixelOffsetCoords) is added to x and y.
+
+    The chips are read with a heap ordered by the time up to which each chip is complete, always
+    refilling the chip which is furthest behind. All hits before the earliest of these times are
+    emitted sorted, so only about one block per chip is held in memory.
+
+    Parameters
+    ----------
+    streams : list of iterables of (x, y, toa, tot)
+        Hit blocks of each chip
+    offsets : list of (int, int), optional
+        Position offsets of the chips in pixels (Default: no offset)
+    max_disorder : float
+        Time in seconds by which hits of a chip can arrive later than hits of previous blocks
+
+    Yields
+    ------
+    (chip, x, y, toa, tot)
+        Hits ordered by toa, chip is the index of the stream
+    """
+
+    def __init__(self, streams, offsets=None, max_disorder=0.0):
+        self._streams = [iter(stream) for stream in streams]
+        self._offsets = offsets if offsets is not None else [(0, 0)] * len(self._streams)
+        self._max_disorder = max_disorder
+        if len(self._offsets) != len(self._streams):
+            raise ValueError("{} offsets for {} chips".format(len(self._offsets), len(self._streams)))
+
+    def __iter__(self):
+        pending = [[] for _ in self._streams]
+        heap = [(-np.inf, chip) for chip in range(len(self._streams))]
+        heapq.heapify(heap)
+        while heap:
+            complete, chip = heapq.heappop(heap)
+            block = next(self._streams[chip], None)
+            if block is not None:
+                pending[chip].append(self.__with_chip(chip, block))
+                complete = max(complete, np.max(block[2], initial=-np.inf) - self._max_disorder)
+                heapq.heappush(heap, (complete, chip))
+            horizon = heap[0][0] if heap else np.inf
+            merged = self.__take(pending, horizon)
+            if merged is not None:
+                yield merged
+
+    def __with_chip(self, chip, block):
+        x, y, toa, tot = block[:4]
+        x_offset, y_offset = self._offsets[chip]
+        return np.full(toa.shape[0], chip, dtype=np.uint8), x + x_offset, y + y_offset, toa, tot
+
+    @staticmethod
+    def __take(pending, horizon):
+        """Hits of all chips up to horizon, sorted by toa, the rest stays pending"""
+        parts = []
+        for chip, blocks in enumerate(pending):
+            if not blocks:
+                continue
+            columns = [np.concatenate(column) for column in zip(*blocks)] if len(blocks) > 1 else list(blocks[0])
+            done = columns[3] <= horizon
+            parts.append([column[done] for column in columns])
+            pending[chip] = [tuple(column[~done] for column in columns)] if not done.all() else []
+        parts = [part for part in parts if part[0].shape[0] > 0]
+        if not parts:
+            return None
+        columns = [np.concatenate(column) for column in zip(*parts)]
+        order = np.argsort(columns[3], kind="stable")
+        return tuple(column[order] for column in columns)
+
+
+def main():
+    """Merge the raw files of several chips, compared with sorting all hits in memory
+
+    Usage: python -m pymepix.processing.chip_merger <raw file> <raw file> ...
+    """
+    import sys
+    import time
+
+    files = sys.argv[1:]
+    start = time.perf_counter()
+    hits, peak = 0, 0
+    for block in ChipMerger([raw_file_hits(file_name) for file_name in files], max_disorder=1e-6):
+        hits += block[0].shape[0]
+        peak = max(peak, block[0].shape[0])
+    print("merged {} hits in {:.2f} s, largest block {} hits".format(hits, time.perf_counter() - start, peak))
+
+    start = time.perf_counter()
+    columns = [np.concatenate(column) for column in zip(*(block for file_name in files for block in raw_file_hits(file_name)))]
+    np.argsort(columns[2], kind="stable")
+    print("sorted {} hits in memory in {:.2f} s".format(columns[0].shape[0], time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
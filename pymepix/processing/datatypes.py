@@ -39,3 +39,5 @@ class MessageType(IntEnum):
     """Open File message"""
     CloseFileCommand = 5
     """Close File Message"""
+    DecodedData = 9
+    """Sequence number, decoded pixels and triggers of a chunk for the event builder"""
@@ -0,0 +1,216 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Buffered writing of the post-processing results to HDF5"""
+import queue
+import threading
+
+import h5py
+import numpy as np
+
+from pymepix.core.log import Logger
+
+
+class _Hdf5Group:
+    """Description of a group of equally long datasets and the rows buffered for it"""
+
+    def __init__(self, path, attrs, names, dtypes, units, descriptions, parent_attrs=None):
+        self.path = path
+        self.attrs = attrs
+        self.names = names
+        self.dtypes = list(dtypes)
+        self.units = units
+        self.descriptions = descriptions
+        self.parent_attrs = parent_attrs
+        self.buffer = [[] for _ in names]
+        self.rows = 0
+        self.created = False
+
+    def append(self, columns):
+        for index in range(len(self.names)):
+            column = np.asarray(columns[index])
+            if self.dtypes[index] is None:
+                # the first data determines the dtype, as for datasets created from data
+                self.dtypes[index] = column.dtype
+            self.buffer[index].append(column.astype(self.dtypes[index], copy=False))
+        self.rows += len(columns[0])
+
+    def take(self):
+        columns = [np.concatenate(column) for column in self.buffer]
+        self.buffer = [[] for _ in self.names]
+        self.rows = 0
+        return columns
+
+
+class Hdf5Writer(Logger):
+    """Writes raw events, centroids and timestamps of the post-processing into one HDF5 file
+
+    The file is kept open until close is called. Rows are collected in memory and written in batches
+    of at least buffer_size rows by a background thread, so processing continues while the data is
+    written. Each dataset is resized only once per batch. The datasets, attributes and dtypes are the
+    same as of RawFileSampler.saveToHDF5 before.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file, an existing file is appended to
+    buffer_size : int
+        Number of raw event rows collected before a batch is written
+    chunk_size : int
+        Number of rows of one HDF5 chunk
+    compression : str
+        HDF5 compression filter of the datasets, e.g. "gzip" or "lzf". No compression by default.
+    compression_opts
+        Options of the compression filter, e.g. the gzip level
+    """
+
+    def __init__(self, file_name, buffer_size=1 << 20, chunk_size=1 << 16, compression=None, compression_opts=None):
+        super().__init__("Hdf5Writer")
+        self._file_name = file_name
+        self._buffer_size = buffer_size
+        self._chunk_size = chunk_size
+        self._compression = compression
+        self._compression_opts = compression_opts
+
+        self._groups = {
+            "centroided": _Hdf5Group(
+                "centroided",
+                {"description": "centroided events", "nr events": 0},
+                ["trigger nr", "x", "y", "tof", "tot avg", "tot max", "clustersize"],
+                [None] * 7,
+                {"tot max": "s", "tot avg": "s", "tof": "s", "x": "pixel", "y": "pixel"},
+                {
+                    "tot max": "maximum of time above threshold in cluster",
+                    "tot avg": "mean of time above threshold in cluster",
+                },
+            ),
+            "raw": _Hdf5Group(
+                "raw",
+                {"description": "timewalk correted raw events", "nr events": 0},
+                ["trigger nr", "x", "y", "tof", "tot"],
+                [np.uint64, np.uint8, np.uint8, None, np.uint32],
+                {"tof": "s", "tot": "s", "x": "pixel", "y": "pixel"},
+                {},
+            ),
+            "timing": _Hdf5Group(
+                "timing/timepix",
+                {"description": "timing information from TimePix", "nr events": 0},
+                ["trigger nr", "timestamp"],
+                [np.uint64, np.uint64],
+                {"timestamp": "ns"},
+                {},
+                parent_attrs={"description": "timing information from TimePix and facility"},
+            ),
+        }
+
+        self._file = h5py.File(file_name, "a")
+        self._batches = queue.Queue(maxsize=2)
+        self._exception = None
+        self._thread = threading.Thread(target=self._write_batches, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, raw=None, centroids=None, timestamps=None):
+        """Add the data of one processed packet, None is ignored
+
+        Parameters
+        ----------
+        raw : (trigger nr, x, y, tof, tot)
+        centroids : (trigger nr, x, y, tof, tot avg, tot max, clustersize)
+        timestamps : (trigger nr, timestamp)
+        """
+        self.__raise_exception()
+        for key, columns in (("centroided", centroids), ("raw", raw), ("timing", timestamps)):
+            if columns is not None:
+                self._groups[key].append(columns)
+
+        if any(group.rows >= self._buffer_size for group in self._groups.values()):
+            self.flush()
+
+    def flush(self):
+        """Hand all buffered rows to the writing thread"""
+        batch = []
+        for group in self._groups.values():
+            if group.rows > 0 or (group.buffer[0] and not group.created):
+                batch.append((group, group.take()))
+                group.created = True
+        if batch:
+            self._batches.put(batch)
+
+    def close(self):
+        """Write the remaining rows, wait for the writing thread and close the file"""
+        if self._file is None:
+            return
+        self.flush()
+        self._batches.put(None)
+        self._thread.join()
+        self._file.close()
+        self._file = None
+        self.__raise_exception()
+
+    def __raise_exception(self):
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise exception
+
+    def _write_batches(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                break
+            if self._exception is not None:
+                continue
+            try:
+                for group, columns in batch:
+                    self.__write_group(group, columns)
+            except Exception as e:
+                self.error("Writing to {} failed: {}".format(self._file_name, str(e)))
+                self._exception = e
+
+    def __write_group(self, group, columns):
+        if group.path in self._file:
+            size = columns[0].shape[0]
+            for name, column in zip(group.names, columns):
+                dataset = self._file[group.path][name]
+                dataset.resize(dataset.shape[0] + size, axis=0)
+                dataset[-size:] = column
+            return
+
+        h5_group = self._file.create_group(group.path)
+        if group.parent_attrs is not None:
+            h5_group.parent.attrs.update(group.parent_attrs)
+        h5_group.attrs.update(group.attrs)
+        for name, column in zip(group.names, columns):
+            dataset = h5_group.create_dataset(
+                name,
+                data=column,
+                maxshape=(None,),
+                chunks=(self._chunk_size,),
+                compression=self._compression,
+                compression_opts=self._compression_opts,
+            )
+            if name in group.units:
+                dataset.attrs["unit"] = group.units[name]
+            if name in group.descriptions:
+                dataset.attrs["description"] = group.descriptions[name]
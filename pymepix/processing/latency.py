@@ -0,0 +1,114 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""End-to-end latency of the pipeline messages, from the reception of their UDP chunk to the consumer"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from pymepix.processing.datatypes import MessageType
+
+
+class LatencyTracker:
+    """Rolling latency percentiles per MessageType
+
+    With latency tracing enabled (e.g. PixelPipeline(latency_tracing=True)) the messages of the
+    data queue are (data_type, data, (sequence, receive_time)), where receive_time is the
+    time.monotonic() at which the UdpSampler received the first datagram of the chunk. The clock is
+    the same in all processes of the machine, so the latency is the time since then.
+
+    Parameters
+    ----------
+    window : int
+        Number of latest messages per type used for the percentiles
+    """
+
+    def __init__(self, window=1_000):
+        self._window = window
+        self._latencies = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, data_type, trace, now=None):
+        """Record the latency of a message with the trace (sequence, receive time) of its chunk"""
+        _, receive_time = trace
+        latency = (time.monotonic() if now is None else now) - receive_time
+        with self._lock:
+            if data_type not in self._latencies:
+                self._latencies[data_type] = deque(maxlen=self._window)
+                self._counts[data_type] = 0
+            self._latencies[data_type].append(latency)
+            self._counts[data_type] += 1
+
+    def record(self, value):
+        """Record the latency of a received message if it carries a trace, returns (data_type, data)"""
+        if len(value) > 2:
+            self.add(value[0], value[2])
+        return value[0], value[1]
+
+    def reset(self):
+        with self._lock:
+            self._latencies = {}
+            self._counts = {}
+
+    def report(self):
+        """Latency in seconds of the latest messages by type name
+
+        Returns
+        -------
+        dict
+            {name: {"count": messages since the reset, "p50": ..., "p99": ..., "max": ...}}
+        """
+        with self._lock:
+            latencies = {data_type: np.array(values) for data_type, values in self._latencies.items()}
+            counts = dict(self._counts)
+        report = {}
+        for data_type, values in latencies.items():
+            p50, p99 = np.percentile(values, [50, 99])
+            report[_name(data_type)] = {
+                "count": counts[data_type],
+                "p50": float(p50),
+                "p99": float(p99),
+                "max": float(values.max()),
+            }
+        return report
+
+
+def _name(data_type):
+    try:
+        return MessageType(data_type).name
+    except ValueError:
+        return str(data_type)
+
+
+def main():
+    tracker = LatencyTracker(window=10_000)
+    rng = np.random.default_rng(0)
+    now = time.monotonic()
+    for sequence, delay in enumerate(rng.exponential(1e-3, 100_000)):
+        tracker.add(MessageType.EventData, (sequence, now - delay), now=now)
+    start = time.perf_counter()
+    report = tracker.report()
+    print("report in {:.2f} ms: {}".format((time.perf_counter() - start) * 1e3, report))
+
+
+if __name__ == "__main__":
+    main()
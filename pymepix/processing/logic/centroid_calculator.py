@@ -18,11 +18,14 @@
 # You should have received a copy of the GNU General Public License along with this program. If not,
 # see <https://www.gnu.org/licenses/>.
 import multiprocessing as mp
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
 
 import numpy as np
-import scipy.ndimage as nd
 from sklearn.cluster import DBSCAN
 
+from pymepix.processing.logic.grid_clustering import grid_dbscan
 from pymepix.processing.logic.processing_parameter import ProcessingParameter
 from pymepix.processing.logic.processing_step import ProcessingStep
 
@@ -48,6 +51,8 @@ class CentroidCalculator(ProcessingStep):
         triggers_processed=1,
         chunk_size_limit=6_500,
         cent_timewalk_lut=None,
+        clustering="dbscan",
+        adaptive_chunk_size=False,
         *args,
         **kwargs,
     ):
@@ -67,8 +72,14 @@ class CentroidCalculator(ProcessingStep):
             data rate is too high to process all triggers directly.
         chunk_size_limit : int
             Maximum size of the chunks to increase the performance of DBSCAN. Higher and Lower values might increase the runtime.
+            With adaptive_chunk_size this is the start value of the tuning.
         cent_timewalk_lut
             Data for correction of the time-walk
+        clustering : str
+            "dbscan" uses sklearn's DBSCAN, "grid" the equivalent clustering on the pixel grid (see
+            grid_clustering), which is about an order of magnitude faster.
+        adaptive_chunk_size : bool
+            Tune the chunk size while processing from the measured clustering time (see ChunkSizeTuner)
         parameter_wrapper_classe : ProcessingParameter
             Class used to wrap the processing parameters to make them changable while processing is running (useful for online optimization)
         """
@@ -82,6 +93,17 @@ class CentroidCalculator(ProcessingStep):
         self._chunk_size_limit = chunk_size_limit
         self._tof_scale = 1e7
         self._cent_timewalk_lut = cent_timewalk_lut
+        if clustering not in ("dbscan", "grid"):
+            raise ValueError("Unknown clustering {}, use 'dbscan' or 'grid'".format(clustering))
+        self._clustering = clustering
+        self._chunk_size_tuner = ChunkSizeTuner(chunk_size_limit) if adaptive_chunk_size else None
+
+    @property
+    def chunk_size_limit(self):
+        """Current chunk size limit, changes while processing with adaptive_chunk_size"""
+        if self._chunk_size_tuner is not None:
+            return self._chunk_size_tuner.limit
+        return self._chunk_size_limit
 
     @property
     def epsilon(self):
@@ -125,9 +147,12 @@ class CentroidCalculator(ProcessingStep):
         if data is not None:
             shot, x, y, tof, tot = self.__skip_triggers(*data)
             chunks = self.__divide_into_chunks(shot, x, y, tof, tot)
-            centroids_in_chunks = self.perform_centroiding(chunks)
+            start = time.perf_counter()
+            centroids = self.__centroid_chunks_to_centroids(self.perform_centroiding(chunks))
+            if self._chunk_size_tuner is not None:
+                self._chunk_size_tuner.update(shot.shape[0], time.perf_counter() - start)
 
-            return self.__centroid_chunks_to_centroids(centroids_in_chunks)
+            return centroids
         else:
             return None
 
@@ -157,39 +182,40 @@ class CentroidCalculator(ProcessingStep):
             return [(shot, x, y, tof, tot)]
 
     def __calc_trig_chunks_split_indices(self, shot):
-        _, unique_trig_nr_indices, unique_trig_nr_counts = np.unique(
-            shot, return_index=True, return_counts=True
-        )
+        """Start indices of the chunks in the sorted shots. Triggers are added to a chunk until it has at least
+        chunk_size_limit events, the cumulative sum of the events per trigger allows to find the end of each
+        chunk with a binary search instead of looping over all triggers."""
+        if shot.shape[0] == 0:
+            return []
+        trigger_end = np.append(np.flatnonzero(shot[1:] != shot[:-1]) + 1, shot.shape[0])
+        chunk_size_limit = self.__effective_chunk_size_limit(shot.shape[0])
+
+        split_indices = []
+        last_trigger = trigger_end.shape[0] - 1
+        chunk_end = np.searchsorted(trigger_end, chunk_size_limit)
+        while chunk_end < last_trigger:
+            split_indices.append(trigger_end[chunk_end])
+            chunk_end = np.searchsorted(trigger_end, trigger_end[chunk_end] + chunk_size_limit)
+        return split_indices
+
+    def __effective_chunk_size_limit(self, size):
+        if self._chunk_size_tuner is None:
+            return self._chunk_size_limit
+        return self._chunk_size_tuner.chunk_size_limit(size, self.number_of_workers)
 
-        trigger_chunks = []
-        trigger_chunk_voxel_counter = 0
-        for index, unique_trig_nr_index in enumerate(unique_trig_nr_indices):
-            if trigger_chunk_voxel_counter < self._chunk_size_limit:
-                trigger_chunk_voxel_counter += unique_trig_nr_counts[index]
-            else:
-                trigger_chunks.append(unique_trig_nr_index)
-                trigger_chunk_voxel_counter = unique_trig_nr_counts[index]
-
-        return trigger_chunks
+    @property
+    def number_of_workers(self):
+        """Number of processes clustering the chunks in parallel"""
+        return 1
 
     def __centroid_chunks_to_centroids(self, chunks):
-        # range(7) because the centroids have 7 dimensions: shot, x, y, tof, tot avg, tot max, cluster size
-        """centroids = [[] for i in range(7)]
-        for chunk in list(chunks):
-            if chunk != None:
-                for index, coordinate in enumerate(chunk):
-                    centroids[index].append(coordinate)"""
-
-        # list_chunks = list(chunks)
-        # TODO check if try catch is faster or if list_chunks[0] == None
-        # remember, that in 3.10 or 3.11 try catch should become less expensive
-        try:
-            joined_chunks = np.concatenate(list(chunks), axis=0)
-        except Exception as e:
-            self.debug(str(e))
-            joined_chunks = None
-
-        return joined_chunks
+        """Join the centroids of the chunks to one array with the 7 columns shot, x, y, tof, tot avg,
+        tot max and cluster size as rows. Chunks without centroids (None) are skipped."""
+        chunks = [chunk for chunk in chunks if chunk is not None]
+        if len(chunks) == 0:
+            return None
+
+        return np.concatenate(chunks, axis=1)
 
     def perform_centroiding(self, chunks):
         return map(self.calculate_centroids, chunks)
@@ -230,6 +256,9 @@ class CentroidCalculator(ProcessingStep):
             Discovering Clusters [p. 229-230] (https://www.aaai.org/Papers/KDD/1996/KDD96-037.pdf)
             A more specific explaination can be found here:
             https://stats.stackexchange.com/questions/306829/why-is-dbscan-deterministic"""
+        if self._clustering == "grid":
+            return grid_dbscan(shot, x, y, tof, self.epsilon, self.min_samples, self._tof_scale) + 1
+
         if x.size >= 0:
             X = np.column_stack(
                 (shot * self.epsilon * 1_000, x, y, tof * self._tof_scale)
@@ -264,33 +293,39 @@ class CentroidCalculator(ProcessingStep):
         can be about 10^-22 nano seconds.
 
         Currently this is issue exists only for the TOF-column as the other columns are integer-based values.
+
+        The sums are accumulated with np.bincount in the original order of the points, as by scipy.ndimage,
+        so the results equal those of the former scipy.ndimage based implementation. Of several points with
+        the maximum tot in a cluster the last one is taken for the trigger number.
         """
-        label_index, cluster_size = np.unique(labels, return_counts=True)
-        tot_max = np.array(
-            nd.maximum_position(tot, labels=labels, index=label_index)
-        ).flatten()
-
-        tot_sum = nd.sum(tot, labels=labels, index=label_index)
-        tot_mean = nd.mean(tot, labels=labels, index=label_index)
-        cluster_x = np.array(
-            nd.sum(x * tot, labels=labels, index=label_index) / tot_sum
-        ).flatten()
-        cluster_y = np.array(
-            nd.sum(y * tot, labels=labels, index=label_index) / tot_sum
-        ).flatten()
-        cluster_tof = np.array(
-            nd.sum(tof * tot, labels=labels, index=label_index) / tot_sum
-        ).flatten()
-        cluster_totMax = tot[tot_max]
-        cluster_totAvg = tot_mean
+        size = labels.shape[0]
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        cluster_start = np.flatnonzero(np.concatenate(([True], sorted_labels[1:] != sorted_labels[:-1])))
+        cluster_size = np.diff(np.append(cluster_start, size))
+        cluster = np.empty(size, dtype=np.intp)
+        cluster[order] = np.repeat(np.arange(cluster_start.shape[0]), cluster_size)
+
+        sorted_tot = tot[order]
+        cluster_totMax = np.maximum.reduceat(sorted_tot, cluster_start)
+        is_max = sorted_tot == np.repeat(cluster_totMax, cluster_size)
+        tot_max = order[np.maximum.reduceat(np.where(is_max, np.arange(size), -1), cluster_start)]
         cluster_shot = shot[tot_max]
 
+        tot_sum = np.bincount(cluster, weights=tot)
+        cluster_totAvg = tot_sum / cluster_size
+        weighted = np.empty(size, dtype=np.float64)
+        np.multiply(x, tot, out=weighted)
+        cluster_x = np.bincount(cluster, weights=weighted) / tot_sum
+        np.multiply(y, tot, out=weighted)
+        cluster_y = np.bincount(cluster, weights=weighted) / tot_sum
+        np.multiply(tof, tot, out=weighted)
+        cluster_tof = np.bincount(cluster, weights=weighted) / tot_sum
+
         if self._cent_timewalk_lut is not None:
             # cluster_tof -= self._timewalk_lut[(cluster_tot / 25).astype(np.int) - 1]
             # cluster_tof *= 1e6
-            cluster_tof -= (
-                self._cent_timewalk_lut[np.int(cluster_totMax // 25) - 1] * 1e3
-            )
+            cluster_tof -= self._cent_timewalk_lut[np.int_(cluster_totMax // 25) - 1] * 1e3
             # TODO: should totAvg not also be timewalk corrected?!
             # cluster_tof *= 1e-6
 
@@ -305,29 +340,205 @@ class CentroidCalculator(ProcessingStep):
         )
 
 
+class ChunkSizeTuner:
+    """Tunes the chunk size limit of the CentroidCalculator from the measured clustering time
+
+    The clustering cost grows faster than linear with the chunk size while every chunk adds a fixed
+    overhead, so there is an optimal chunk size depending on the hit density. After each processed
+    packet the throughput (events per second of clustering time) is compared to the one of the previous
+    packet. The limit keeps being changed by the step factor in the same direction while the throughput
+    improves and the direction is reversed otherwise. This follows changes of the hit density during a run.
+
+    Independent of the tuned value the chunks are made small enough that every worker gets at least
+    chunks_per_worker chunks of a packet, which keeps the load of the pool workers balanced.
+
+    Parameters
+    ----------
+    start_limit : int
+        Chunk size limit used for the first packet
+    min_limit, max_limit : int
+        Range of the tuned limit
+    step : float
+        Factor the limit is changed by after each packet
+    chunks_per_worker : int
+        Minimum number of chunks per worker if there are several workers
+    smoothing : float
+        Weight of the newest measurement in the moving average of the throughput
+    """
+
+    def __init__(self, start_limit=6_500, min_limit=500, max_limit=200_000, step=1.25, chunks_per_worker=2, smoothing=0.5):
+        self._limit = float(start_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._step = step
+        self._chunks_per_worker = chunks_per_worker
+        self._smoothing = smoothing
+        self._direction = 1
+        self._throughput = None
+
+    @property
+    def limit(self):
+        """Tuned chunk size limit"""
+        return int(self._limit)
+
+    def chunk_size_limit(self, size, number_of_workers=1):
+        """Chunk size limit for a packet of size events processed by number_of_workers processes"""
+        if number_of_workers <= 1:
+            return self.limit
+        balanced = -(-size // (number_of_workers * self._chunks_per_worker))
+        return max(min(self.limit, balanced), self._min_limit)
+
+    def update(self, size, elapsed):
+        """Take the clustering time of a packet of size events into account"""
+        if size == 0 or elapsed <= 0:
+            return
+        throughput = size / elapsed
+        if self._throughput is not None:
+            if throughput < self._throughput:
+                self._direction = -self._direction
+            throughput = self._smoothing * throughput + (1 - self._smoothing) * self._throughput
+        self._throughput = throughput
+        self._limit = min(max(self._limit * self._step**self._direction, self._min_limit), self._max_limit)
+
+
 class CentroidCalculatorPooled(CentroidCalculator):
 
     """
-    Parallelized implementation of CentroidCalculator using mp.Pool for parallelization.
+    Parallelized implementation of CentroidCalculator using a persistent mp.Pool for parallelization.
+
+    The worker processes are started once in pre_process and get their copy of the calculator only at
+    start-up. The chunks are copied into a shared memory block and the workers only receive the offset
+    and length of their chunk. The centroids are written by the workers into a shared output block at the
+    offset of the chunk, so no event data is pickled in either direction. Both blocks grow as needed.
+
+    The pool has to be created in a non-daemonic process, e.g. in the main process. The processes of the
+    acquisition pipeline are daemonic and can't start a pool.
     """
 
     def __init__(self, number_of_processes=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._number_of_processes = number_of_processes
+        self._pool = None
+        self._input = None
+        self._output = None
+
+    @property
+    def number_of_workers(self):
+        return self._number_of_processes or os.cpu_count()
 
     def perform_centroiding(self, chunks):
-        return self._pool.map(self.calculate_centroids, chunks)
+        chunks = list(chunks)
+        sizes = [chunk[0].shape[0] for chunk in chunks]
+        offsets = np.cumsum([0] + sizes)
+        dtypes = tuple(column.dtype.str for column in chunks[0])
+        self.__reserve(offsets[-1], dtypes)
+
+        columns = _shared_columns(self._input, self._input_capacity, dtypes)
+        for offset, chunk in zip(offsets, chunks):
+            for column, chunk_column in zip(columns, chunk):
+                column[offset : offset + chunk_column.shape[0]] = chunk_column
+        del columns
+
+        parameters = (self.epsilon, self.min_samples, self.tot_threshold)
+        tasks = [
+            (self._input.name, self._output.name, self._input_capacity, dtypes, offset, size, parameters)
+            for offset, size in zip(offsets, sizes)
+        ]
+        counts = self._pool.map(_calculate_centroids_shared, tasks)
+
+        output = np.ndarray((7, self._input_capacity), dtype=np.float64, buffer=self._output.buf)
+        return [
+            output[:, offset : offset + count] if count > 0 else None for offset, count in zip(offsets, counts)
+        ]
+
+    def __reserve(self, size, dtypes):
+        """Make sure the shared blocks can hold size events of the given dtypes"""
+        if self._input is not None and size <= self._input_capacity and dtypes == self._input_dtypes:
+            return
+        capacity = max(size, 2 * self._input_capacity if self._input is not None else 1 << 16)
+        self.__release_blocks()
+        self._input = shared_memory.SharedMemory(
+            create=True, size=capacity * sum(np.dtype(dtype).itemsize for dtype in dtypes)
+        )
+        self._output = shared_memory.SharedMemory(create=True, size=capacity * 7 * np.dtype(np.float64).itemsize)
+        self._input_capacity = capacity
+        self._input_dtypes = dtypes
+
+    def __release_blocks(self):
+        for block in (self._input, self._output):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self._input = None
+        self._output = None
 
     def pre_process(self):
-        self._pool = mp.Pool(self._number_of_processes)
+        # the workers have to share the resource tracker of this process, otherwise their own
+        # trackers unlink the shared blocks when the workers exit
+        resource_tracker.ensure_running()
+        self._pool = mp.Pool(self._number_of_processes, initializer=_init_pooled_worker, initargs=(self,))
         return super().pre_process()
 
     def post_process(self):
         self._pool.close()
         self._pool.join()
+        self._pool = None
+        self.__release_blocks()
         return super().post_process()
 
     def __getstate__(self):
         self_dict = self.__dict__.copy()
-        del self_dict["_pool"]
+        for key in ["_pool", "_input", "_output"]:
+            self_dict[key] = None
         return self_dict
+
+
+def _shared_columns(block, capacity, dtypes):
+    """Views of the columns shot, x, y, tof and tot stored one after another in the shared block"""
+    columns = []
+    position = 0
+    for dtype in dtypes:
+        columns.append(np.ndarray((capacity,), dtype=dtype, buffer=block.buf, offset=position))
+        position += capacity * np.dtype(dtype).itemsize
+    return columns
+
+
+# state of the processes of CentroidCalculatorPooled
+_pooled_calculator = None
+_pooled_blocks = {}
+
+
+def _init_pooled_worker(calculator):
+    global _pooled_calculator
+    _pooled_calculator = calculator
+
+
+def _attach_block(name):
+    """Attach to the shared block, dropping the blocks replaced by the main process"""
+    if name not in _pooled_blocks:
+        block = shared_memory.SharedMemory(name=name)
+        if len(_pooled_blocks) >= 2:
+            for old_name in list(_pooled_blocks):
+                _pooled_blocks.pop(old_name).close()
+        _pooled_blocks[name] = block
+    return _pooled_blocks[name]
+
+
+def _calculate_centroids_shared(task):
+    input_name, output_name, capacity, dtypes, offset, size, parameters = task
+    calculator = _pooled_calculator
+    calculator.epsilon, calculator.min_samples, calculator.tot_threshold = parameters
+
+    input_block = _attach_block(input_name)
+    output_block = _attach_block(output_name)
+    chunk = [column[offset : offset + size] for column in _shared_columns(input_block, capacity, dtypes)]
+    centroids = calculator.calculate_centroids(chunk)
+    del chunk
+    if centroids is None:
+        return 0
+
+    count = centroids[0].shape[0]
+    output = np.ndarray((7, capacity), dtype=np.float64, buffer=output_block.buf)
+    for row, column in zip(output, centroids):
+        row[offset : offset + count] = column
+    return count
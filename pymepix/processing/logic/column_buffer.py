@@ -0,0 +1,115 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+import numpy as np
+
+
+class ColumnBuffer:
+    """Growable struct-of-arrays buffer with head and tail indices.
+
+    Rows are appended at the tail and consumed from the head. The storage grows by doubling and
+    space of consumed rows is reclaimed by moving the live rows to the front, so that appending
+    copies every row only an amortized constant number of times (in contrast to np.append, which
+    copies the complete buffer for every call).
+
+    Parameters
+    ----------
+    dtypes : list of numpy dtypes
+        One entry per column
+    capacity : int
+        Initial number of rows that can be stored without reallocation
+    """
+
+    def __init__(self, dtypes, capacity=1024):
+        self._dtypes = [np.dtype(dtype) for dtype in dtypes]
+        self._columns = [np.empty(capacity, dtype=dtype) for dtype in self._dtypes]
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def capacity(self):
+        return self._columns[0].shape[0]
+
+    @property
+    def columns(self):
+        """Views of the live rows of all columns. Views become invalid after the next append."""
+        return tuple(column[self._head : self._tail] for column in self._columns)
+
+    def column(self, index):
+        """View of the live rows of a single column. The view becomes invalid after the next append."""
+        return self._columns[index][self._head : self._tail]
+
+    def append(self, *columns):
+        """Append rows to the tail. All columns must have the same length."""
+        size = len(columns[0])
+        self._reserve(size)
+        for column, data in zip(self._columns, columns):
+            column[self._tail : self._tail + size] = data
+        self._tail += size
+
+    def consume(self, size):
+        """Drop the first size rows"""
+        self._head = min(self._head + int(size), self._tail)
+        if self._head == self._tail:
+            self._head = self._tail = 0
+
+    def keep(self, mask):
+        """Keep only the live rows selected by mask, preserving their order"""
+        kept = 0
+        for column in self._columns:
+            data = column[self._head : self._tail][mask]
+            kept = data.shape[0]
+            column[:kept] = data
+        self._head = 0
+        self._tail = kept
+
+    def take(self, mask=None):
+        """Return copies of the live rows selected by mask (all rows if mask is None)"""
+        if mask is None:
+            return tuple(np.copy(column) for column in self.columns)
+        return tuple(column[mask] for column in self.columns)
+
+    def clear(self):
+        self._head = 0
+        self._tail = 0
+
+    def _reserve(self, size):
+        if self._tail + size <= self.capacity:
+            return
+
+        live = len(self)
+        if live + size <= self.capacity // 2:
+            # at least half of the storage is reclaimed, so moving the live rows is amortized
+            for column in self._columns:
+                column[:live] = column[self._head : self._tail]
+        else:
+            capacity = max(2 * self.capacity, 1)
+            while capacity < live + size:
+                capacity *= 2
+            columns = []
+            for column, dtype in zip(self._columns, self._dtypes):
+                new_column = np.empty(capacity, dtype=dtype)
+                new_column[:live] = column[self._head : self._tail]
+                columns.append(new_column)
+            self._columns = columns
+        self._head = 0
+        self._tail = live
@@ -0,0 +1,224 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Density based clustering of Timepix hits on the pixel grid.
+
+The clustering gives the same result as DBSCAN on the features (shot * epsilon * 1000, x, y, tof * tof_scale)
+used by the CentroidCalculator, but exploits that x and y are pixel indices. Two hits can only be
+neighbours if they belong to the same shot and their pixels are at most epsilon apart, so the
+neighbours are found by looking up the few pixel offsets within epsilon in the pixels sorted by (shot, x, y)
+instead of a general radius search. Core points are connected by propagating the lowest index along the neighbour pairs
+and border points are assigned to the first cluster reaching them, as DBSCAN does.
+"""
+import numpy as np
+
+
+def _pixel_offsets(epsilon):
+    """Pixel offsets (dx, dy) within epsilon, one of each pair of opposite offsets and (0, 0)"""
+    reach = int(np.floor(epsilon))
+    return [
+        (dx, dy)
+        for dx in range(0, reach + 1)
+        for dy in range(-reach, reach + 1)
+        if (dx > 0 or dy >= 0) and dx * dx + dy * dy <= epsilon * epsilon
+    ]
+
+
+def _expand_pairs(first_start, first_count, second_start, second_count):
+    """All combinations of the hits first_start[k] + [0, first_count[k]) and second_start[k] + [0, second_count[k])"""
+    counts = first_count * second_count
+    if np.all(counts == 1):
+        return first_start, second_start
+    group = np.repeat(np.arange(counts.shape[0]), counts)
+    index = np.arange(group.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    return (
+        first_start[group] + index // second_count[group],
+        second_start[group] + index % second_count[group],
+    )
+
+
+def _neighbour_pairs(key, x, y, scaled_tof, epsilon, height):
+    """All pairs (i, j) of hits within epsilon, each pair once. The hits have to be sorted by key."""
+    size = key.shape[0]
+    pixel_start = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    pixel_key = key[pixel_start]
+    pixel_count = np.diff(np.append(pixel_start, size))
+
+    # hits in the same pixel
+    pixel_end = np.repeat(pixel_start + pixel_count, pixel_count)
+    counts = pixel_end - np.arange(size) - 1
+    first = [np.repeat(np.arange(size), counts)]
+    second = [first[0] + np.arange(first[0].shape[0]) - np.repeat(np.cumsum(counts) - counts, counts) + 1]
+
+    for dx, dy in _pixel_offsets(epsilon):
+        if dx == 0 and dy == 0:
+            continue
+        target = pixel_key + dx * height + dy
+        position = np.minimum(np.searchsorted(pixel_key, target), pixel_key.shape[0] - 1)
+        pixel = np.flatnonzero(pixel_key[position] == target)
+        neighbour = position[pixel]
+        i, j = _expand_pairs(pixel_start[pixel], pixel_count[pixel], pixel_start[neighbour], pixel_count[neighbour])
+        first.append(i)
+        second.append(j)
+
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    pixel_distance = (x[first] - x[second]) ** 2 + (y[first] - y[second]) ** 2
+    tof_difference = scaled_tof[first] - scaled_tof[second]
+    within = pixel_distance + tof_difference * tof_difference <= epsilon * epsilon
+    return first[within], second[within]
+
+
+def _connected_components(first, second, size):
+    """Lowest index of the connected component of each node, given the edges (first, second)
+
+    Clusters have a small diameter, so propagating the lowest index along the edges combined with
+    pointer jumping converges after a few iterations.
+    """
+    component = np.arange(size)
+    while True:
+        lowest = np.minimum(component[first], component[second])
+        updated = component.copy()
+        np.minimum.at(updated, first, lowest)
+        np.minimum.at(updated, second, lowest)
+        updated = updated[updated]
+        if np.array_equal(updated, component):
+            return component
+        component = updated
+
+
+def grid_dbscan(shot, x, y, tof, epsilon, min_samples, tof_scale):
+    """Cluster the hits like DBSCAN(eps=epsilon, min_samples=min_samples)
+
+    Parameters
+    ----------
+    shot, x, y, tof : np.ndarray
+        Trigger number, pixel position (integer valued) and time of flight of the hits
+    epsilon : float
+        Maximum distance of neighbours in pixels
+    min_samples : int
+        Minimum number of hits within epsilon (including the hit itself) of a core point
+    tof_scale : float
+        Factor to convert the time of flight into the distance unit
+
+    Returns
+    -------
+    np.ndarray
+        Cluster label of every hit, -1 for noise. Clusters are numbered in the order of their first core
+        point, as in sklearn.cluster.DBSCAN.
+    """
+    size = shot.shape[0]
+    labels = np.full(size, -1, dtype=np.int64)
+    if size == 0:
+        return labels
+
+    reach = int(np.floor(epsilon))
+    _, shot_index = np.unique(shot, return_inverse=True)
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    x = x - x.min() + reach
+    y = y - y.min() + reach
+    # the padding with reach makes sure that neighbouring keys don't wrap into the next row or shot
+    height = int(y.max()) + reach + 1
+    width = int(x.max()) + reach + 1
+    key = (shot_index.astype(np.int64) * width + x) * height + y
+    scaled_tof = tof * tof_scale
+
+    order = np.argsort(key)
+    first, second = _neighbour_pairs(key[order], x[order], y[order], scaled_tof[order], epsilon, height)
+
+    neighbour_count = 1 + np.bincount(first, minlength=size) + np.bincount(second, minlength=size)
+    core = neighbour_count >= min_samples
+    if not core.any():
+        return labels
+
+    # clusters are the connected components of the core points
+    core_edges = core[first] & core[second]
+    component = _connected_components(first[core_edges], second[core_edges], size)
+
+    # number the clusters by their first core point in the original order
+    component_start = np.full(size, size, dtype=np.int64)
+    np.minimum.at(component_start, component[core], order[core])
+    cluster_components = np.flatnonzero(component_start < size)
+    cluster_number = np.empty(size, dtype=np.int64)
+    cluster_number[cluster_components[np.argsort(component_start[cluster_components])]] = np.arange(
+        cluster_components.size
+    )
+
+    sorted_labels = np.full(size, -1, dtype=np.int64)
+    sorted_labels[core] = cluster_number[component[core]]
+
+    # border points belong to the cluster with the lowest number among their core neighbours
+    border_label = np.full(size, size, dtype=np.int64)
+    for point, neighbour in ((first, second), (second, first)):
+        border = ~core[point] & core[neighbour]
+        np.minimum.at(border_label, point[border], sorted_labels[neighbour[border]])
+    border = border_label < size
+    sorted_labels[border] = border_label[border]
+
+    labels[order] = sorted_labels
+    return labels
+
+
+def main():
+    """Compare the runtime of DBSCAN and grid_dbscan on synthetic clusters
+
+    Usage: python -m pymepix.processing.logic.grid_clustering [hdf5 file with raw events]
+    """
+    import sys
+    import time
+
+    from sklearn.cluster import DBSCAN
+
+    epsilon, min_samples, tof_scale = 2, 3, 1e7
+    if len(sys.argv) > 1:
+        import h5py
+
+        with h5py.File(sys.argv[1], "r") as f:
+            size = min(f["raw/x"].shape[0], 6_500 * 20)
+            shot, x, y, tof = (f["raw"][key][:size] for key in ["trigger nr", "x", "y", "tof"])
+            shot, x, y = (np.int64(arr) for arr in [shot, x, y])
+    else:
+        rng = np.random.default_rng(0)
+        clusters = 20_000
+        cluster_size = rng.integers(1, 12, clusters)
+        shot = np.repeat(rng.integers(0, 400, clusters), cluster_size)
+        x = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-2, 3, cluster_size.sum())
+        y = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-2, 3, cluster_size.sum())
+        tof = np.repeat(rng.random(clusters) * 1e-5, cluster_size) + rng.random(cluster_size.sum()) * 1e-7
+
+    chunk_size = 6_500
+    for name, cluster in [
+        (
+            "DBSCAN",
+            lambda s, a, b, t: DBSCAN(eps=epsilon, min_samples=min_samples, n_jobs=1)
+            .fit(np.column_stack((s * epsilon * 1_000, a, b, t * tof_scale)))
+            .labels_,
+        ),
+        ("grid", lambda s, a, b, t: grid_dbscan(s, a, b, t, epsilon, min_samples, tof_scale)),
+    ]:
+        start = time.perf_counter()
+        for index in range(0, shot.shape[0], chunk_size):
+            chunk = slice(index, index + chunk_size)
+            cluster(shot[chunk], x[chunk], y[chunk], tof[chunk])
+        print(f"{name:>6s}: {time.perf_counter() - start:7.3f} s for {shot.shape[0]:,d} hits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Single-pass decoder for Timepix3 packets.
+
+The decoder classifies every 64-bit word and writes x, y, toa, tot of the pixels and the trigger times
+in one pass into preallocated arrays. It produces the same values as PacketProcessor.process_pixels and
+PacketProcessor.process_triggers but avoids the full-array temporaries of the NumPy implementation.
+The kernel is compiled with Numba, if Numba is not installed the PacketProcessor falls back to its
+NumPy implementation.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _correct_global_time(value, ltimebits, ltime, ltime_previous, ltime_next):
+    pixelbits = (value >> 28) & 0x3
+    diff = ltimebits - pixelbits
+    if diff == 1 or diff == -3:
+        return ltime_previous | (value & 0x3FFFFFFF)
+    elif diff == -1 or diff == 3:
+        return ltime_next | (value & 0x3FFFFFFF)
+    return ltime | (value & 0x3FFFFFFF)
+
+
+def _decode_packet(packet, longtime, orientation, x_offset, y_offset, timewalk_lut, x, y, toa, tot, triggers):
+    """Decode the words in packet (int64) into x, y, toa, tot and triggers.
+
+    Returns the number of pixels and triggers written to the output arrays.
+    """
+    time_unit = 25.0 / 4096
+    ltimebits = (longtime >> 28) & 0x3
+    ltime = longtime & 0xFFFFC0000000
+    ltime_previous = (longtime - 0x10000000) & 0xFFFFC0000000
+    ltime_next = (longtime + 0x10000000) & 0xFFFFC0000000
+
+    pixel_count = 0
+    trigger_count = 0
+    for index in range(packet.shape[0]):
+        word = packet[index]
+        header = (word >> 60) & 0xF
+        if header == 0xA or header == 0xB:
+            dcol = (word & 0x0FE0000000000000) >> 52
+            spix = (word & 0x001F800000000000) >> 45
+            pix = (word & 0x0000700000000000) >> 44
+            col = dcol + pix // 4
+            row = spix + (pix & 0x3)
+
+            data = (word & 0x00000FFFFFFF0000) >> 16
+            spidr_time = word & 0x000000000000FFFF
+            pixel_toa = (data & 0x0FFFC000) >> 14
+            pixel_ftoa = data & 0xF
+            pixel_tot = ((data & 0x00003FF0) >> 4) * 25
+
+            toa_coarse = (
+                _correct_global_time(
+                    (spidr_time << 14) | pixel_toa, ltimebits, ltime, ltime_previous, ltime_next
+                )
+                & 0xFFFFFFFFFFFF
+            )
+            global_toa = (toa_coarse << 12) - (pixel_ftoa << 8)
+            column_shift = (col // 2) % 16
+            global_toa += column_shift << 8
+            if column_shift == 0:
+                global_toa += 16 << 8
+            final_toa = global_toa * time_unit * 1e-9
+            if timewalk_lut.shape[0] > 0:
+                final_toa -= timewalk_lut[pixel_tot // 25 - 1] * 1e3
+
+            if orientation == 0:
+                pixel_x, pixel_y = col, row
+            elif orientation == 1:
+                pixel_x, pixel_y = row, 255 - col
+            elif orientation == 2:
+                pixel_x, pixel_y = 255 - col, 255 - row
+            else:
+                pixel_x, pixel_y = 255 - row, col
+
+            x[pixel_count] = pixel_x + x_offset
+            y[pixel_count] = pixel_y + y_offset
+            toa[pixel_count] = final_toa
+            tot[pixel_count] = pixel_tot
+            pixel_count += 1
+        elif header == 0x4 or header == 0x6:
+            subheader = (word >> 56) & 0xF
+            if subheader == 0xF:
+                coarsetime = _correct_global_time(
+                    (word >> 12) & 0xFFFFFFFF, ltimebits, ltime, ltime_previous, ltime_next
+                )
+                tmpfine = (word >> 5) & 0xF
+                tmpfine = ((tmpfine - 1) << 9) // 12
+                trigtime_fine = (word & 0x0000000000000E00) | (tmpfine & 0x00000000000001FF)
+                triggers[trigger_count] = coarsetime * 25e-9 + trigtime_fine * time_unit * 1e-9
+                trigger_count += 1
+
+    return pixel_count, trigger_count
+
+
+if njit is not None:
+    _correct_global_time = njit(cache=True, nogil=True)(_correct_global_time)
+    _decode_packet_compiled = njit(cache=True, nogil=True)(_decode_packet)
+else:
+    _decode_packet_compiled = None
+
+
+def fused_decoder_available():
+    """Whether the compiled decoder can be used (requires Numba)"""
+    return _decode_packet_compiled is not None
+
+
+class FusedPacketDecoder:
+    """Decodes raw Timepix3 words in a single pass using the compiled kernel.
+
+    The output arrays are kept between calls and only grow if a larger packet is decoded.
+
+    Parameters
+    ----------
+    orientation : int
+        Value of :class:`PixelOrientation`
+    position_offset : (int, int)
+        Offset/ shift of x- and y-position
+    timewalk_lut
+        Data for correction of the time-walk
+    """
+
+    def __init__(self, orientation=0, position_offset=(0, 0), timewalk_lut=None):
+        self._orientation = int(orientation)
+        self._x_offset, self._y_offset = (int(offset) for offset in position_offset)
+        if timewalk_lut is None:
+            self._timewalk_lut = np.empty(0, dtype=np.float64)
+        else:
+            self._timewalk_lut = np.ascontiguousarray(timewalk_lut, dtype=np.float64)
+        self._allocate(0)
+
+    def _allocate(self, size):
+        self._x = np.empty(size, dtype=np.int64)
+        self._y = np.empty(size, dtype=np.int64)
+        self._toa = np.empty(size, dtype=np.float64)
+        self._tot = np.empty(size, dtype=np.int64)
+        self._triggers = np.empty(size, dtype=np.float64)
+
+    def decode(self, packet, longtime):
+        """Decode packet (array of uint64 words) using longtime for the global time correction.
+
+        Returns
+        -------
+        (x, y, toa, tot), triggers
+            Arrays are newly allocated copies and can be handed on safely.
+        """
+        if packet.shape[0] > self._x.shape[0]:
+            self._allocate(packet.shape[0])
+
+        pixel_count, trigger_count = _decode_packet_compiled(
+            packet.view(np.int64),
+            int(longtime),
+            self._orientation,
+            self._x_offset,
+            self._y_offset,
+            self._timewalk_lut,
+            self._x,
+            self._y,
+            self._toa,
+            self._tot,
+            self._triggers,
+        )
+
+        pixels = (
+            self._x[:pixel_count].copy(),
+            self._y[:pixel_count].copy(),
+            self._toa[:pixel_count].copy(),
+            self._tot[:pixel_count].copy(),
+        )
+        return pixels, self._triggers[:trigger_count].copy()
@@ -23,6 +23,8 @@ from ctypes import c_bool
 
 import numpy as np
 from pymepix.core.log import Logger
+from pymepix.processing.logic.column_buffer import ColumnBuffer
+from pymepix.processing.logic.packet_decoder import FusedPacketDecoder, fused_decoder_available
 from pymepix.processing.logic.processing_parameter import ProcessingParameter
 
 from pymepix.processing.logic.processing_step import ProcessingStep
@@ -51,9 +53,13 @@ class PacketProcessor(ProcessingStep):
     process(data):
         Process data and return the result. To use this class only this method should be used! Use the other methods only for testing or 
         if you are sure about what you are doing
+    decode(data), build_events(pixel_data, triggers):
+        The two halves of process. decode keeps no state, so chunks can be decoded by several processes
+        in any order, build_events has to get the decoded chunks in the order of the data.
     """
     def __init__(self, handle_events=True, event_window=(0.0, 10000.0), position_offset=(0, 0), 
-                orientation=PixelOrientation.Up, start_time=0, timewalk_lut=None, *args, **kwargs):
+                orientation=PixelOrientation.Up, start_time=0, timewalk_lut=None, fused_decoder=False,
+                *args, **kwargs):
         """
         Constructor for the PacketProcessor.
 
@@ -69,6 +75,9 @@ class PacketProcessor(ProcessingStep):
         start_time : int
         timewalk_lut
             Data for correction of the time-walk
+        fused_decoder : boolean
+            Decode the packets with the compiled single-pass decoder (requires Numba). Falls back to the
+            NumPy implementation if Numba is not available.
         parameter_wrapper_classe : ProcessingParameter
             Class used to wrap the processing parameters to make them changable while processing is running (useful for online optimization)
         """
@@ -85,6 +94,13 @@ class PacketProcessor(ProcessingStep):
 
         self._trigger_counter = 0
 
+        self._fused_decoder = None
+        if fused_decoder:
+            if fused_decoder_available():
+                self._fused_decoder = FusedPacketDecoder(orientation, position_offset, timewalk_lut)
+            else:
+                self.warning("Numba is not available, falling back to the NumPy packet decoder")
+
         self.clearBuffers()
 
     @property
@@ -97,6 +113,15 @@ class PacketProcessor(ProcessingStep):
         self._event_window_min.value = event_window_min
         self._event_window_max.value = event_window_max
 
+    @property
+    def trigger_counter(self):
+        """Number assigned to the next trigger event"""
+        return self._trigger_counter
+
+    @trigger_counter.setter
+    def trigger_counter(self, trigger_counter):
+        self._trigger_counter = trigger_counter
+
     @property
     def handle_events(self):
         """:noindex:"""
@@ -107,13 +132,36 @@ class PacketProcessor(ProcessingStep):
         self._handle_events.value = handle_events
 
     def process(self, data):
+        pixel_data, triggers = self.decode(data)
+
+        event_data, timestamps = None, None
+        result = self.build_events(pixel_data, triggers)
+        if result is not None:
+            event_data, timestamps = result
+
+        return event_data, pixel_data, timestamps
+
+    def decode(self, data):
+        """Decode the pixels and triggers of a chunk without changing the state of the event building
+
+        Returns
+        -------
+        pixel_data : (x, y, toa, tot)
+            None if the chunk contains no pixels
+        triggers : numpy.ndarray
+            Trigger times, None if the chunk contains no pixels (the triggers are then dropped)
+        """
         packet_view = memoryview(data)
         packet = np.frombuffer(packet_view[:-8], dtype=np.uint64)
         # needs to be an integer or "(ltime >> 28) & 0x3" fails
         longtime = int(np.frombuffer(packet_view[-8:], dtype=np.uint64)[0])
 
-        event_data, pixel_data, timestamps = None, None, None
-        if len(packet) > 0:
+        if len(packet) > 0 and self._fused_decoder is not None:
+            pixel_data, triggers = self._fused_decoder.decode(packet, longtime)
+            if pixel_data[0].size > 0:
+                return pixel_data, triggers
+
+        elif len(packet) > 0:
 
             header = ((packet & 0xF000000000000000) >> 60) & 0xF
             subheader = ((packet & 0x0F00000000000000) >> 56) & 0xF
@@ -126,54 +174,55 @@ class PacketProcessor(ProcessingStep):
             ]
 
             if pixels.size > 0:
-                pixel_data = self.process_pixels(np.int64(pixels), longtime)
+                pixel_data = self.decode_pixels(np.int64(pixels), longtime)
+                return pixel_data, self.decode_triggers(np.int64(triggers), longtime)
 
-                if triggers.size > 0:
-                    self.process_triggers(np.int64(triggers), longtime)
+        return None, None
 
-                if self.handle_events:
-                    result = self.find_events_fast()
-                    if result is not None:
-                        event_data, timestamps = result
+    def build_events(self, pixel_data, triggers):
+        """Add a decoded chunk to the carry-over pixels and triggers and find the complete events
 
-        return event_data, pixel_data, timestamps
+        Returns
+        -------
+        (event_data, timestamps)
+            None if there are no complete events or events are not handled
+        """
+        if pixel_data is None or not self.handle_events:
+            return None
+        self._pixel_buffer.append(*pixel_data)
+        if triggers.size > 0:
+            self._trigger_buffer.append(triggers)
+        return self.find_events_fast()
 
     def pre_process(self):
         self.info("Running with triggers? {}".format(self.handle_events))
+        if self._fused_decoder is not None:
+            # compile the decoder before the first data arrives
+            self._fused_decoder.decode(np.empty(0, dtype=np.uint64), 0)
 
     def post_process(self):
         return self.find_events_fast_post()
 
     def updateBuffers(self, val_filter):
-        self._x = self._x[val_filter]
-        self._y = self._y[val_filter]
-        self._toa = self._toa[val_filter]
-        self._tot = self._tot[val_filter]
+        self._pixel_buffer.keep(val_filter)
 
     def getBuffers(self, val_filter=None):
-        if val_filter is None:
-            return (
-                np.copy(self._x),
-                np.copy(self._y),
-                np.copy(self._toa),
-                np.copy(self._tot),
-            )
-        else:
-            return (
-                np.copy(self._x[val_filter]),
-                np.copy(self._y[val_filter]),
-                np.copy(self._toa[val_filter]),
-                np.copy(self._tot[val_filter]),
-            )
+        return self._pixel_buffer.take(val_filter)
 
     def clearBuffers(self):
-        self._x = None
-        self._y = None
-        self._tot = None
-        self._toa = None
-        self._triggers = None
+        """Carry-over pixels (x, y, toa, tot) and triggers are accumulated in growable column
+        buffers, so each hit is only copied a constant number of times while waiting for its
+        trigger."""
+        self._pixel_buffer = ColumnBuffer((np.int64, np.int64, np.float64, np.int64))
+        self._trigger_buffer = ColumnBuffer((np.float64,))
 
     def process_triggers(self, pixdata, longtime):
+        m_trigTime = self.decode_triggers(pixdata, longtime)
+
+        if self.handle_events:
+            self._trigger_buffer.append(m_trigTime)
+
+    def decode_triggers(self, pixdata, longtime):
         coarsetime = pixdata >> 12 & 0xFFFFFFFF
         coarsetime = self.correct_global_time(coarsetime, longtime)
         tmpfine = (pixdata >> 5) & 0xF
@@ -182,13 +231,7 @@ class PacketProcessor(ProcessingStep):
         time_unit = 25.0 / 4096
         tdc_time = coarsetime * 25e-9 + trigtime_fine * time_unit * 1e-9
 
-        m_trigTime = tdc_time
-
-        if self.handle_events:
-            if self._triggers is None:
-                self._triggers = m_trigTime
-            else:
-                self._triggers = np.append(self._triggers, m_trigTime)
+        return tdc_time
 
     def orientPixels(self, col, row):
         """ Orient the pixels based on Timepix orientation """
@@ -202,6 +245,14 @@ class PacketProcessor(ProcessingStep):
             return 255 - row, col
 
     def process_pixels(self, pixdata, longtime):
+        x, y, finalToA, ToT = self.decode_pixels(pixdata, longtime)
+
+        if self.handle_events:
+            self._pixel_buffer.append(x, y, finalToA, ToT)
+
+        return x, y, finalToA, ToT
+
+    def decode_pixels(self, pixdata, longtime):
 
         dcol = (pixdata & 0x0FE0000000000000) >> 52
         spix = (pixdata & 0x001F800000000000) >> 45
@@ -233,18 +284,6 @@ class PacketProcessor(ProcessingStep):
         x += self._x_offset
         y += self._y_offset
 
-        if self.handle_events:
-            if self._x is None:
-                self._x = x
-                self._y = y
-                self._toa = finalToA
-                self._tot = ToT
-            else:
-                self._x = np.append(self._x, x)
-                self._y = np.append(self._y, y)
-                self._toa = np.append(self._toa, finalToA)
-                self._tot = np.append(self._tot, ToT)
-
         return x, y, finalToA, ToT
 
     def correct_global_time(self, arr, ltime):
@@ -275,11 +314,11 @@ class PacketProcessor(ProcessingStep):
 
     def find_events_fast(self):
         if self.__exist_enough_triggers():
-            self._triggers = self._triggers[np.argmin(self._triggers) :]
+            self._trigger_buffer.consume(np.argmin(self._trigger_buffer.column(0)))
 
             if self.__toa_is_not_empty():
                 # Get our start/end triggers to bin events accordingly
-                start = self._triggers[0:-1:]
+                start = np.copy(self._trigger_buffer.column(0)[0:-1:])
                 if start.size > 0:
                     trigger_counter = np.arange(
                         self._trigger_counter, self._trigger_counter + start.size - 1, dtype=int
@@ -290,11 +329,12 @@ class PacketProcessor(ProcessingStep):
                     # Get the first and last triggers in pile
                     first_trigger = start[0]
                     last_trigger = start[-1]
-                    # Delete useless pixels before the first trigger
-                    self.updateBuffers(self._toa >= first_trigger)
-                    # grab only pixels we care about
-                    x, y, toa, tot = self.getBuffers(self._toa < last_trigger)
-                    self.updateBuffers(self._toa >= last_trigger)
+                    # grab only pixels we care about, pixels before the first trigger are deleted
+                    buffered_toa = self._pixel_buffer.column(2)
+                    x, y, toa, tot = self.getBuffers(
+                        (buffered_toa >= first_trigger) & (buffered_toa < last_trigger)
+                    )
+                    self.updateBuffers(buffered_toa >= last_trigger)
                     try:
                         event_mapping = np.digitize(toa, start) - 1
                     except Exception as e:
@@ -302,9 +342,9 @@ class PacketProcessor(ProcessingStep):
                         self.error("Writing output TOA {}".format(toa))
                         self.error("Writing triggers {}".format(start))
                         self.error("Flushing triggers!!!")
-                        self._triggers = self._triggers[-2:]
+                        self._trigger_buffer.consume(len(self._trigger_buffer) - 2)
                         return None
-                    self._triggers = self._triggers[-2:]
+                    self._trigger_buffer.consume(len(self._trigger_buffer) - 2)
 
                     tof = toa - start[event_mapping]
                     event_number = trigger_counter[event_mapping]
@@ -329,22 +369,52 @@ class PacketProcessor(ProcessingStep):
         return None # Clear out the triggers since they have nothing
 
     def __exist_enough_triggers(self):
-        return self._triggers is not None and self._triggers.size >= 4
+        return len(self._trigger_buffer) >= 4
 
     def __toa_is_not_empty(self):
-        return self._toa is not None and self._toa.size > 0
+        return len(self._pixel_buffer) > 0
 
     def find_events_fast_post(self):
         """Call this function at the very end of to also have the last two trigger events processed"""
         # add an imaginary last trigger event after last pixel event for np.digitize to work
-        if self._toa is not None and self._toa.shape[0] > 0:
-            self._triggers = np.concatenate(
-                (self._triggers, np.array([self._toa.max() + 1, self._toa.max() + 2]))
-            )
+        if len(self._pixel_buffer) > 0:
+            toa_max = self._pixel_buffer.column(2).max()
+            self._trigger_buffer.append(np.array([toa_max + 1, toa_max + 2]))
 
         event_data, timestamps = None, None
         result = self.find_events_fast()
         if result is not None:
             event_data, timestamps = result
 
-        return event_data, None, timestamps
\ No newline at end of file
+        return event_data, None, timestamps
+
+
+def main():
+    """Micro-benchmark of the pixel accumulation while triggers are late.
+
+    Chunks of pixels are processed without any triggers, so all pixels are kept as carry-over.
+    The time per chunk should stay flat while the backlog grows.
+    """
+    import time
+
+    rng = np.random.default_rng(0)
+    chunk_size = 100_000
+    longtime = 2233861246990
+    header = np.uint64(0xB) << np.uint64(60)
+    chunk = header | rng.integers(0, 2 ** 60, size=chunk_size, dtype=np.uint64)
+    data = np.append(chunk, np.uint64(longtime)).tobytes()
+
+    packet_processor = PacketProcessor(handle_events=True)
+    for index in range(1, 201):
+        start = time.perf_counter()
+        packet_processor.process(data)
+        duration = time.perf_counter() - start
+        if index % 20 == 0:
+            print(
+                f"backlog {len(packet_processor._pixel_buffer):>11,d} hits: "
+                f"{duration * 1e3:6.2f} ms per chunk of {chunk_size:,d} hits"
+            )
+
+
+if __name__ == "__main__":
+    main()
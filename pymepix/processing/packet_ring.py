@@ -0,0 +1,154 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Ring of packet buffers in shared memory between the UdpSampler and the packet processors"""
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+_SEQUENCE, _LENGTH, _RELEASED = range(3)
+# number of slots and slot size
+_HEADER_SIZE = 64
+
+
+class PacketRing:
+    """Fixed number of slots in shared memory written by one producer and read by several consumers
+
+    The producer receives data directly into a slot and publishes it with a sequence number. The
+    descriptor (slot, sequence, length) is sent to one of the consumers, e.g. by a ZMQ PUSH socket,
+    which reads the data in place and releases the slot afterwards. Sequence number s always uses the
+    slot s % slots and the producer only acquires the slot again once the consumer released sequence
+    s - slots. Each control field has a single writer, so no locks are required.
+
+    Use PacketRing.create in the producer and PacketRing.attach with the name in the consumers.
+    """
+
+    def __init__(self, block, owner):
+        self._block = block
+        self._owner = owner
+        self._slots, self._slot_size = (int(value) for value in np.ndarray((2,), dtype=np.int64, buffer=block.buf))
+        self._control = np.ndarray((self._slots, 3), dtype=np.int64, buffer=block.buf, offset=_HEADER_SIZE)
+        self._data = block.buf[_data_offset(self._slots) :]
+
+    @classmethod
+    def create(cls, slots, slot_size):
+        """Create a new ring in shared memory"""
+        block = shared_memory.SharedMemory(create=True, size=_data_offset(slots) + slots * slot_size)
+        np.ndarray((2,), dtype=np.int64, buffer=block.buf)[:] = slots, slot_size
+        ring = cls(block, owner=True)
+        ring._control[:, _SEQUENCE] = -1
+        ring._control[:, _LENGTH] = 0
+        # the slots are free for the first round
+        ring._control[:, _RELEASED] = np.arange(slots) - slots
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the ring created by the producer"""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self._block.name
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def slot_size(self):
+        return self._slot_size
+
+    def __slot(self, sequence):
+        return sequence % self._slots
+
+    def __view(self, slot, length):
+        start = slot * self._slot_size
+        return self._data[start : start + length]
+
+    def is_free(self, sequence):
+        """Whether the slot of sequence has been released by the consumer of sequence - slots"""
+        return self._control[self.__slot(sequence), _RELEASED] >= sequence - self._slots
+
+    def acquire(self, sequence, timeout=0.0):
+        """Memoryview of the slot for sequence, None if it is not released within timeout seconds"""
+        deadline = time.perf_counter() + timeout
+        while not self.is_free(sequence):
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(1e-4)
+        return self.__view(self.__slot(sequence), self._slot_size)
+
+    def publish(self, sequence, length):
+        """Mark the slot of sequence as written with length bytes, returns the descriptor for the consumer"""
+        slot = self.__slot(sequence)
+        self._control[slot, _LENGTH] = length
+        self._control[slot, _SEQUENCE] = sequence
+        return np.array([slot, sequence, length], dtype=np.int64).tobytes()
+
+    def read(self, descriptor):
+        """Memoryview of the data of a descriptor and its sequence number
+
+        Raises
+        ------
+        RuntimeError
+            If the slot has already been overwritten
+        """
+        slot, sequence, length = (int(value) for value in np.frombuffer(descriptor, dtype=np.int64))
+        if self._control[slot, _SEQUENCE] != sequence:
+            raise RuntimeError(
+                "Slot {} of ring {} contains sequence {} instead of {}".format(
+                    slot, self.name, self._control[slot, _SEQUENCE], sequence
+                )
+            )
+        return self.__view(slot, length), sequence
+
+    def release(self, sequence):
+        """Allow the producer to reuse the slot of sequence"""
+        self._control[self.__slot(sequence), _RELEASED] = sequence
+
+    def close(self):
+        """Detach from the shared memory, the producer also removes it"""
+        self._control = None
+        try:
+            self._data.release()
+            self._block.close()
+        except BufferError:
+            # views still in use, e.g. by ZMQ, the mapping is removed once they are gone
+            pass
+        if self._owner:
+            try:
+                self._block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def ensure_shared_resource_tracker():
+    """Start the resource tracker of the current process before the pipeline processes are started
+
+    Processes started afterwards share it. Otherwise each of them starts its own tracker, which removes
+    the shared memory attached by the process when it exits.
+    """
+    resource_tracker.ensure_running()
+
+
+def _data_offset(slots):
+    # header and control fields of the slots, the data starts cache line aligned
+    return _HEADER_SIZE + -(-slots * 3 * 8 // 64) * 64
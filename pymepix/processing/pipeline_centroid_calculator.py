@@ -24,10 +24,21 @@ from pymepix.processing.logic.centroid_calculator import CentroidCalculator
 from pymepix.processing.logic.shared_processing_parameter import SharedProcessingParameter
 
 from .basepipeline import BasePipelineObject
+from .bounded_queue import BoundedQueue
+
+# waiting messages of an unbounded input queue from which on triggers are skipped
+_BACKLOG_LIMIT = 64
 
 
 class PipelineCentroidCalculator(BasePipelineObject):
-    """Performs centroiding on EventData recieved from Packet processor"""
+    """Performs centroiding on EventData recieved from Packet processor
+
+    With max_triggers_processed the triggers_processed of the centroid calculator is doubled, up to
+    max_triggers_processed, while more than half of a bounded input queue (or 64 messages of an unbounded
+    one) is waiting. It goes back to the initial value once the queue is empty.
+
+    With batch_size several EventData messages are merged and centroided together, see BasePipelineObject.
+    """
 
     def __init__(
         self,
@@ -36,18 +47,68 @@ class PipelineCentroidCalculator(BasePipelineObject):
         create_output=True,
         num_outputs=1,
         shared_output=None,
+        transport=None,
+        max_triggers_processed=None,
+        batch_size=1,
+        batch_timeout=0.01,
+        trace=False,
     ):
         super().__init__(
             PipelineCentroidCalculator.__name__,
             input_queue=input_queue,
             create_output=create_output,
             num_outputs=num_outputs,
-            shared_output=shared_output
+            shared_output=shared_output,
+            transport=transport,
+            batch_size=batch_size,
+            batch_timeout=batch_timeout,
+            trace=trace,
         )
         self.centroid_calculator = centroid_calculator
+        self._max_triggers_processed = max_triggers_processed
+
+    def pre_run(self):
+        self.centroid_calculator.pre_process()
+        self._initial_triggers_processed = self.centroid_calculator.triggers_processed
+        self._adapt_triggers_processed = (
+            self._max_triggers_processed is not None
+            and self._max_triggers_processed > self._initial_triggers_processed
+            and self.input_queue is not None
+        )
+
+    def __adapt_triggers_processed(self):
+        try:
+            backlog = self.input_queue.qsize()
+        except NotImplementedError:
+            self.warning("The size of the input queue is not available, triggers_processed is not adapted")
+            self._adapt_triggers_processed = False
+            return
+        if isinstance(self.input_queue, BoundedQueue):
+            backlog_limit = self.input_queue.maxsize // 2
+        else:
+            backlog_limit = _BACKLOG_LIMIT
+
+        triggers_processed = self.centroid_calculator.triggers_processed
+        if backlog > backlog_limit and triggers_processed < self._max_triggers_processed:
+            triggers_processed = min(2 * triggers_processed, self._max_triggers_processed)
+            self.warning(
+                "Centroiding falls behind ({} messages waiting), processing every {}. trigger".format(
+                    backlog, triggers_processed
+                )
+            )
+        elif backlog == 0 and triggers_processed > self._initial_triggers_processed:
+            triggers_processed = max(triggers_processed // 2, self._initial_triggers_processed)
+            self.info("Centroiding caught up, processing every {}. trigger".format(triggers_processed))
+        self.centroid_calculator.triggers_processed = triggers_processed
+
+    def post_run(self):
+        self.centroid_calculator.post_process()
+        return None, None
 
     def process(self, data_type=None, data=None):
         if data_type == MessageType.EventData:
+            if self._adapt_triggers_processed:
+                self.__adapt_triggers_processed()
             return MessageType.CentroidData, self.centroid_calculator.process(data)
 
         return None, None
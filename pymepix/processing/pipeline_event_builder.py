@@ -0,0 +1,125 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Builds events from the chunks decoded by several packet processors in the order of the data"""
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.logic.packet_processor import PacketProcessor
+from pymepix.processing.logic.shared_processing_parameter import SharedProcessingParameter
+
+from .basepipeline import BasePipelineObject
+
+
+class PipelineEventBuilder(BasePipelineObject):
+    """Puts the chunks decoded by PipelinePacketProcessor(decode_only=True) back in order and builds the events
+
+    The decoding processes take the chunks from the UdpSampler in any order. Chunks arriving early wait
+    until all chunks with lower sequence numbers have been passed to the event building, so the carry-over
+    pixels and triggers as well as the trigger numbers are the same as with a single packet processor.
+    The pixel data of the chunks is passed on in the same order. Other messages are passed on directly.
+
+    Parameters
+    ----------
+    packet_processor : PacketProcessor
+        Only used for the event building (window and trigger numbering), the decoding settings are ignored
+    max_pending : int
+        Number of chunks waiting for a missing chunk after which the missing chunk is skipped, e.g. if a
+        decoding process failed
+    """
+
+    def __init__(
+        self,
+        packet_processor: PacketProcessor = PacketProcessor(parameter_wrapper_class=SharedProcessingParameter),
+        max_pending=1_000,
+        input_queue=None,
+        create_output=True,
+        num_outputs=1,
+        shared_output=None,
+        transport=None,
+        trace=False,
+    ):
+        super().__init__(
+            PipelineEventBuilder.__name__,
+            input_queue=input_queue,
+            create_output=create_output,
+            num_outputs=num_outputs,
+            shared_output=shared_output,
+            propogate_input=False,
+            transport=transport,
+            trace=trace,
+        )
+        self.packet_processor = packet_processor
+        self._max_pending = max_pending
+        self._pending = {}
+        self._next_sequence = 0
+        self._skipped_chunks = 0
+
+    @property
+    def skipped_chunks(self):
+        """Number of chunks which never arrived"""
+        return self._skipped_chunks
+
+    def pre_run(self):
+        self.info("Building events of decoded chunks")
+        self._pending = {}
+        self._next_sequence = 0
+        self._skipped_chunks = 0
+
+    def post_run(self):
+        # chunks behind a missing chunk
+        while self._pending:
+            self.__skip_to(min(self._pending))
+            self.__release()
+        event_data, _, _ = self.packet_processor.post_process()
+        if event_data is not None:
+            return MessageType.EventData, event_data
+        return None, None
+
+    def process(self, data_type=None, data=None):
+        if data_type != MessageType.DecodedData:
+            return data_type, data
+
+        sequence, pixel_data, triggers = data
+        if sequence < self._next_sequence:
+            self.warning("Chunk {} arrived after it was skipped".format(sequence))
+            return None, None
+        self._pending[sequence] = pixel_data, triggers, self._trace
+        if len(self._pending) > self._max_pending:
+            self.__skip_to(min(self._pending))
+        self.__release()
+        return None, None
+
+    def __skip_to(self, sequence):
+        self.warning("Chunks {} to {} are missing, skipping them".format(self._next_sequence, sequence - 1))
+        self._skipped_chunks += sequence - self._next_sequence
+        self._next_sequence = sequence
+
+    def __release(self):
+        """Build the events of the chunks which are in order"""
+        while self._next_sequence in self._pending:
+            pixel_data, triggers, trace = self._pending.pop(self._next_sequence)
+            self._next_sequence += 1
+            if pixel_data is None:
+                continue
+            # the outputs are traced back to the chunk, not to the message being processed
+            self._trace = trace
+            self.pushOutput(MessageType.PixelData, pixel_data)
+            result = self.packet_processor.build_events(pixel_data, triggers)
+            if result is not None:
+                event_data, _timestamps = result
+                self.pushOutput(MessageType.EventData, event_data)
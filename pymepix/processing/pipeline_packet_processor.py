@@ -22,16 +22,26 @@ from enum import IntEnum
 from pymepix.processing.datatypes import MessageType
 from pymepix.processing.logic.shared_processing_parameter import SharedProcessingParameter
 
+import numpy as np
 import zmq
 
 from .basepipeline import BasePipelineObject
 from .logic.packet_processor import PacketProcessor
+from .packet_ring import PacketRing, ensure_shared_resource_tracker
 
 class PipelinePacketProcessor(BasePipelineObject):
     """Processes Pixel packets for ToA, ToT, triggers and events
 
     This class, creates a UDP socket connection to SPIDR and recivies the UDP packets from Timepix
     It then pre-processes them and sends them off for more processing
+
+    The UdpSampler sends the name of its PacketRing and the descriptor of a filled slot, the packets
+    are processed in place in shared memory and the slot is released afterwards. The descriptors are
+    received from packet_address, which the UdpSampler binds.
+
+    With decode_only the chunks are only decoded and sent on with their sequence number as DecodedData,
+    the events are built by a PipelineEventBuilder in the next stage. Several processes can then share
+    the decoding without mixing up the carry-over pixels, triggers and trigger numbers.
     """
 
     def __init__(
@@ -40,7 +50,11 @@ class PipelinePacketProcessor(BasePipelineObject):
         input_queue=None,
         create_output=True,
         num_outputs=1,
-        shared_output=None
+        shared_output=None,
+        decode_only=False,
+        transport=None,
+        trace=False,
+        packet_address="ipc:///tmp/packetProcessor",
     ):
         # set input_queue to None for now, or baseaqusition.build would have to be modified
         # input_queue is replace by zmq
@@ -50,14 +64,29 @@ class PipelinePacketProcessor(BasePipelineObject):
             create_output=create_output,
             num_outputs=num_outputs,
             shared_output=shared_output,
+            transport=transport,
+            trace=trace,
         )
         self.packet_processor = packet_processor
+        self._decode_only = decode_only
+        self._packet_address = packet_address
+        ensure_shared_resource_tracker()
 
     def init_new_process(self):
         self.debug("create ZMQ socket")
         ctx = zmq.Context.instance()
         self._packet_sock = ctx.socket(zmq.PULL)
-        self._packet_sock.connect("ipc:///tmp/packetProcessor")
+        self._packet_sock.connect(self._packet_address)
+        self._ring = None
+
+    def __attach_ring(self, name):
+        """Ring of the UdpSampler, a new one is attached if the sampler has been restarted"""
+        name = name.decode()
+        if self._ring is None or self._ring.name != name:
+            if self._ring is not None:
+                self._ring.close()
+            self._ring = PacketRing.attach(name)
+        return self._ring
 
     def pre_run(self):
         self.init_new_process()
@@ -65,11 +94,29 @@ class PipelinePacketProcessor(BasePipelineObject):
 
     def post_run(self):
         self._packet_sock.close()
+        if self._ring is not None:
+            self._ring.close()
+        if self._decode_only:
+            return None, None
         return None, self.packet_processor.post_process()
 
     def process(self, data_type=None, data=None):
         # timestamps are not required for online processing
-        result = self.packet_processor.process(self._packet_sock.recv(copy=False))
+        name, descriptor, received = self._packet_sock.recv_multipart()
+        ring = self.__attach_ring(name)
+        data, sequence = ring.read(descriptor)
+        self.input_received(len(data), (sequence, float(np.frombuffer(received, dtype=np.float64)[0])))
+        try:
+            if self._decode_only:
+                pixel_data, triggers = self.packet_processor.decode(data)
+            else:
+                result = self.packet_processor.process(data)
+        finally:
+            del data
+            ring.release(sequence)
+        if self._decode_only:
+            # also empty chunks, the event builder waits for every sequence number
+            return MessageType.DecodedData, (sequence, pixel_data, triggers)
         if result is not None:
             event_data, pixel_data, _timestamps = result
 
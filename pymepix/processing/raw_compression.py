@@ -0,0 +1,310 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Compressed container for raw recordings
+
+A compressed raw file starts with a 16 byte header (magic, codec, shuffle flag) followed by blocks,
+each with its compressed and uncompressed size (two little endian uint32) and the compressed data.
+The uncompressed stream is the content of the plain raw file, including the start time header.
+Raw files are opened with open_raw, which reads both formats.
+
+LZ4 (package lz4) or Zstandard (package zstandard) are used if installed, zlib otherwise.
+"""
+import bisect
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_MAGIC = b"PMXRAWZ\x01"
+_HEADER = struct.Struct("<8sBB6x")
+_BLOCK = struct.Struct("<II")
+_CODECS = ("zlib", "lz4", "zstd")
+
+
+def available_codecs():
+    """Codecs usable in this environment, fastest first"""
+    return [
+        codec
+        for codec, available in (("lz4", lz4_block is not None), ("zstd", zstandard is not None), ("zlib", True))
+        if available
+    ]
+
+
+def shuffle(data):
+    """Group the n-th bytes of all 64-bit words, so the repeating header bytes end up next to each other"""
+    data = memoryview(data).cast("B")
+    size = data.nbytes // 8 * 8
+    words = np.frombuffer(data, dtype=np.uint8, count=size)
+    return words.reshape(-1, 8).T.tobytes() + data[size:].tobytes()
+
+
+def unshuffle(data):
+    """Inverse of shuffle"""
+    data = memoryview(data).cast("B")
+    size = data.nbytes // 8 * 8
+    columns = np.frombuffer(data, dtype=np.uint8, count=size)
+    return columns.reshape(8, -1).T.tobytes() + data[size:].tobytes()
+
+
+class RawCompressor:
+    """Compresses blocks of a raw recording into the container format
+
+    Parameters
+    ----------
+    codec : str
+        "lz4", "zstd", "zlib" or "auto" for the fastest available one
+    shuffle : bool
+        Whether the bytes of the words are shuffled before the compression
+    level : int
+        Compression level of the codec, None for a fast default
+    """
+
+    def __init__(self, codec="auto", shuffle=True, level=None):
+        if codec == "auto":
+            codec = available_codecs()[0]
+        if codec not in available_codecs():
+            raise ValueError("Codec {} is not available, use one of {}".format(codec, available_codecs()))
+        self._codec = codec
+        self._shuffle = shuffle
+        if codec == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=1 if level is None else level)
+        self._level = level
+
+    @property
+    def codec(self):
+        return self._codec
+
+    def header(self):
+        return _HEADER.pack(_MAGIC, _CODECS.index(self._codec), self._shuffle)
+
+    def compress(self, data):
+        """Block of the container with the compressed data"""
+        raw_size = memoryview(data).nbytes
+        if self._shuffle:
+            data = shuffle(data)
+        if self._codec == "lz4":
+            if self._level is None:
+                compressed = lz4_block.compress(data, store_size=False)
+            else:
+                compressed = lz4_block.compress(data, mode="high_compression", compression=self._level, store_size=False)
+        elif self._codec == "zstd":
+            compressed = self._zstd.compress(data)
+        else:
+            compressed = zlib.compress(data, 1 if self._level is None else self._level)
+        return _BLOCK.pack(len(compressed), raw_size) + compressed
+
+
+def is_compressed(file_name):
+    """Whether file_name is a compressed raw file"""
+    with open(file_name, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+class CompressedRawFile(io.RawIOBase):
+    """Seekable, read-only view of the uncompressed stream of a compressed raw file
+
+    The block sizes are read when the file is opened, afterwards only the blocks which are read are
+    decompressed, one at a time.
+    """
+
+    def __init__(self, file_name):
+        super().__init__()
+        self._file = open(file_name, "rb")
+        try:
+            magic, codec, self._shuffle = _HEADER.unpack(self._file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError("{} is not a compressed raw file".format(file_name))
+            self._codec = _CODECS[codec]
+            if self._codec not in available_codecs():
+                raise ValueError("{} is compressed with {}, which is not installed".format(file_name, self._codec))
+            self._offsets, self._raw_offsets = self.__read_blocks()
+        except Exception:
+            self._file.close()
+            raise
+        if self._codec == "zstd":
+            self._zstd = zstandard.ZstdDecompressor()
+        self._position = 0
+        self._block_index = -1
+        self._block = b""
+
+    def __read_blocks(self):
+        """File offsets of the blocks and the offsets of their data in the uncompressed stream"""
+        offsets, raw_offsets = [], [0]
+        offset = _HEADER.size
+        while True:
+            self._file.seek(offset)
+            frame = self._file.read(_BLOCK.size)
+            if len(frame) < _BLOCK.size:
+                break
+            compressed_size, raw_size = _BLOCK.unpack(frame)
+            offsets.append(offset)
+            raw_offsets.append(raw_offsets[-1] + raw_size)
+            offset += _BLOCK.size + compressed_size
+        return offsets, raw_offsets
+
+    @property
+    def size(self):
+        """Size of the uncompressed stream"""
+        return self._raw_offsets[-1]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer):
+        buffer = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < buffer.nbytes and self._position < self.size:
+            index = bisect.bisect_right(self._raw_offsets, self._position) - 1
+            block = self.__block(index)
+            start = self._position - self._raw_offsets[index]
+            size = min(len(block) - start, buffer.nbytes - filled)
+            buffer[filled : filled + size] = block[start : start + size]
+            filled += size
+            self._position += size
+        return filled
+
+    def __block(self, index):
+        if index != self._block_index:
+            self._file.seek(self._offsets[index])
+            compressed_size, raw_size = _BLOCK.unpack(self._file.read(_BLOCK.size))
+            compressed = self._file.read(compressed_size)
+            if self._codec == "lz4":
+                data = lz4_block.decompress(compressed, uncompressed_size=raw_size)
+            elif self._codec == "zstd":
+                data = self._zstd.decompress(compressed, max_output_size=raw_size)
+            else:
+                data = zlib.decompress(compressed)
+            self._block = unshuffle(data) if self._shuffle else data
+            self._block_index = index
+        return self._block
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._block = b""
+        super().close()
+
+
+def open_raw(file_name):
+    """Open a plain or compressed raw file for binary reading
+
+    A list of segment files is read as one raw file, see SegmentedRawFile
+    """
+    if isinstance(file_name, (list, tuple)):
+        from .raw_segments import SegmentedRawFile
+
+        return io.BufferedReader(SegmentedRawFile(file_name), buffer_size=1 << 16)
+    if is_compressed(file_name):
+        return io.BufferedReader(CompressedRawFile(file_name), buffer_size=1 << 16)
+    return open(file_name, "rb")
+
+
+def raw_size(file_name):
+    """Size of the (uncompressed) content of a raw file or a list of segment files"""
+    if isinstance(file_name, (list, tuple)):
+        from .raw_segments import SegmentedRawFile
+
+        with SegmentedRawFile(file_name) as f:
+            return f.size
+    if is_compressed(file_name):
+        with CompressedRawFile(file_name) as f:
+            return f.size
+    return os.path.getsize(file_name)
+
+
+def main():
+    """Compression ratio and throughput of the codecs for a raw file
+
+    Usage: python -m pymepix.processing.raw_compression <raw file>
+    """
+    import sys
+    import tempfile
+    import time
+
+    from pymepix.processing.raw_writer import RawFileWriter
+
+    with open_raw(sys.argv[1]) as f:
+        data = f.read()
+    print("{:.1f} MB of raw data".format(len(data) * 1e-6))
+
+    block_size = 4 << 20
+    blocks = [data[start : start + block_size] for start in range(0, len(data), block_size)]
+    for codec in available_codecs():
+        for shuffled in (False, True):
+            compressor = RawCompressor(codec, shuffled)
+            start = time.perf_counter()
+            compressed = [compressor.compress(block) for block in blocks]
+            elapsed = time.perf_counter() - start
+            size = sum(len(block) for block in compressed)
+            print(
+                "{:5s} shuffle {:d}: ratio {:5.2f}, compression {:7.1f} MB/s".format(
+                    codec, shuffled, len(data) / size, len(data) / elapsed * 1e-6
+                )
+            )
+
+    with tempfile.TemporaryDirectory(dir=".") as folder:
+        file_name = os.path.join(folder, "raw.bin")
+        for compression in (None, "auto"):
+            start = time.perf_counter()
+            with RawFileWriter(file_name, compression=compression) as writer:
+                for offset in range(0, len(data), 65_536):
+                    writer.write(data[offset : offset + 65_536])
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            with open_raw(file_name) as f:
+                assert f.read() == data
+            print(
+                "RawFileWriter compression {}: write {:.1f} MB/s, read {:.1f} MB/s, {} bytes".format(
+                    compression,
+                    len(data) / elapsed * 1e-6,
+                    len(data) / (time.perf_counter() - start) * 1e-6,
+                    os.path.getsize(file_name),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
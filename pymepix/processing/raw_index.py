@@ -0,0 +1,254 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Sparse index of the heartbeats of a raw file for processing time or trigger ranges"""
+import os
+
+import numpy as np
+
+from .raw_compression import open_raw, raw_size
+
+TICKS_PER_SECOND = 40_000_000
+
+
+def heartbeat_index_file_name(file_name):
+    """Sidecar of the heartbeat index, e.g. run.raw -> run.heartbeats.npz"""
+    return os.path.splitext(file_name)[0] + ".heartbeats.npz"
+
+
+class HeartbeatIndex:
+    """Position, time and number of preceding triggers of each MSB heartbeat word of a raw file
+
+    The offsets are in 64-bit words after the start time header. The longtime of an MSB word is
+    combined with the last LSB word before it (0 if there is none, as in RawFileSampler), in 25 ns
+    units. The trigger count is the number of trigger words between the first MSB heartbeat word,
+    before which RawFileSampler drops all data, and the heartbeat word, without the triggers of the
+    chunks the PacketProcessor drops because they contain no pixels, i.e. the trigger number
+    RawFileSampler assigns to the next trigger. Whether a chunk is dropped depends on where the data is
+    pushed, so processing a range starts at a boundary, a heartbeat at which RawFileSampler.run pushes.
+
+    Parameters
+    ----------
+    offsets, longtimes, triggers, boundaries : numpy.ndarray
+        One entry per MSB heartbeat word
+    file_size : int
+        Size of the (uncompressed) raw file the index belongs to
+    """
+
+    def __init__(self, offsets, longtimes, triggers, boundaries, file_size):
+        self.offsets = offsets
+        self.longtimes = longtimes
+        self.triggers = triggers
+        self.boundaries = boundaries
+        self.file_size = file_size
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+    @classmethod
+    def build(cls, file_name, block_size=1 << 22):
+        """Scan the raw file for the heartbeat words
+
+        The chunks pushed to the PacketProcessor are found with the scan of RawFileSampler itself. The
+        PacketProcessor drops the triggers of a chunk without pixel words, so these are not counted.
+        """
+        from .rawfilesampler import RawFileSampler
+
+        sampler = RawFileSampler(file_name, None)
+        sampler.init_new_process(file_name)
+        offsets, longtimes, triggers, boundaries = [], [], [], []
+        lsb = 0
+        trigger_count = 0  # triggers of the finished chunks with pixels
+        chunk_triggers, chunk_pixels, chunk_entry = 0, False, 0
+        block_offset = 0
+        buffer = bytearray(block_size * 8)
+        with open_raw(file_name) as file:
+            file.seek(8)
+            while True:
+                words_read = file.readinto(buffer) // 8
+                if words_read == 0:
+                    break
+                block = np.frombuffer(buffer, dtype="<u8", count=words_read)
+                header = block >> np.uint64(60)
+                subheader = (block >> np.uint64(56)) & np.uint64(0xF)
+                timer = (header == 0x4) | (header == 0x6)
+                lsb_indices = np.flatnonzero(timer & (subheader == 0x4))
+                msb_indices = np.flatnonzero(timer & (subheader == 0x5))
+                trigger_indices = np.flatnonzero(timer & (subheader == 0xF))
+                pixel_indices = np.flatnonzero((header == 0xA) | (header == 0xB))
+
+                # the last LSB word before each MSB word, which can be in a previous block
+                lsb_times = np.append(
+                    np.uint64(lsb), (block[lsb_indices] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16)
+                )
+                msb_lsb = lsb_times[np.searchsorted(lsb_indices, msb_indices)]
+                msb_times = ((block[msb_indices] & np.uint64(0x00000000FFFF0000)) << np.uint64(16)) | msb_lsb
+
+                # the data before the first heartbeat is dropped
+                start, pushes = sampler.scan_block(block, header, subheader)
+                cuts = [msb_index for msb_index, _ in pushes] + [words_read]
+                for cut in cuts:
+                    chunk_msb = np.flatnonzero((msb_indices >= start) & (msb_indices < cut))
+                    chunk_trigger_indices = trigger_indices[(trigger_indices >= start) & (trigger_indices < cut)]
+                    chunk_offsets = msb_indices[chunk_msb]
+                    offsets.extend((chunk_offsets + block_offset).tolist())
+                    longtimes.extend(msb_times[chunk_msb].tolist())
+                    preceding = trigger_count + chunk_triggers + np.searchsorted(chunk_trigger_indices, chunk_offsets)
+                    triggers.extend(preceding.tolist())
+                    boundaries.extend([False] * chunk_msb.size)
+                    chunk_triggers += chunk_trigger_indices.size
+                    chunk_pixels |= bool(np.any((pixel_indices >= start) & (pixel_indices < cut)))
+                    if cut == words_read:
+                        break
+                    # the chunk is pushed at the heartbeat word cut
+                    if chunk_pixels:
+                        trigger_count += chunk_triggers
+                    else:
+                        triggers[chunk_entry:] = [trigger_count] * (len(triggers) - chunk_entry)
+                    chunk_triggers, chunk_pixels = 0, False
+                    offsets.append(cut + block_offset)
+                    longtimes.append(int(msb_times[np.searchsorted(msb_indices, cut)]))
+                    triggers.append(trigger_count)
+                    boundaries.append(True)
+                    chunk_entry = len(triggers)
+                    start = cut + 1
+                if lsb_indices.size > 0:
+                    lsb = int(lsb_times[-1])
+                block_offset += words_read
+
+        if boundaries:
+            # processing starts at the first heartbeat
+            boundaries[0] = True
+        return cls(
+            np.array(offsets, dtype=np.int64),
+            np.array(longtimes, dtype=np.uint64),
+            np.array(triggers, dtype=np.int64),
+            np.array(boundaries, dtype=bool),
+            raw_size(file_name),
+        )
+
+    def save(self, file_name):
+        np.savez(
+            file_name,
+            offsets=self.offsets,
+            longtimes=self.longtimes,
+            triggers=self.triggers,
+            boundaries=self.boundaries,
+            file_size=np.int64(self.file_size),
+        )
+
+    @classmethod
+    def load(cls, file_name, save=True):
+        """Index of the raw file_name from its sidecar, which is built (and saved) if it is missing or outdated
+
+        The index of a list of segment files is always built.
+        """
+        if isinstance(file_name, (list, tuple)):
+            return cls.build(file_name)
+        index_file = heartbeat_index_file_name(file_name)
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(file_name):
+            with np.load(index_file) as data:
+                # sidecars without boundaries count the triggers of dropped chunks as well
+                if "boundaries" in data and int(data["file_size"]) == raw_size(file_name):
+                    return cls(
+                        data["offsets"], data["longtimes"], data["triggers"], data["boundaries"], int(data["file_size"])
+                    )
+        index = cls.build(file_name)
+        if save:
+            try:
+                index.save(index_file)
+            except OSError:
+                # e.g. a read-only folder, the index is built again next time
+                pass
+        return index
+
+    def __word_range(self, begin, end):
+        """Words from the boundary at or before heartbeat begin up to (excluding) heartbeat end, the entry
+        of the boundary"""
+        begin = np.flatnonzero(self.boundaries[: max(begin, 0) + 1])[-1]
+        stop = int(self.offsets[end]) if end < len(self) else None
+        return int(self.offsets[begin]), stop, int(self.longtimes[begin]), int(self.triggers[begin])
+
+    def time_range(self, start=None, stop=None):
+        """Words to process for the time range in seconds after the first heartbeat
+
+        The range is widened to the boundary before the heartbeat before start and to the heartbeat
+        after the one following stop, so the events of the triggers in the range are complete.
+
+        Returns
+        -------
+        (first word, stop word or None for the end of the file, longtime, trigger count) of the
+        heartbeat at the first word, None if the file contains no heartbeat
+        """
+        if len(self) == 0:
+            return None
+        first_longtime = int(self.longtimes[0])
+        begin = 0
+        if start is not None:
+            after = np.flatnonzero(self.longtimes >= first_longtime + int(start * TICKS_PER_SECOND))
+            begin = after[0] - 1 if after.size > 0 else len(self) - 1
+        end = len(self)
+        if stop is not None:
+            after = np.flatnonzero(self.longtimes[begin:] > first_longtime + int(stop * TICKS_PER_SECOND))
+            end = begin + after[0] + 1 if after.size > 0 else len(self)
+        return self.__word_range(begin, end)
+
+    def trigger_range(self, first=None, stop=None):
+        """Words to process for the trigger numbers first to stop (exclusive), see time_range"""
+        if len(self) == 0:
+            return None
+        begin = 0
+        if first is not None:
+            after = np.flatnonzero(self.triggers > first)
+            begin = after[0] - 1 if after.size > 0 else len(self) - 1
+        end = len(self)
+        if stop is not None:
+            after = np.flatnonzero(self.triggers[begin:] >= stop)
+            end = begin + after[0] + 1 if after.size > 0 else len(self)
+        return self.__word_range(begin, end)
+
+
+def main():
+    """Time the index building and the processing of one second of a raw file against the whole file
+
+    Usage: python -m pymepix.processing.raw_index <raw file> [start time in s]
+    """
+    import sys
+    import tempfile
+    import time
+
+    from .rawfilesampler import RawFileSampler
+
+    file_name = sys.argv[1]
+    start = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    begin = time.perf_counter()
+    index = HeartbeatIndex.build(file_name)
+    print("{} heartbeats indexed in {:.2f} s".format(len(index), time.perf_counter() - begin))
+    with tempfile.TemporaryDirectory() as folder:
+        output_file = os.path.join(folder, "output.hdf5")
+        begin = time.perf_counter()
+        RawFileSampler(file_name, output_file).run_range(start, start + 1.0)
+        print("1 s from {} s: {:.2f} s".format(start, time.perf_counter() - begin))
+        begin = time.perf_counter()
+        RawFileSampler(file_name, output_file).run()
+        print("whole file: {:.2f} s".format(time.perf_counter() - begin))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Numbered segments of raw recordings and their sidecar index files"""
+import bisect
+import glob
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+from .raw_compression import open_raw, raw_size
+
+
+def segment_file_name(file_name, segment):
+    """File name of a segment of the recording file_name, e.g. run.raw -> run_0003.raw"""
+    stem, extension = os.path.splitext(file_name)
+    return "{}_{:04d}{}".format(stem, segment, extension)
+
+
+def index_file_name(file_name):
+    """Sidecar index of a raw file, e.g. run_0003.raw -> run_0003.json"""
+    return os.path.splitext(file_name)[0] + ".json"
+
+
+class SegmentIndex:
+    """Summary of the raw words written to one segment file
+
+    The words are passed to update as they are written. The longtimes are the times of the MSB
+    heartbeat words combined with the preceding LSB word in 25 ns units, as used by the
+    PacketProcessor. The LSB part is carried over from the previous segment, so the first MSB word of
+    a segment has a time even if its LSB word was written to the previous one.
+
+    Parameters
+    ----------
+    file_name : str
+        Segment file
+    segment : int
+        Number of the segment in the recording
+    start_time_ns : int
+        Start time header of the segment file
+    heartbeat_lsb : int
+        LSB part of the time of the last LSB heartbeat word of the previous segment, None if unknown
+    """
+
+    def __init__(self, file_name, segment, start_time_ns, heartbeat_lsb=None):
+        self.file_name = file_name
+        self.segment = segment
+        self.start_time_ns = start_time_ns
+        self.heartbeat_lsb = heartbeat_lsb
+        self.first_longtime = None
+        self.last_longtime = None
+        self.words = 0
+        self.triggers = 0
+        self.heartbeats = 0
+
+    def update(self, data):
+        """Add the raw words of data (bytes-like), a trailing incomplete word is ignored"""
+        data = memoryview(data).cast("B")
+        words = np.frombuffer(data, dtype="<u8", count=data.nbytes // 8)
+        header = words >> np.uint64(60)
+        subheader = (words >> np.uint64(56)) & np.uint64(0xF)
+        timer = (header == 0x4) | (header == 0x6)
+        self.words += words.shape[0]
+        self.triggers += int(np.count_nonzero(timer & (subheader == 0xF)))
+
+        lsb_indices = np.flatnonzero(timer & (subheader == 0x4))
+        msb_indices = np.flatnonzero(timer & (subheader == 0x5))
+        if msb_indices.size > 0:
+            lsb_times = (words[lsb_indices] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16)
+            last_lsb_of_msb = np.searchsorted(lsb_indices, msb_indices) - 1
+            known = last_lsb_of_msb >= 0
+            lsb = np.empty(msb_indices.shape[0], dtype=np.uint64)
+            lsb[known] = lsb_times[last_lsb_of_msb[known]]
+            if self.heartbeat_lsb is None:
+                msb_indices, lsb = msb_indices[known], lsb[known]
+            else:
+                lsb[~known] = self.heartbeat_lsb
+            longtimes = ((words[msb_indices] & np.uint64(0x00000000FFFF0000)) << np.uint64(16)) | lsb
+            if longtimes.size > 0:
+                if self.first_longtime is None:
+                    self.first_longtime = int(longtimes[0])
+                self.last_longtime = int(longtimes[-1])
+                self.heartbeats += longtimes.shape[0]
+        if lsb_indices.size > 0:
+            self.heartbeat_lsb = int((words[lsb_indices[-1]] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16))
+
+    def to_dict(self):
+        return {
+            "file": os.path.basename(self.file_name),
+            "segment": self.segment,
+            "start_time_ns": self.start_time_ns,
+            "first_longtime": self.first_longtime,
+            "last_longtime": self.last_longtime,
+            "words": self.words,
+            "triggers": self.triggers,
+            "heartbeats": self.heartbeats,
+        }
+
+    def save(self):
+        """Write the sidecar index next to the segment file"""
+        with open(index_file_name(self.file_name), "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+def load_segment_indices(file_name):
+    """Sidecar indices of all segments of the recording file_name, ordered by segment
+
+    Returns
+    -------
+    list of dict
+        see SegmentIndex.to_dict, "file" is the path of the segment file
+    """
+    stem, extension = os.path.splitext(file_name)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"_(\d{4,})" + re.escape(extension) + "$")
+    indices = []
+    for segment_file in glob.glob(glob.escape(stem) + "_*" + extension):
+        if pattern.match(os.path.basename(segment_file)) and os.path.exists(index_file_name(segment_file)):
+            with open(index_file_name(segment_file)) as f:
+                index = json.load(f)
+            index["file"] = segment_file
+            indices.append(index)
+    return sorted(indices, key=lambda index: index["segment"])
+
+
+def select_segments(file_name, start=None, stop=None):
+    """Segment files of the recording file_name which contain data between start and stop
+
+    The data of a segment lies between the last heartbeat before it and the first heartbeat after it,
+    which can be in other segments than the neighbouring ones.
+
+    Parameters
+    ----------
+    start, stop : int
+        Longtime range in 25 ns units, None for no limit
+    """
+    indices = load_segment_indices(file_name)
+    # the first heartbeat after each segment
+    following = [None] * len(indices)
+    for position in range(len(indices) - 2, -1, -1):
+        following[position] = indices[position + 1]["first_longtime"] or following[position + 1]
+    files = []
+    previous = None
+    for position, index in enumerate(indices):
+        # segments before the first heartbeat are dropped by the processing anyway
+        begin = previous if previous is not None else index["first_longtime"]
+        # the data after the last heartbeat of the recording
+        end = following[position]
+        if begin is not None and (stop is None or begin <= stop) and (start is None or end is None or end >= start):
+            files.append(index["file"])
+        if index["last_longtime"] is not None:
+            previous = index["last_longtime"]
+    return files
+
+
+class SegmentedRawFile(io.RawIOBase):
+    """Seekable, read-only view of segment files as one raw file
+
+    The stream starts with the start time header of the first segment, followed by the words of all
+    segments without their own headers. The segments can be compressed (see open_raw). Pass the
+    result of select_segments to process a time range of a segmented recording.
+
+    Parameters
+    ----------
+    file_names : list of str
+        Segment files in the order of the recording
+    """
+
+    def __init__(self, file_names):
+        super().__init__()
+        if len(file_names) == 0:
+            raise ValueError("No segment files")
+        self._file_names = [os.fspath(file_name) for file_name in file_names]
+        # offsets of the data of each segment in the stream, the first one with its header
+        self._offsets = [0]
+        for position, file_name in enumerate(self._file_names):
+            self._offsets.append(self._offsets[-1] + raw_size(file_name) - (8 if position > 0 else 0))
+        self._position = 0
+        self._segment = -1
+        self._file = None
+
+    @property
+    def size(self):
+        return self._offsets[-1]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer):
+        buffer = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < buffer.nbytes and self._position < self.size:
+            segment = bisect.bisect_right(self._offsets, self._position) - 1
+            file = self.__segment_file(segment)
+            # skip the start time header of the following segments
+            file.seek(self._position - self._offsets[segment] + (8 if segment > 0 else 0))
+            size = min(self._offsets[segment + 1] - self._position, buffer.nbytes - filled)
+            read = file.readinto(buffer[filled : filled + size])
+            if read == 0:
+                break
+            filled += read
+            self._position += read
+        return filled
+
+    def __segment_file(self, segment):
+        if segment != self._segment:
+            if self._file is not None:
+                self._file.close()
+            self._file = open_raw(self._file_names[segment])
+            self._segment = segment
+        return self._file
+
+    def close(self):
+        if not self.closed and self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
@@ -0,0 +1,283 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Coalescing writer for raw files with preallocation and optional direct I/O"""
+import errno
+import mmap
+import os
+import queue
+import threading
+import time
+
+from pymepix.core.log import Logger
+from pymepix.processing.raw_compression import RawCompressor
+
+# alignment of buffers, file offsets and sizes required for O_DIRECT
+_ALIGNMENT = 4_096
+
+
+class RawFileWriter(Logger):
+    """Writes a stream of small messages to a file in large aligned blocks
+
+    Messages are copied into one of two page aligned buffers of buffer_size bytes. A full buffer is
+    handed to a background thread which writes it with one system call while the next one is filled.
+    If both buffers are in use, write waits for the thread, this time is reported as behind_time.
+    The file is extended with posix_fallocate in steps of preallocate bytes, so the file system can
+    reserve contiguous extents, and truncated to the written size on close.
+
+    With direct the file is opened with O_DIRECT, bypassing the page cache. This falls back to normal
+    I/O if the platform or file system does not support it.
+
+    With compression each buffer is compressed by the background thread and the file is written in
+    the compressed container format, see RawCompressor and open_raw. Compressed blocks are not aligned,
+    so direct is ignored then.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file, an existing file is overwritten
+    buffer_size : int
+        Size of the buffers in bytes, rounded up to a multiple of 4096
+    preallocate : int
+        Bytes reserved at once when the file grows, 0 disables the preallocation
+    direct : bool
+        Whether to write with O_DIRECT
+    compression : str
+        Codec of the compressed container ("lz4", "zstd", "zlib" or "auto"), None writes a plain file
+    shuffle : bool
+        Whether the bytes of the words are shuffled before the compression
+    """
+
+    def __init__(
+        self,
+        file_name,
+        buffer_size=4 << 20,
+        preallocate=256 << 20,
+        direct=False,
+        compression=None,
+        shuffle=True,
+    ):
+        super().__init__("RawFileWriter")
+        self._file_name = file_name
+        self._buffer_size = -(-buffer_size // _ALIGNMENT) * _ALIGNMENT
+        self._preallocate = preallocate
+        self._compressor = None
+        if compression is not None:
+            self._compressor = RawCompressor(compression, shuffle)
+            if direct:
+                self.warning("O_DIRECT is not used for compressed files")
+                direct = False
+        self._fd, self._direct = self.__open(file_name, direct)
+
+        self._free = queue.Queue()
+        for _ in range(2):
+            self._free.put(mmap.mmap(-1, self._buffer_size))
+        self._full = queue.Queue()
+        self._buffer = self._free.get()
+        self._position = 0
+
+        self._written = 0
+        self._raw_bytes = 0
+        self._allocated = 0
+        self._write_time = 0.0
+        self._behind_time = 0.0
+        self._start = time.perf_counter()
+        self._elapsed = None
+        self._exception = None
+        if self._compressor is not None:
+            header = self._compressor.header()
+            self.__write(header, 0)
+            self._written = len(header)
+        self._thread = threading.Thread(target=self._write_buffers, daemon=True)
+        self._thread.start()
+
+    def __open(self, file_name, direct):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        if direct:
+            if not hasattr(os, "O_DIRECT"):
+                self.warning("O_DIRECT is not available, writing through the page cache")
+            else:
+                try:
+                    return os.open(file_name, flags | os.O_DIRECT, 0o644), True
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    self.warning("{} does not support O_DIRECT, writing through the page cache".format(file_name))
+        return os.open(file_name, flags, 0o644), False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def direct(self):
+        """Whether the file is written with O_DIRECT"""
+        return self._direct
+
+    @property
+    def statistics(self):
+        """Bytes in the file and before the compression, time spent compressing and writing, MB/s of the
+        uncompressed data and seconds write waited for the thread"""
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        return {
+            "bytes": self._written,
+            "raw_bytes": self._raw_bytes,
+            "ratio": self._raw_bytes / self._written if self._written > 0 else 1.0,
+            "write_time": self._write_time,
+            "mb_per_s": self._raw_bytes / self._write_time * 1e-6 if self._write_time > 0 else 0.0,
+            "behind_time": self._behind_time,
+            "elapsed": elapsed,
+        }
+
+    def write(self, data):
+        """Copy data (bytes-like) into the buffers, full buffers are written by the background thread"""
+        self.__raise_exception()
+        data = memoryview(data).cast("B")
+        while data.nbytes > 0:
+            size = min(data.nbytes, self._buffer_size - self._position)
+            self._buffer[self._position : self._position + size] = data[:size]
+            self._position += size
+            data = data[size:]
+            if self._position == self._buffer_size:
+                self.__submit()
+
+    def __submit(self):
+        self._full.put((self._buffer, self._position))
+        start = time.perf_counter()
+        self._buffer = self._free.get()
+        self._behind_time += time.perf_counter() - start
+        self._position = 0
+
+    def close(self):
+        """Write the buffered data, wait for the writing thread and close the file"""
+        if self._fd is None:
+            return
+        if self._position > 0:
+            self.__submit()
+        self._full.put(None)
+        self._thread.join()
+        try:
+            # remove the preallocated space and the padding of the last block
+            os.ftruncate(self._fd, self._written)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._elapsed = time.perf_counter() - self._start
+            for buffer in (self._buffer, *self.__free_buffers()):
+                buffer.close()
+        self.__raise_exception()
+
+    def __free_buffers(self):
+        while not self._free.empty():
+            yield self._free.get_nowait()
+
+    def __raise_exception(self):
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise exception
+
+    def _write_buffers(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            buffer, length = item
+            if self._exception is None:
+                try:
+                    self.__write_buffer(buffer, length)
+                except Exception as e:
+                    self.error("Writing to {} failed: {}".format(self._file_name, str(e)))
+                    self._exception = e
+            self._free.put(buffer)
+
+    def __write_buffer(self, buffer, length):
+        start = time.perf_counter()
+        view = memoryview(buffer)
+        self._raw_bytes += length
+        if self._compressor is not None:
+            data = self._compressor.compress(view[:length])
+            view.release()
+            view = memoryview(data)
+            length = size = len(data)
+        else:
+            # O_DIRECT writes whole blocks, the padding of the last one is truncated on close
+            size = -(-length // _ALIGNMENT) * _ALIGNMENT if self._direct else length
+        self.__reserve(self._written + size)
+        self.__write(view[:size], self._written)
+        view.release()
+        self._write_time += time.perf_counter() - start
+        self._written += length
+
+    def __write(self, data, offset):
+        written = 0
+        while written < len(data):
+            written += os.pwrite(self._fd, data[written:], offset + written)
+
+    def __reserve(self, end):
+        if self._preallocate <= 0 or end <= self._allocated:
+            return
+        size = max(self._preallocate, end - self._allocated)
+        try:
+            os.posix_fallocate(self._fd, self._allocated, size)
+            self._allocated += size
+        except (AttributeError, OSError) as e:
+            # not supported by the platform or file system
+            self.warning("Preallocation of {} failed, disabled: {}".format(self._file_name, str(e)))
+            self._preallocate = 0
+
+
+def main():
+    import tempfile
+
+    message = os.urandom(64 * 1024)
+    total = 512 << 20
+    with tempfile.TemporaryDirectory(dir=".") as directory:
+        file_name = os.path.join(directory, "raw.bin")
+        start = time.perf_counter()
+        with open(file_name, "wb") as f:
+            for _ in range(total // len(message)):
+                f.write(message)
+            f.flush()
+            os.fsync(f.fileno())
+        print("file.write per message: {:.0f} MB/s".format(total / (time.perf_counter() - start) * 1e-6))
+
+        for direct in (False, True):
+            start = time.perf_counter()
+            writer = RawFileWriter(file_name, direct=direct)
+            for _ in range(total // len(message)):
+                writer.write(message)
+            writer.close()
+            fd = os.open(file_name, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+            print(
+                "RawFileWriter (direct {}): {:.0f} MB/s, {}".format(
+                    writer.direct, total / (time.perf_counter() - start) * 1e-6, writer.statistics
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
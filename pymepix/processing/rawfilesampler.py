@@ -20,14 +20,50 @@
 import time
 import os
 import struct
+import multiprocessing as mp
 
 import numpy as np
-import h5py
 from .logic.packet_processor import PacketProcessor
 from .logic.centroid_calculator import CentroidCalculator, CentroidCalculatorPooled
+from .hdf5writer import Hdf5Writer
+from .raw_compression import open_raw, raw_size
+from .raw_index import HeartbeatIndex
 
 
 class RawFileSampler():
+    """Post-processing of raw files: decoding, event building, centroiding and saving to HDF5
+
+    The raw file is streamed in blocks of block_size 64-bit words. Heartbeat words are located with
+    NumPy masks and the pixel and trigger words between heartbeats, which lie more than 5 s apart,
+    are handed to the PacketProcessor as a whole.
+
+    With more than one process the file is first scanned for these segments only. The segments are
+    decoded and centroided in a pool of worker processes and the results are written in order, with
+    the trigger numbers continued from segment to segment. To restore the carry-over pixels and
+    triggers of the previous segment, each worker first processes the data following the last overlap
+    triggers before its segment and discards the resulting events.
+
+    Raw files written in the compressed container (see RawFileWriter) are decompressed while reading,
+    block by block.
+
+    Instead of a file name, a list of segment files of a recording split by Raw2Disk can be passed,
+    they are processed as one file (see SegmentedRawFile). With select_segments only the segments of
+    a time range are read.
+
+    Parameters
+    ----------
+    number_of_processes : int
+        Number of worker processes, -1 uses all cores. None or 1 processes the file in this process.
+    block_size : int
+        Number of 64-bit words read from the file at once
+    overlap : int
+        Number of trigger words before a segment, from which on the data is processed in advance to
+        restore the state of the PacketProcessor. The PacketProcessor needs at least 4 triggers.
+    write_buffer_size : int
+        Number of raw event rows collected before they are written to the output file, see Hdf5Writer
+    compression : str
+        HDF5 compression filter of the output datasets, e.g. "gzip" or "lzf"
+    """
 
     def __init__(
         self,
@@ -36,7 +72,11 @@ class RawFileSampler():
         number_of_processes=None,
         timewalk_file=None,
         cent_timewalk_file=None,
-        progress_callback=None
+        progress_callback=None,
+        block_size=1 << 22,
+        overlap=16,
+        write_buffer_size=1 << 20,
+        compression=None,
     ):
         self._filename = file_name
         self._output_file = output_file
@@ -45,11 +85,16 @@ class RawFileSampler():
 
         self._number_of_processes = number_of_processes
         self._progress_callback = progress_callback
+        self._block_size = block_size
+        self._overlap = overlap
+        self._write_buffer_size = write_buffer_size
+        self._compression = compression
+        self._writer = None
 
     def init_new_process(self, file):
         """create connections and initialize variables in new process"""
         self._startTime = None
-        with open(self._filename, 'rb') as file:
+        with open_raw(self._filename) as file:
             self._startTime = struct.unpack("L", file.read(8))[0]
 
         self._longtime = -1
@@ -71,11 +116,7 @@ class RawFileSampler():
     def pre_run(self):
         """init stuff which should only be available in new process"""
 
-        try:
-            os.remove(self._output_file)
-        except OSError:
-            pass
-
+        self.__open_writer()
         self.init_new_process(self._filename)
         self._last_update = time.time()
 
@@ -90,24 +131,45 @@ class RawFileSampler():
             self.__calculate_and_save_centroids(*result)
 
         self.centroid_calculator.post_process()
+        self.__close_writer()
 
-    def bytes_from_file(self, chunksize=8192):
-        print("Reading to memory", flush=True)
-        with open(self._filename, 'rb') as file:
-            ba = np.fromfile(file, dtype="<u8")
-        print("Done", flush=True)
-
-        packets_to_process = len(ba)
-        packets_processed = 0
+    def __open_writer(self):
+        try:
+            os.remove(self._output_file)
+        except OSError:
+            pass
 
-        for b in np.nditer(ba):
-            yield b
-            packets_processed += 1
-            if self._progress_callback is not None:
-                self._progress_callback(packets_processed / packets_to_process)
+        if self._output_file is not None:
+            self._writer = Hdf5Writer(
+                self._output_file, buffer_size=self._write_buffer_size, compression=self._compression
+            )
 
-    def handle_lsb_time(self, pixdata):
-        self._longtime_lsb = (pixdata & 0x0000FFFFFFFF0000) >> 16
+    def __close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def blocks_from_file(self, report_progress=True, start=0, stop=None):
+        """Reads the raw file block by block into a reused buffer to keep the resident memory bounded
+
+        The 8 byte start time header is skipped. A trailing incomplete word is ignored. Only the words
+        start to stop (exclusive, None for the end of the file) are read.
+        """
+        stop = (raw_size(self._filename) - 8) // 8 if stop is None else stop
+        buffer = memoryview(bytearray(self._block_size * 8))
+        with open_raw(self._filename) as file:
+            file.seek(8 + start * 8)
+            position = start
+            while position < stop:
+                bytes_read = file.readinto(buffer[: min(self._block_size, stop - position) * 8])
+                words_read = bytes_read // 8
+                if words_read == 0:
+                    break
+                position += words_read
+                # the slices of the block kept by process_block are copies, so the buffer can be reused
+                yield np.frombuffer(buffer, dtype="<u8", count=words_read)
+                if report_progress and self._progress_callback is not None:
+                    self._progress_callback((position - start) / max(stop - start, 1))
 
     def handle_msb_time(self, pixdata):
         self._longtime_msb = (pixdata & 0x00000000FFFF0000) << 16
@@ -138,24 +200,168 @@ class RawFileSampler():
         else:
             return False
 
-    def handle_other(self, pixdata):
-        """trash data which arrives before 1st timestamp data (heartbeat)"""
-        if self._longtime == -1:
-            return
-
-        self._packet_buffer.append(pixdata)
-
-    def push_data(self, post=False):
-        result = self.__run_packet_processor(self._packet_buffer)
+    @staticmethod
+    def __useful_words(header, subheader):
+        """Mask of the pixel and trigger words"""
+        return (header == 0xA) | (header == 0xB) | (((header == 0x4) | (header == 0x6)) & (subheader == 0xF))
+
+    def scan_block(self, block, header, subheader):
+        """Update the time from the heartbeat words in block and find the words at which data is pushed
+
+        Only the MSB heartbeat words are handled one by one. The LSB part of the time for each MSB word
+        is the last LSB word before it, which can also be in one of the previous blocks.
+
+        Returns
+        -------
+        start : int
+            Index of the first word to keep, the data before the first heartbeat is dropped
+        pushes : list of (int, int)
+            Index of the MSB heartbeat word ending a segment and the longtime to process the segment with
+        """
+        timer = (header == 0x4) | (header == 0x6)
+        lsb_indices = np.flatnonzero(timer & (subheader == 0x4))
+        msb_indices = np.flatnonzero(timer & (subheader == 0x5))
+        lsb_times = (block[lsb_indices] & 0x0000FFFFFFFF0000) >> 16
+        last_lsb_of_msb = np.searchsorted(lsb_indices, msb_indices) - 1
+
+        start = 0 if self._longtime != -1 else block.shape[0]
+        pushes = []
+        for msb_index, lsb_index in zip(msb_indices.tolist(), last_lsb_of_msb.tolist()):
+            if lsb_index >= 0:
+                self._longtime_lsb = int(lsb_times[lsb_index])
+            if self._longtime == -1:
+                # trash data which arrives before 1st timestamp data (heartbeat)
+                start = msb_index
+            if self.handle_msb_time(int(block[msb_index])):
+                pushes.append((msb_index, self._longtime))
+
+        if lsb_indices.size > 0:
+            self._longtime_lsb = int(lsb_times[-1])
+
+        return start, pushes
+
+    def process_block(self, block):
+        """Split a block of raw words at the heartbeats and push the pixel and trigger words"""
+        header = (block >> 60) & 0xF
+        subheader = (block >> 56) & 0xF
+        useful = self.__useful_words(header, subheader)
+
+        segment_start, pushes = self.scan_block(block, header, subheader)
+        for msb_index, longtime in pushes:
+            self.__buffer_packets(block[segment_start:msb_index], useful[segment_start:msb_index])
+            self.push_data(longtime=longtime)
+            segment_start = msb_index + 1
+
+        self.__buffer_packets(block[segment_start:], useful[segment_start:])
+
+    def scan_segments(self):
+        """Find the segments of the file which are pushed to the PacketProcessor as a whole
+
+        Returns
+        -------
+        list of (int, int, int, int)
+            First and last (exclusive) word of each segment in the file, without the start time header,
+            the longtime used for the segment and the first word of the warm-up before the segment
+        """
+        segments = []
+        segment_start, warmup_start = None, None
+        recent_triggers = np.empty(0, dtype=np.int64)
+        block_offset = 0
+        for block in self.blocks_from_file(report_progress=False):
+            header = (block >> 60) & 0xF
+            subheader = (block >> 56) & 0xF
+            start, pushes = self.scan_block(block, header, subheader)
+            if segment_start is None and self._longtime != -1:
+                segment_start = warmup_start = block_offset + start
+
+            triggers = np.flatnonzero(((header == 0x4) | (header == 0x6)) & (subheader == 0xF)) + block_offset
+            triggers = np.concatenate((recent_triggers, triggers))
+            for msb_index, longtime in pushes:
+                segments.append((segment_start, block_offset + msb_index, longtime, warmup_start))
+                segment_start = block_offset + msb_index + 1
+                first_trigger = np.searchsorted(triggers, segment_start) - self._overlap
+                if self._overlap == 0:
+                    warmup_start = segment_start
+                elif first_trigger >= 0:
+                    warmup_start = max(warmup_start, int(triggers[first_trigger]))
+            recent_triggers = triggers[max(triggers.size - self._overlap, 0):]
+            block_offset += block.shape[0]
+
+        if segment_start is not None:
+            segments.append((segment_start, block_offset, self._longtime, warmup_start))
+        return segments
+
+    def __segment_tasks(self, segments):
+        """Tasks for process_segment, the warm-up ranges are the parts of the previous segments after
+        the warm-up start"""
+        tasks = []
+        for index, (start, stop, longtime, warmup_start) in enumerate(segments):
+            warmup = []
+            for previous_start, previous_stop, previous_longtime, _ in reversed(segments[:index]):
+                if previous_stop <= warmup_start:
+                    break
+                warmup.insert(0, (max(previous_start, warmup_start), previous_stop, previous_longtime))
+            tasks.append((warmup, (start, stop, longtime), index == len(segments) - 1))
+        return tasks
+
+    def __read_segment(self, file, start, stop):
+        file.seek(8 + start * 8)
+        packets = np.frombuffer(file.read((stop - start) * 8), dtype="<u8")
+        return packets[self.__useful_words((packets >> 60) & 0xF, (packets >> 56) & 0xF)]
+
+    def process_segment(self, warmup, segment, last):
+        """Decode and centroid one segment, called in the worker processes
+
+        The PacketProcessor is reset and the warm-up ranges are processed first without using the
+        results, the trigger numbers of the segment start at 0.
+
+        Returns
+        -------
+        results : list of (event_data, centroids, timestamps)
+        trigger_count : int
+            Number of trigger numbers used by the segment
+        """
+        self.packet_processor.clearBuffers()
+        results = []
+        with open_raw(self._filename) as file:
+            for start, stop, longtime in warmup:
+                self.__run_packet_processor([self.__read_segment(file, start, stop)], longtime)
+            self.packet_processor.trigger_counter = 0
+
+            start, stop, longtime = segment
+            result = self.__run_packet_processor([self.__read_segment(file, start, stop)], longtime)
+        if result is not None:
+            results.append(result)
+        if last:
+            result = self.packet_processor.post_process()
+            if result is not None:
+                results.append(result)
+
+        results = [
+            (event_data, self.centroid_calculator.process(event_data), timestamps)
+            for event_data, _pixel_data, timestamps in results
+        ]
+        return results, self.packet_processor.trigger_counter
+
+    def __buffer_packets(self, packets, useful):
+        packets = packets[useful]
+        if packets.size > 0:
+            self._packet_buffer.append(packets)
+
+    def push_data(self, post=False, longtime=None):
+        if longtime is None:
+            longtime = self._longtime
+        result = self.__run_packet_processor(self._packet_buffer, longtime)
 
         self._packet_buffer = []
         if result is not None:
             self.__calculate_and_save_centroids(*result)
 
-    def __run_packet_processor(self, packet_buffer):
+    def __run_packet_processor(self, packet_buffer, longtime):
+        packet_buffer = [packets for packets in packet_buffer if packets.size > 0]
         if len(packet_buffer) > 0:
-            packet_buffer.append(np.uint64(self._longtime))
-            return self.packet_processor.process(np.array(packet_buffer, dtype=np.uint64).tobytes())
+            packet_buffer.append(np.array([longtime], dtype=np.uint64))
+            return self.packet_processor.process(np.concatenate(packet_buffer).tobytes())
 
         return None
 
@@ -165,109 +371,129 @@ class RawFileSampler():
 
     def saveToHDF5(self, output_file, raw, clusters, timeStamps):
         if output_file is not None:
-            with h5py.File(output_file, "a") as f:
-                names = ["trigger nr", "x", "y", "tof", "tot avg", "tot max", "clustersize"]
-                ###############
-                # save centroided data
-                if clusters is not None:
-                    if f.keys().__contains__("centroided"):
-                        for i, key in enumerate(names):
-                            dset = f["centroided"][key]
-                            dset.resize(dset.shape[0] + len(clusters[i]), axis=0)
-                            dset[-len(clusters[i]) :] = clusters[i]
-                    else:
-                        grp = f.create_group("centroided")
-                        grp.attrs["description"] = "centroided events"
-                        grp.attrs["nr events"] = 0
-                        for i, key in enumerate(names):
-                            grp.create_dataset(key, data=clusters[i], maxshape=(None,))
-                        f["centroided/tot max"].attrs["unit"] = "s"
-                        f["centroided/tot avg"].attrs["unit"] = "s"
-                        f["centroided/tot max"].attrs[
-                            "description"
-                        ] = "maximum of time above threshold in cluster"
-                        f["centroided/tot avg"].attrs[
-                            "description"
-                        ] = "mean of time above threshold in cluster"
-                        f["centroided/tof"].attrs["unit"] = "s"
-                        f["centroided/x"].attrs["unit"] = "pixel"
-                        f["centroided/y"].attrs["unit"] = "pixel"
-                # out_file.flush()
-
-                ###############
-                # save raw data
-                if raw is not None:
-                    names = ["trigger nr", "x", "y", "tof", "tot"]
-                    if f.keys().__contains__("raw"):
-                        for i, key in enumerate(names):
-                            dset = f["raw"][key]
-                            dset.resize(dset.shape[0] + len(raw[i]), axis=0)
-                            dset[-len(raw[i]) :] = raw[i]
-                    else:
-                        grp = f.create_group("raw")
-                        grp.attrs["description"] = "timewalk correted raw events"
-                        grp.attrs["nr events"] = 0
-                        grp.create_dataset("trigger nr", data=raw[0].astype(np.uint64), maxshape=(None,))
-                        grp.create_dataset("x", data=raw[1].astype(np.uint8), maxshape=(None,))
-                        grp.create_dataset("y", data=raw[2].astype(np.uint8), maxshape=(None,))
-                        grp.create_dataset("tof", data=raw[3], maxshape=(None,))
-                        grp.create_dataset("tot", data=raw[4].astype(np.uint32), maxshape=(None,))
-
-                        f["raw/tof"].attrs["unit"] = "s"
-                        f["raw/tot"].attrs["unit"] = "s"
-                        f["raw/x"].attrs["unit"] = "pixel"
-                        f["raw/y"].attrs["unit"] = "pixel"
-
-                ###############
-                # save time stamp data                
-                if timeStamps is not None and self._startTime is not None:
-                    names = ["trigger nr", "timestamp"]
-                    if f.keys().__contains__("timing/timepix"):
-                        for i, key in enumerate(names):
-                            dset = f["timing/timepix"][key]
-                            dset.resize(dset.shape[0] + len(timeStamps[i]), axis=0)
-                            dset[-len(timeStamps[i]) :] = timeStamps[i]
-                    else:
-                        grp = f.create_group("timing")
-                        grp.attrs["description"] = "timing information from TimePix and facility"
-                        subgrp = grp.create_group("timepix")
-                        subgrp.attrs["description"] = "timing information from TimePix"
-                        subgrp.attrs["nr events"] = 0
-                        for i, key in enumerate(names):
-                            subgrp.create_dataset(
-                                key, data=timeStamps[i].astype(np.uint64), maxshape=(None,)
-                            )
-                        f["timing/timepix/timestamp"].attrs["unit"] = "ns"
+            if self._startTime is None:
+                timeStamps = None
+            self._writer.write(raw, clusters, timeStamps)
+
+    def __number_of_workers(self):
+        if self._number_of_processes == -1:
+            return os.cpu_count()
+        return self._number_of_processes or 1
 
     def run(self):
         """method which is executed in new process via multiprocessing.Process.start"""
+        if self.__number_of_workers() > 1:
+            self.run_parallel()
+            return
+
         self.pre_run()
 
-        for packet in self.bytes_from_file():
-            # if we'd leave this with numpy we had to write
-            # ((packet & 0xF000000000000000) >> np.uint64(60)) & np.uint64(0xF)
-            # see: https://stackoverflow.com/questions/30513741/python-bit-shifting-with-numpy
-            pixdata = int(packet)
-            header = ((pixdata & 0xF000000000000000) >> 60) & 0xF
-            should_push = False
-            # Read Pixel Matrix Sequential (Header=0hA0)
-            # Read Pixel Matrix Data-Driven (Header=0hB0)
-            if header == 0xA or header == 0xB:
-                self.handle_other(pixdata)
-            # 0x4X timer configuration
-            elif header == 0x4 or header == 0x6:
-                subheader = ((pixdata & 0x0F00000000000000) >> 56) & 0xF
-                if subheader == 0xF:
-                    self.handle_other(pixdata)
-                elif subheader == 0x4:
-                    self.handle_lsb_time(pixdata)
-                elif subheader == 0x5:
-                    should_push = self.handle_msb_time(pixdata)
-
-            if should_push:
-                self.push_data()
+        for block in self.blocks_from_file():
+            self.process_block(block)
 
         if len(self._packet_buffer) > 0:
             self.push_data()
-        
+
         self.post_run()
+
+    def run_range(self, start=None, stop=None, first_trigger=None, stop_trigger=None):
+        """Process only the data of a time or trigger range
+
+        The heartbeat index of the file (see HeartbeatIndex) is read from its sidecar or built once,
+        then the file is read from the last heartbeat at which run pushes data before the range to the
+        heartbeat after it, so the data is pushed in the same chunks as by run. The trigger numbers are
+        the same as when the whole file is processed. Triggers close to the range can be included as well.
+
+        Parameters
+        ----------
+        start, stop : float
+            Time range in seconds after the first heartbeat of the file, None for no limit
+        first_trigger, stop_trigger : int
+            Range of trigger numbers (stop_trigger exclusive), used instead of the time range if given
+        """
+        index = HeartbeatIndex.load(self._filename)
+        if first_trigger is not None or stop_trigger is not None:
+            word_range = index.trigger_range(first_trigger, stop_trigger)
+        else:
+            word_range = index.time_range(start, stop)
+
+        self.pre_run()
+        if word_range is not None:
+            first_word, stop_word, longtime, trigger_count = word_range
+            # state at the heartbeat, as if the file had been processed up to there
+            self._longtime_lsb = longtime & 0xFFFFFFFF
+            self.packet_processor.trigger_counter = trigger_count
+            for block in self.blocks_from_file(start=first_word, stop=stop_word):
+                self.process_block(block)
+
+            if len(self._packet_buffer) > 0:
+                self.push_data()
+
+        self.post_run()
+
+    def run_parallel(self):
+        """Process the segments of the file in a pool of worker processes"""
+        self.__open_writer()
+        self.init_new_process(self._filename)
+
+        tasks = self.__segment_tasks(self.scan_segments())
+        trigger_offset = 0
+        with mp.Pool(
+            self.__number_of_workers(),
+            initializer=_init_segment_worker,
+            initargs=(self._filename, self.timewalk_file, self.cent_timewalk_file),
+        ) as pool:
+            for index, (results, trigger_count) in enumerate(pool.imap(_process_segment, tasks)):
+                for event_data, centroids, timestamps in results:
+                    if event_data is not None:
+                        event_data = (event_data[0] + trigger_offset, *event_data[1:])
+                    if centroids is not None:
+                        centroids = np.copy(centroids)
+                        centroids[0] += trigger_offset
+                    if timestamps is not None:
+                        timestamps = (timestamps[0] + trigger_offset, timestamps[1])
+                    self.saveToHDF5(self._output_file, event_data, centroids, timestamps)
+                trigger_offset += trigger_count
+                if self._progress_callback is not None:
+                    self._progress_callback((index + 1) / len(tasks))
+        self.__close_writer()
+
+
+_segment_sampler = None
+
+
+def _init_segment_worker(file_name, timewalk_file, cent_timewalk_file):
+    global _segment_sampler
+    _segment_sampler = RawFileSampler(
+        file_name, None, timewalk_file=timewalk_file, cent_timewalk_file=cent_timewalk_file
+    )
+    _segment_sampler.init_new_process(file_name)
+    _segment_sampler.packet_processor.pre_process()
+    _segment_sampler.centroid_calculator.pre_process()
+
+
+def _process_segment(task):
+    return _segment_sampler.process_segment(*task)
+
+
+def main():
+    """Compare the runtime of the post-processing with an increasing number of processes
+
+    Usage: python -m pymepix.processing.rawfilesampler <raw file> [max number of processes]
+    """
+    import sys
+    import tempfile
+
+    file_name = sys.argv[1]
+    max_processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as folder:
+        number_of_processes = 1
+        while number_of_processes <= max_processes:
+            start = time.perf_counter()
+            RawFileSampler(file_name, os.path.join(folder, "output.hdf5"), number_of_processes).run()
+            print(f"{number_of_processes:3d} processes: {time.perf_counter() - start:8.2f} s")
+            number_of_processes *= 2
+
+
+if __name__ == "__main__":
+    main()
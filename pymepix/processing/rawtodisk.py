@@ -27,6 +27,8 @@ import numpy as np
 import zmq
 
 from pymepix.core.log import ProcessLogger
+from pymepix.processing.raw_segments import SegmentIndex, segment_file_name
+from pymepix.processing.raw_writer import RawFileWriter
 
 
 # Class to write raw data to files using ZMQ and a new thread to prevent IO blocking
@@ -34,13 +36,42 @@ class Raw2Disk(ProcessLogger):
     """
     Class for asynchronously writing raw files
     Intended to allow writing of raw data while minimizing impact on UDP reception reliability.
+
+    The messages are coalesced into large blocks by a RawFileWriter, buffer_size, preallocate, direct
+    and compression are passed to it.
+
+    With segment_size (bytes) or segment_time (seconds) a recording is split into numbered segment
+    files, e.g. run_0000.raw, run_0001.raw, ... for run.raw. A new segment is started once the limit
+    is reached, each one begins with its own start time header and gets a sidecar index with its
+    first and last heartbeat time and number of triggers (see SegmentIndex and select_segments).
+
+    The commands (file name, "SHUTDOWN") are received from the process bound to control_address.
     """
 
-    def __init__(self, context=None):
+    def __init__(
+        self,
+        context=None,
+        buffer_size=4 << 20,
+        preallocate=256 << 20,
+        direct=False,
+        segment_size=0,
+        segment_time=0.0,
+        compression=None,
+        control_address="tcp://127.0.0.1:40000",
+    ):
         """ Need to pass a ZMQ context object to ensure that inproc sockets can be created """
         ProcessLogger.__init__(self, "Raw2Disk")
 
         self.info("init raw2disk")
+        self._writer_args = {
+            "buffer_size": buffer_size,
+            "preallocate": preallocate,
+            "direct": direct,
+            "compression": compression,
+        }
+        self._segment_size = segment_size
+        self._segment_time = segment_time
+        self._control_address = control_address
 
         self.writing = False  # Keep track of whether we're currently writing a file
         self.stop_thr = False
@@ -78,8 +109,8 @@ class Raw2Disk(ProcessLogger):
         inproc_sock.connect(sock_addr)
         # socket for cummunication with main
         z_sock = context.socket(zmq.PAIR)
-        z_sock.connect("tcp://127.0.0.1:40000")
-        self.info("zmq connect to 'tcp://127.0.0.1:40000'")
+        z_sock.connect(self._control_address)
+        self.info(f"zmq connect to '{self._control_address}'")
 
         # socket to maxwell
         max_sock = context.socket(zmq.PUSH)
@@ -90,6 +121,7 @@ class Raw2Disk(ProcessLogger):
         writing = False
         shutdown = False
         filehandle = None
+        index = None
 
         while not shutdown:
             # wait for instructions, valid commands are
@@ -103,14 +135,12 @@ class Raw2Disk(ProcessLogger):
                     shutdown = True
                 else:  # Interpret as file name / path
                     filename = cmd
-                    if not os.path.exists(filename):
+                    if not os.path.exists(self.__segment_name(filename, 0)):
                         self.info(f"File {filename} opening")
 
                         # Open filehandle
-                        filehandle = open(filename, "wb")
-                        filehandle.write(
-                            time.time_ns().to_bytes(8, "little")
-                        )  # add start time into file
+                        segment = 0
+                        filehandle, index = self.__open_segment(filename, segment)
                         z_sock.send_string("OPENED")
 
                         waiting = False
@@ -136,18 +166,18 @@ class Raw2Disk(ProcessLogger):
                 if writing is True:
                     # print(np.frombuffer(data_view, dtype=np.uint64))
                     filehandle.write(data_view)
+                    if index is not None:
+                        index.update(data_view)
+                        if self.__segment_full(filehandle, index):
+                            self.__close_segment(filehandle, index, max_sock)
+                            segment += 1
+                            filehandle, index = self.__open_segment(filename, segment, index.heartbeat_lsb)
 
             # close file
             if filehandle is not None:
-                self.debug("closing file")
-                filehandle.flush()
-                filehandle.close()
-                self.debug("file closed")
+                self.__close_segment(filehandle, index, max_sock)
                 z_sock.send_string("CLOSED")
                 filehandle = None
-                max_sock.send_string(
-                    filename
-                )  # send filename to maxwell for conversion
             waiting = True
 
         # We reach this point only after "SHUTDOWN" command received
@@ -157,6 +187,42 @@ class Raw2Disk(ProcessLogger):
         inproc_sock.close()
         self.debug("Thread is finished")
 
+    def __segment_name(self, filename, segment):
+        if self._segment_size > 0 or self._segment_time > 0:
+            return segment_file_name(filename, segment)
+        return filename
+
+    def __open_segment(self, filename, segment, heartbeat_lsb=None):
+        """Writer of a new file with start time header and its index, None without segmenting"""
+        segment_name = self.__segment_name(filename, segment)
+        start_time = time.time_ns()
+        filehandle = RawFileWriter(segment_name, **self._writer_args)
+        filehandle.write(start_time.to_bytes(8, "little"))  # add start time into file
+        index = None
+        if segment_name != filename:
+            index = SegmentIndex(segment_name, segment, start_time, heartbeat_lsb)
+            self._segment_opened = time.monotonic()
+        return filehandle, index
+
+    def __segment_full(self, filehandle, index):
+        return (self._segment_size > 0 and index.words * 8 >= self._segment_size) or (
+            self._segment_time > 0 and time.monotonic() - self._segment_opened >= self._segment_time
+        )
+
+    def __close_segment(self, filehandle, index, max_sock):
+        self.debug("closing file")
+        filehandle.close()
+        file_name = filehandle.file_name
+        if index is not None:
+            index.save()
+        statistics = filehandle.statistics
+        self.info(
+            "File {} closed, {:.1f} MB written at {:.1f} MB/s, {:.3f} s waiting for the disk".format(
+                file_name, statistics["bytes"] * 1e-6, statistics["mb_per_s"], statistics["behind_time"]
+            )
+        )
+        max_sock.send_string(file_name)  # send filename to maxwell for conversion
+
     def open_file(self, socket, filename):
         """
         Creates a file with a given filename and path.
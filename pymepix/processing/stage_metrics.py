@@ -0,0 +1,149 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Processing time, queue depth and throughput of the pipeline objects in shared memory"""
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+# process time histogram: bucket i counts durations below 2**i microseconds, the last one all longer ones
+HISTOGRAM_BUCKETS = 21
+
+
+class StageMetrics:
+    """Counters of one pipeline process, written by the process and read by the controlling process
+
+    The process accumulates the counters locally and stores them into shared memory every store_interval
+    seconds, so recording a message costs about a microsecond.
+
+    Counters
+    --------
+    messages_in : messages processed (merged messages count once)
+    messages_out : messages pushed to the output queues
+    bytes_in : bytes of the arrays of the processed messages
+    bytes_out : bytes of the arrays of the pushed messages
+    process_time_ns : total time spent processing
+    queue_depth : messages waiting in the input queue at the last sample
+    queue_depth_max : largest sampled input queue depth
+    update_time_ns : time of the last store
+    histogram_<i> : number of messages processed in less than 2**i microseconds
+    """
+
+    FIELDS = (
+        "messages_in",
+        "messages_out",
+        "bytes_in",
+        "bytes_out",
+        "process_time_ns",
+        "queue_depth",
+        "queue_depth_max",
+        "update_time_ns",
+    ) + tuple("histogram_{}".format(bucket) for bucket in range(HISTOGRAM_BUCKETS))
+
+    def __init__(self, store_interval=0.1):
+        self._values = multiprocessing.Array(ctypes.c_uint64, len(self.FIELDS), lock=False)
+        self._store_interval_ns = int(store_interval * 1e9)
+        self._reset_local()
+
+    def _reset_local(self):
+        self._messages_in = 0
+        self._messages_out = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._process_time_ns = 0
+        self._queue_depth = 0
+        self._queue_depth_max = 0
+        self._histogram = [0] * HISTOGRAM_BUCKETS
+        self._last_store_ns = 0
+
+    def record(self, start_ns, nbytes=0):
+        """Record a processed message which took from start_ns (time.perf_counter_ns) until now"""
+        now = time.perf_counter_ns()
+        duration = now - start_ns
+        self._messages_in += 1
+        self._bytes_in += nbytes
+        self._process_time_ns += duration
+        self._histogram[min((duration // 1_000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        if now - self._last_store_ns > self._store_interval_ns:
+            self.store()
+
+    def record_output(self, nbytes=0):
+        self._messages_out += 1
+        self._bytes_out += nbytes
+
+    def sample_queue(self, depth):
+        self._queue_depth = depth
+        self._queue_depth_max = max(self._queue_depth_max, depth)
+
+    def store(self):
+        """Write the local counters to shared memory"""
+        self._last_store_ns = time.perf_counter_ns()
+        self._values[:] = [
+            self._messages_in,
+            self._messages_out,
+            self._bytes_in,
+            self._bytes_out,
+            self._process_time_ns,
+            self._queue_depth,
+            self._queue_depth_max,
+            time.time_ns(),
+        ] + self._histogram
+
+    def reset(self):
+        self._reset_local()
+        self._values[:] = [0] * len(self.FIELDS)
+
+    def snapshot(self):
+        """Current counters as dict, with the histogram as list and the mean process time in seconds"""
+        values = self._values[:]
+        result = dict(zip(self.FIELDS[: -HISTOGRAM_BUCKETS], values[:-HISTOGRAM_BUCKETS]))
+        result["histogram"] = values[-HISTOGRAM_BUCKETS:]
+        result["mean_process_time"] = (
+            result["process_time_ns"] * 1e-9 / result["messages_in"] if result["messages_in"] > 0 else 0.0
+        )
+        return result
+
+    @staticmethod
+    def quantile(snapshot, q):
+        """Upper bound of the q quantile of the process time in seconds from the histogram, None without messages"""
+        counts = np.cumsum(snapshot["histogram"])
+        if counts[-1] == 0:
+            return None
+        bucket = int(np.searchsorted(counts, q * counts[-1]))
+        return 2 ** bucket * 1e-6
+
+    @staticmethod
+    def rates(previous, current):
+        """Messages and bytes per second in and out between two snapshots"""
+        elapsed = (current["update_time_ns"] - previous["update_time_ns"]) * 1e-9
+        names = ("messages_in", "messages_out", "bytes_in", "bytes_out")
+        if elapsed <= 0:
+            return {"{}_per_s".format(name): 0.0 for name in names}
+        return {"{}_per_s".format(name): (current[name] - previous[name]) / elapsed for name in names}
+
+
+def nbytes(data):
+    """Bytes of the numpy arrays in data, also nested in tuples"""
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, tuple):
+        return sum(nbytes(item) for item in data)
+    return 0
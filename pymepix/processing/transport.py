@@ -0,0 +1,211 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Transports for the data passed between the pipeline processes by multiprocessing queues
+
+The data of a message is encoded by the transport of the sending pipeline object before it is put
+on the queue. The receiver always uses receive, which works for messages of every transport.
+"""
+import ctypes
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .packet_ring import ensure_shared_resource_tracker
+
+# start of each column in the shared memory block
+_ALIGNMENT = 64
+
+
+class QueueTransport:
+    """Puts the data on the queue as it is, the arrays are pickled and sent through the pipe of the queue"""
+
+    def encode(self, data):
+        return data
+
+
+class SharedMemoryTransport:
+    """Copies columns (tuples of numpy arrays, also nested in tuples) into shared memory and only puts a
+    SharedColumns descriptor on the queue
+
+    The receiver gets arrays backed by the shared memory without copying or unpickling them, the block is
+    freed once they are deleted. Smaller data is put on the queue as it is, creating a shared memory
+    block costs more than pickling a few kB.
+
+    Parameters
+    ----------
+    min_size : int
+        Minimum number of bytes of the columns to use shared memory
+    """
+
+    def __init__(self, min_size=65_536):
+        self._min_size = min_size
+        # the blocks are created by the pipeline processes and unlinked by the receivers
+        ensure_shared_resource_tracker()
+
+    def encode(self, data):
+        if _is_columns(data):
+            if sum(column.nbytes for column in data) >= self._min_size:
+                return SharedColumns.store(data)
+        elif isinstance(data, tuple):
+            return tuple(self.encode(item) for item in data)
+        return data
+
+
+class SharedColumns:
+    """Descriptor of a tuple of numpy arrays stored in one shared memory block
+
+    Each descriptor can only be loaded once, by the receiver of the message.
+    """
+
+    def __init__(self, name, layout):
+        self.name = name
+        # (dtype, shape, offset) of each column
+        self.layout = layout
+
+    @classmethod
+    def store(cls, columns):
+        """Copy the columns into a new shared memory block"""
+        layout, size = [], 0
+        for column in columns:
+            layout.append((column.dtype.str, column.shape, size))
+            size += -(-column.nbytes // _ALIGNMENT) * _ALIGNMENT
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for column, (dtype, shape, offset) in zip(columns, layout):
+            np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = column
+        descriptor = cls(block.name, layout)
+        block.close()
+        return descriptor
+
+    def load(self):
+        """Tuple of arrays backed by the shared memory block
+
+        The block is unlinked right away, the memory stays mapped as long as one of the arrays exists.
+        """
+        block = shared_memory.SharedMemory(name=self.name)
+        block.unlink()
+        memory = np.asarray(_BlockMemory(block))
+        return tuple(
+            memory[offset : offset + int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+            for dtype, shape, offset in self.layout
+        )
+
+    def discard(self):
+        """Free the shared memory without loading it"""
+        try:
+            block = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        block.close()
+        block.unlink()
+
+
+class _BlockMemory:
+    """Memory of an attached shared memory block for numpy, the block is closed once the arrays are deleted
+
+    The arrays use the address of the memory, a buffer export of block.buf would keep the block from
+    being closed.
+    """
+
+    def __init__(self, block):
+        pointer = ctypes.c_char.from_buffer(block.buf)
+        address = ctypes.addressof(pointer)
+        del pointer
+        self.__array_interface__ = {"shape": (block.size,), "typestr": "|u1", "data": (address, False), "version": 3}
+        # keeps the block open as long as this object, the base of the arrays, exists
+        weakref.finalize(self, block.close)
+
+
+def receive(value):
+    """Decode a message (data_type, data[, trace]) taken from a pipeline queue, None is passed on"""
+    if value is None:
+        return None
+    return (value[0], _load(value[1])) + tuple(value[2:])
+
+
+def discard(value):
+    """Free the shared memory of a message taken from a pipeline queue which is not processed"""
+    if value is not None:
+        _discard(value[1])
+
+
+def _load(data):
+    if isinstance(data, SharedColumns):
+        return data.load()
+    if isinstance(data, tuple):
+        return tuple(_load(item) for item in data)
+    return data
+
+
+def _discard(data):
+    if isinstance(data, SharedColumns):
+        data.discard()
+    elif isinstance(data, tuple):
+        for item in data:
+            _discard(item)
+
+
+def _is_columns(data):
+    return isinstance(data, tuple) and len(data) > 0 and all(isinstance(column, np.ndarray) for column in data)
+
+
+def main():
+    """Throughput of passing PixelData of different sizes between two processes with both transports"""
+    import multiprocessing
+    import time
+
+    from pymepix.processing.datatypes import MessageType
+
+    def produce(queue, transport, hits, count):
+        rng = np.random.default_rng(0)
+        data = (
+            rng.integers(0, 256, hits),
+            rng.integers(0, 256, hits),
+            rng.random(hits),
+            rng.integers(0, 1000, hits),
+        )
+        for _ in range(count):
+            queue.put((MessageType.PixelData, transport.encode(data)))
+        queue.put(None)
+
+    for hits in (1_000, 100_000, 1_000_000):
+        count = max(10, 20_000_000 // hits)
+        for transport in (QueueTransport(), SharedMemoryTransport()):
+            queue = multiprocessing.Queue()
+            producer = multiprocessing.Process(target=produce, args=(queue, transport, hits, count))
+            start = time.perf_counter()
+            producer.start()
+            received = 0
+            while True:
+                value = receive(queue.get())
+                if value is None:
+                    break
+                received += value[1][0].shape[0]
+                del value
+            duration = time.perf_counter() - start
+            producer.join()
+            print(
+                f"{type(transport).__name__:>21s} {hits:>9,d} hits per message: "
+                f"{received / duration / 1e6:7.1f} M hits/s ({32 * received / duration / 1e6:7.1f} MB/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# This file is part of Pymepix
+#
+# In all scientific work using Pymepix, please reference it as
+#
+# A. F. Al-Refaie, M. Johny, J. Correa, D. Pennicard, P. Svihra, A. Nomerotski, S. Trippel, and J. Küpper:
+# "PymePix: a python library for SPIDR readout of Timepix3", J. Inst. 14, P10003 (2019)
+# https://doi.org/10.1088/1748-0221/14/10/P10003
+# https://arxiv.org/abs/1905.07999
+#
+# Pymepix is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <https://www.gnu.org/licenses/>.
+"""Counters of the UdpSampler shared with the controlling process"""
+import ctypes
+import multiprocessing
+import time
+
+
+class UdpStatistics:
+    """Counters of received and lost data of a UdpSampler in shared memory
+
+    The sampler stores its counters at every chunk flush, readers get a consistent enough snapshot
+    without locking or messaging.
+
+    Counters
+    --------
+    datagrams : UDP datagrams received
+    bytes : bytes received
+    flushes_size : chunks handed on because they were full
+    flushes_timeout : chunks handed on because of the flush timeout
+    chunks_dropped : chunks not processed because no ring slot was free (ring overruns)
+    kernel_drops : datagrams dropped by the kernel because the socket buffer was full (SO_RXQ_OVFL)
+    socket_errors : failed receive calls
+    bytes_forwarded : bytes handed to the packet processors, less than bytes with compaction
+    """
+
+    FIELDS = (
+        "datagrams",
+        "bytes",
+        "flushes_size",
+        "flushes_timeout",
+        "chunks_dropped",
+        "kernel_drops",
+        "socket_errors",
+        "bytes_forwarded",
+        "update_time_ns",
+    )
+
+    def __init__(self):
+        self._values = multiprocessing.Array(ctypes.c_uint64, len(self.FIELDS), lock=False)
+
+    def store(self, counters):
+        """Store the counters (all fields but update_time_ns, in the order of FIELDS)"""
+        self._values[:-1] = counters
+        self._values[-1] = time.time_ns()
+
+    def reset(self):
+        self._values[:] = [0] * len(self.FIELDS)
+
+    def snapshot(self):
+        """Current counters as dict"""
+        return dict(zip(self.FIELDS, self._values[:]))
+
+    @staticmethod
+    def rates(previous, current):
+        """Datagrams and bytes per second between two snapshots"""
+        elapsed = (current["update_time_ns"] - previous["update_time_ns"]) * 1e-9
+        if elapsed <= 0:
+            return {"datagrams_per_s": 0.0, "bytes_per_s": 0.0}
+        return {
+            "datagrams_per_s": (current["datagrams"] - previous["datagrams"]) / elapsed,
+            "bytes_per_s": (current["bytes"] - previous["bytes"]) / elapsed,
+        }
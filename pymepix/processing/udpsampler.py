@@ -27,17 +27,96 @@ import numpy as np
 import zmq
 
 from pymepix.core.log import ProcessLogger
+from pymepix.processing.batch_receiver import (
+    BatchReceiver,
+    DatagramReceiver,
+    enable_drop_counter,
+    recvmmsg_available,
+)
+from pymepix.processing.packet_ring import PacketRing, ensure_shared_resource_tracker
+from pymepix.processing.udp_statistics import UdpStatistics
 
 # from pymepix.processing.basepipeline import BasePipelineObject
 from pymepix.processing.rawtodisk import Raw2Disk
 
 
+def compact_chunk(buffer, size, heartbeat_lsb=None):
+    """Move the pixel and trigger words of the first size bytes of buffer to its start
+
+    Heartbeat and other control words are dropped. The time of the last heartbeat in the chunk is
+    calculated from its MSB word and the preceding LSB word, which can be in a previous chunk.
+
+    Parameters
+    ----------
+    buffer : writable buffer
+    size : int
+        Number of bytes received into buffer
+    heartbeat_lsb : int
+        LSB part of the time of the last LSB heartbeat word of the previous chunks, None if there was none
+
+    Returns
+    -------
+    size : int
+        Number of bytes of the compacted words
+    longtime : int
+        Time of the last heartbeat, None if the chunk contains no MSB heartbeat word or its LSB part is unknown
+    heartbeat_lsb : int
+        LSB part of the time of the last LSB heartbeat word, to be passed with the next chunk
+    """
+    words = np.frombuffer(buffer, dtype=np.uint64, count=size // 8)
+    header = words >> np.uint64(60)
+    subheader = (words >> np.uint64(56)) & np.uint64(0xF)
+    timer = (header == 0x4) | (header == 0x6)
+    useful = (header == 0xA) | (header == 0xB) | (timer & (subheader == 0xF))
+
+    longtime = None
+    lsb_indices = np.flatnonzero(timer & (subheader == 0x4))
+    msb_indices = np.flatnonzero(timer & (subheader == 0x5))
+    if msb_indices.size > 0:
+        last_msb = msb_indices[-1]
+        lsb_before = lsb_indices[lsb_indices < last_msb]
+        if lsb_before.size > 0:
+            heartbeat_lsb = int((words[lsb_before[-1]] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16))
+        if heartbeat_lsb is not None:
+            longtime = (int(words[last_msb] & np.uint64(0x00000000FFFF0000)) << 16) | heartbeat_lsb
+    if lsb_indices.size > 0:
+        heartbeat_lsb = int((words[lsb_indices[-1]] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16))
+
+    compacted = words[useful]
+    words[: compacted.shape[0]] = compacted
+    return compacted.shape[0] * 8, longtime, heartbeat_lsb
+
+
 class UdpSampler(multiprocessing.Process, ProcessLogger):
     """Recieves udp packets from SPDIR
 
     This class, creates a UDP socket connection to SPIDR and recivies the UDP packets from Timepix
     It them pre-processes them and sends them off for more processing
 
+    The packets are received directly into the slots of a PacketRing in shared memory. Only the
+    descriptor of a filled slot is sent to the packet processors, which read the data in place. A slot
+    is reused only after the processor released it. If the processors fall behind and no slot is free
+    within ring_timeout seconds, the chunks are received into a spare buffer, still written to disk
+    but not processed until a slot is free again.
+
+    With recv_batch > 1 up to recv_batch datagrams are received with one recvmmsg system call (Linux),
+    which reduces the per datagram overhead at high data rates. Datagrams must not be longer than
+    max_datagram_size bytes in this mode.
+
+    With compact the chunks are reduced to the pixel and trigger words before they are handed to the
+    packet processors (see compact_chunk), Raw2Disk still gets all words. The longtime sent with a
+    chunk is then taken from the heartbeat words in the data once they have been seen.
+
+    With direct_io the raw files are written with O_DIRECT, bypassing the page cache (see RawFileWriter).
+    With segment_size (bytes) or segment_time (seconds) the raw files are split into numbered segments,
+    see Raw2Disk. With compression (e.g. "auto") they are written compressed, see RawCompressor.
+
+    The counters of received data, flushes and losses are kept in a UdpStatistics object in shared
+    memory, see statistics. Pass the same object to the next sampler to keep reading it.
+
+    The packet processors connect to packet_address (ZMQ), the controlling process binds
+    control_address for the commands to Raw2Disk.
+
     """
 
     def __init__(
@@ -50,6 +129,18 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
         create_output=True,
         num_outputs=1,
         shared_output=None,
+        ring_size=10,
+        ring_timeout=0.1,
+        recv_batch=1,
+        max_datagram_size=9_000,
+        statistics=None,
+        compact=False,
+        direct_io=False,
+        segment_size=0,
+        segment_time=0.0,
+        compression=None,
+        packet_address="ipc:///tmp/packetProcessor",
+        control_address="tcp://127.0.0.1:40000",
     ):
         # BasePipelineObject.__init__(self, 'UdpSampler', input_queue=input_queue, create_output=create_output,
         #                            num_outputs=num_outputs, shared_output=shared_output)
@@ -62,44 +153,132 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
             "chunk_size": chunk_size,
             "flush_timeout": flush_timeout,
             "longtime": longtime,
+            "ring_size": ring_size,
+            "ring_timeout": ring_timeout,
+            "recv_batch": recv_batch,
+            "max_datagram_size": max_datagram_size,
+            "compact": compact,
+            "direct_io": direct_io,
+            "segment_size": segment_size,
+            "segment_time": segment_time,
+            "compression": compression,
+            "packet_address": packet_address,
+            "control_address": control_address,
         }
         self._record = Value(ctypes.c_bool, False)
         self._enable = Value(ctypes.c_bool, True)
         self._close_file = Value(ctypes.c_bool, False)
+        self._statistics = statistics if statistics is not None else UdpStatistics()
         self.loop_count = 0
+        ensure_shared_resource_tracker()
 
     def init_new_process(self):
         """create connections and initialize variables in new process"""
         try:
             self.create_socket_connection(self.init_param["address"])
+            self._receiver = self.__create_receiver(self.init_param["recv_batch"], self.init_param["max_datagram_size"])
             self._chunk_size = self.init_param["chunk_size"] * 8192
             self._flush_timeout = self.init_param["flush_timeout"]
             self._packets_collected = 0
-            self._packet_buffer_list = [
-                bytearray(int(1.5 * self._chunk_size)) for i in range(10)
-            ]  # ring buffer to put received data in
-            self._buffer_list_idx = 0
-            self._packet_buffer_view_list = [
-                memoryview(self._packet_buffer_list[i])
-                for i in range(len(self._packet_buffer_list))
-            ]
-            self._packet_buffer_view = self._packet_buffer_view_list[
-                self._buffer_list_idx
-            ]
+            # ring buffer to put received data in, the last 8 bytes of a chunk are the longtime
+            self._ring = PacketRing.create(self.init_param["ring_size"], int(1.5 * self._chunk_size) + 8)
+            self._ring_name = self._ring.name.encode()
+            self._ring_timeout = self.init_param["ring_timeout"]
+            self._sequence = 0
+            self._spare_buffer = memoryview(bytearray(self._ring.slot_size))
+            self._raw_trackers = {}
+            self._in_ring = True
+            self._dropped_chunks = 0
+            self._packet_buffer_view = self.__acquire_buffer()
             self._recv_bytes = 0
+            # time.monotonic() of the first datagram of the chunk, 0.0 while it is empty
+            self._chunk_received = 0.0
             self._total_time = 0.0
             self._longtime = self.init_param["longtime"]
+            self._received_bytes = 0
+            self._forwarded_bytes = 0
+            self._compact = self.init_param["compact"]
+            self._heartbeat_lsb = None
+            self._heartbeat_longtime = None
+            self._flushes_size = 0
+            self._flushes_timeout = 0
+            self._socket_errors = 0
+            self._statistics.reset()
 
             # create connection to packetprocessor
             self.debug("create packetprocessor socket")
             ctx = zmq.Context.instance()
             self._packet_sock = ctx.socket(zmq.PUSH)
-            self._packet_sock.bind("ipc:///tmp/packetProcessor")
+            self._packet_sock.bind(self.init_param["packet_address"])
         except Exception as e:
             self.error("Exception occured in init!!!")
             self.error(e, exc_info=True)
             raise
 
+    def __create_receiver(self, recv_batch, max_datagram_size):
+        """Object whose recv_into receives the datagrams, the socket itself or a BatchReceiver"""
+        if recv_batch <= 1:
+            return DatagramReceiver(self._sock, self._drop_counter)
+        if not recvmmsg_available():
+            self.warning("recvmmsg is not available, datagrams are received one by one")
+            return DatagramReceiver(self._sock, self._drop_counter)
+        self.info("Receiving up to {} datagrams per system call".format(recv_batch))
+        return BatchReceiver(self._sock, recv_batch, max_datagram_size)
+
+    def __acquire_buffer(self):
+        """Slot of the ring for the next chunk or the spare buffer if the processors fall behind"""
+        slot = self._sequence % self._ring.slots
+        if slot in self._raw_trackers:
+            # the slot might still be sent to Raw2Disk
+            self._raw_trackers.pop(slot).wait()
+
+        buffer = self._ring.acquire(self._sequence, self._ring_timeout if self._in_ring else 0.0)
+        if buffer is None:
+            if self._in_ring:
+                self.warning("Packet processors fall behind, chunks are not processed until they catch up")
+            self._in_ring = False
+            return self._spare_buffer
+        if not self._in_ring:
+            self.warning("{} chunks have not been processed".format(self._dropped_chunks))
+        self._in_ring = True
+        return buffer
+
+    def __send_to_disk(self, data):
+        # compacting overwrites the slot, so the data is only sent without a copy otherwise
+        if self._in_ring and not self._compact:
+            tracker = self.write2disk.my_sock.send(data, copy=False, track=True)
+            self._raw_trackers[self._sequence % self._ring.slots] = tracker
+        else:
+            # the spare buffer is reused right away
+            self.write2disk.my_sock.send(data)
+
+    def __store_statistics(self):
+        self._statistics.store(
+            [
+                self._receiver.datagrams,
+                self._received_bytes,
+                self._flushes_size,
+                self._flushes_timeout,
+                self._dropped_chunks,
+                self._receiver.kernel_drops,
+                self._socket_errors,
+                self._forwarded_bytes,
+            ]
+        )
+
+    @property
+    def statistics(self):
+        """Counters of received data and losses, see UdpStatistics"""
+        return self._statistics
+
+    def __close_ring(self):
+        self._packet_sock.close()
+        for tracker in self._raw_trackers.values():
+            tracker.wait()
+        self._raw_trackers = {}
+        self._packet_buffer_view = None
+        self._ring.close()
+
     def create_socket_connection(self, address):
         """Establishes a UDP connection to spidr"""
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Internet  # UDP
@@ -109,6 +288,9 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
             )  # NIC buffer
         except OSError:
             self.warning("NIC memory you try to allocate is too much.")
+        self._drop_counter = enable_drop_counter(self._sock)
+        if not self._drop_counter:
+            self.info("Datagrams dropped by the kernel can't be counted")
         self._sock.settimeout(1.0)
         self.info("Establishing connection to : {}".format(address))
         self._sock.bind(address)
@@ -202,7 +384,13 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
     def pre_run(self):
         """init stuff which should only be available in new process"""
         self.init_new_process()
-        self.write2disk = Raw2Disk()
+        self.write2disk = Raw2Disk(
+            direct=self.init_param["direct_io"],
+            segment_size=self.init_param["segment_size"],
+            segment_time=self.init_param["segment_time"],
+            compression=self.init_param["compression"],
+            control_address=self.init_param["control_address"],
+        )
         self._last_update = time.time()
 
     def post_run(self):
@@ -213,18 +401,11 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
         if self._recv_bytes > 1:
             bytes_to_send = self._recv_bytes
             self._recv_bytes = 0
+            self._received_bytes += bytes_to_send
+            self.__store_statistics()
 
-            curr_list_idx = self._buffer_list_idx
-            self._buffer_list_idx = (self._buffer_list_idx + 1) % len(
-                self._packet_buffer_list
-            )
-            self._packet_buffer_view = self._packet_buffer_view_list[
-                self._buffer_list_idx
-            ]
-
-            self.write2disk.my_sock.send(
-                self._packet_buffer_list[curr_list_idx][:bytes_to_send], copy=False
-            )
+            # copied as the buffer is reused for the next chunk
+            self.write2disk.my_sock.send(self._packet_buffer_view[:bytes_to_send])
             if self.write2disk.writing:
                 self.write2disk.my_sock.send(
                     b"EOF"
@@ -240,7 +421,6 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
                 )  # we should get a response here, but the socket is elsewhere...
                 self.debug("post_run: closed file")
 
-        self._packet_sock.close()
         return None, None
 
     def run(self):
@@ -251,9 +431,10 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
         while True:
             if enabled:
                 try:
-                    self._recv_bytes += self._sock.recv_into(
-                        self._packet_buffer_view[self._recv_bytes :]
-                    )
+                    received = self._receiver.recv_into(self._packet_buffer_view[self._recv_bytes :])
+                    if self._recv_bytes == 0:
+                        self._chunk_received = time.monotonic()
+                    self._recv_bytes += received
                 except socket.timeout:
                     enabled = self.enable
                     # put close file here to get the cases where there's no data coming and file should be closed
@@ -263,8 +444,9 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
                         self.post_run()
                     else:
                         self.debug("Socket timeout")
-                except socket.error:
-                    self.debug("socket error")
+                except socket.error as e:
+                    self._socket_errors += 1
+                    self.warning("Receiving failed: {}".format(e))
 
                 self._packets_collected += 1
                 end = time.time()
@@ -281,43 +463,45 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
                 if (self._recv_bytes > self._chunk_size) or (
                     flush_time > self._flush_timeout
                 ):
-                    # tpx_packets = self.get_useful_packets(packet)
+                    if self._recv_bytes > self._chunk_size:
+                        self._flushes_size += 1
+                    else:
+                        self._flushes_timeout += 1
+                    self._received_bytes += self._recv_bytes
+
                     if self.record:
-                        self.write2disk.my_sock.send(
-                            self._packet_buffer_list[self._buffer_list_idx][
-                                : self._recv_bytes
-                            ],
-                            copy=False,
-                        )
+                        self.__send_to_disk(self._packet_buffer_view[: self._recv_bytes])
                     elif self.close_file:
                         self.close_file = False
                         self.debug("received close file")
-                        self.write2disk.my_sock.send(
-                            self._packet_buffer_list[self._buffer_list_idx][
-                                : self._recv_bytes
-                            ],
-                            copy=False,
-                        )
+                        self.__send_to_disk(self._packet_buffer_view[: self._recv_bytes])
                         self.write2disk.my_sock.send(b"EOF")
-                    # send stuff to packet processor only every 10th iteration
-                    # elif self._buffer_list_idx == 9:
-                    # add longtime to buffers end
-                    bytes_to_send = self._recv_bytes + 8
-                    self._packet_buffer_view[
-                        self._recv_bytes : bytes_to_send
-                    ] = np.uint64(self._longtime.value).tobytes()
-                    self._packet_sock.send(
-                        self._packet_buffer_list[self._buffer_list_idx][:bytes_to_send],
-                        copy=False,
-                    )
+                    if self._in_ring:
+                        data_bytes, longtime = self._recv_bytes, self._longtime.value
+                        if self._compact:
+                            data_bytes, heartbeat_longtime, self._heartbeat_lsb = compact_chunk(
+                                self._packet_buffer_view, self._recv_bytes, self._heartbeat_lsb
+                            )
+                            if heartbeat_longtime is not None:
+                                self._heartbeat_longtime = heartbeat_longtime
+                            if self._heartbeat_longtime is not None:
+                                longtime = self._heartbeat_longtime
+                        # add longtime to buffers end and hand the slot to a packet processor
+                        bytes_to_send = data_bytes + 8
+                        self._packet_buffer_view[data_bytes:bytes_to_send] = np.uint64(longtime).tobytes()
+                        self._forwarded_bytes += data_bytes
+                        descriptor = self._ring.publish(self._sequence, bytes_to_send)
+                        # receive time of the chunk for the latency tracing
+                        received = np.float64(self._chunk_received or time.monotonic()).tobytes()
+                        self._packet_sock.send_multipart([self._ring_name, descriptor, received])
+                        self._sequence += 1
+                    else:
+                        self._dropped_chunks += 1
 
+                    self.__store_statistics()
                     self._recv_bytes = 0
-                    self._buffer_list_idx = (self._buffer_list_idx + 1) % len(
-                        self._packet_buffer_list
-                    )
-                    self._packet_buffer_view = self._packet_buffer_view_list[
-                        self._buffer_list_idx
-                    ]
+                    self._chunk_received = 0.0
+                    self._packet_buffer_view = self.__acquire_buffer()
                     self._last_update = time.time()
                     enabled = self.enable
                     # if len(packet) > 1:
@@ -335,75 +519,137 @@ class UdpSampler(multiprocessing.Process, ProcessLogger):
                 break
         self.post_run()
         self.write2disk.my_sock.close()
+        self.__close_ring()
 
 
-def main():
-    # Create the logger
-    import logging
-    import time
-    from multiprocessing import Process
-
-    import numpy as np
-    import zmq
-
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+def _send_datagrams(packets, chunk_size, address):
+    """Send packets datagrams of chunk_size consecutive numbers to the sampler of benchmark"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # first packet 0...chunk_size - 1, second packet chunk_size...2 * chunk_size - 1 and so on
+    test_data = np.arange(packets * chunk_size, dtype=np.uint64)
+    test_data_view = memoryview(test_data)
+    start = time.time()
+    for i in range(0, len(test_data_view), chunk_size):
+        sock.sendto(test_data_view[i : i + chunk_size], address)
+    dt = time.time() - start
+    print(
+        f"time to send {dt:.2f}",
+        f"MBytes: {test_data.nbytes * 1e-6:.1f}, "
+        f"{test_data.nbytes * 1e-6 / dt:.2f} MByte/s",
     )
-
-    def send_data(packets, chunk_size, start=0, sleep=0.0001):
-        ############
-        # send data
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        test_data = np.arange(
-            start, start + packets * chunk_size, dtype=np.uint64
-        )  # chunk size 135 -> max number=1_012_500
-        test_data_view = memoryview(test_data)
-        time.sleep(1)  # seems to be necessary if this function get called as a Process
-        # first packet 0...134, second packet 135...269 and so on
-        print("sending process")
-        start = time.time()
-        for i in range(0, len(test_data_view), chunk_size):
-            sock.sendto(test_data_view[0 : 0 + chunk_size], ("127.0.0.1", 50000))
-            # time.sleep(sleep)  # if there's no sleep, packets get lost
-        stop = time.time()
-        dt = stop - start
-        print(
-            f"time to send {dt:.2f}",
-            f"time to send 1M: {dt/packets*1_000_002:.2f}s, "
-            # f'bytes: {len(test_data_view.tobytes())}, '
-            f"MBytes: {len(test_data_view.tobytes()) * 1e-6:.1f}, "
-            f"{len(test_data_view.tobytes()) * 1e-6 / dt:.2f} MByte/s",
-        )
-        # return test_data
-
+    sock.close()
+
+
+def benchmark(
+    packets,
+    recv_batch,
+    chunk_size=139,
+    address=("127.0.0.1", 50000),
+    packet_address="ipc:///tmp/packetProcessor",
+    control_address="tcp://127.0.0.1:40000",
+):
+    """Send packets datagrams through a UdpSampler and receive them as the packet processors do
+
+    Parameters
+    ----------
+    packets : int
+        Number of datagrams
+    recv_batch : int
+        Datagrams per receive call of the sampler
+    chunk_size : int
+        Number of 64-bit words per datagram
+    address : tuple
+        UDP address of the sampler
+    packet_address, control_address : str
+        ZMQ addresses of the sampler, see UdpSampler
+
+    Returns
+    -------
+    tuple
+        Received bytes and the time between the first and last chunk with data in seconds
+    """
     ctx = zmq.Context.instance()
+    # Raw2Disk of the sampler connects to it
     z_sock = ctx.socket(zmq.PAIR)
-    z_sock.bind("tcp://127.0.0.1:40000")
-    # z_sock.send_string('hallo')
-    # print(z_sock.recv_string())
-
-    sampler = UdpSampler(("127.0.0.1", 50000), 1)
-    time.sleep(1)  # give thread time to start
-    # send data
-    packets = 3_500_000
-    chunk_size = 139
-    # test_data = np.arange(0, packets * chunk_size, dtype=np.uint64)
-    # test_data = send_data(packets=10_000, chunk_size=135, start=15000, sleep=1e-4)
-    p = Process(target=send_data, args=(packets, chunk_size, 0, 0))
-    start = time.time()
-    p.start()
+    z_sock.bind(control_address)
+    packet_sock = ctx.socket(zmq.PULL)
+    packet_sock.connect(packet_address)
 
+    longtime = Value(ctypes.c_uint64, 1)
+    sampler = UdpSampler(
+        address,
+        longtime,
+        chunk_size=100,
+        recv_batch=recv_batch,
+        packet_address=packet_address,
+        control_address=control_address,
+    )
     sampler.start()
+
+    # act as the packet processor, count the received bytes and release the slots
+    received_bytes, first, last, ring, p = 0, None, None, None, None
+    started = time.perf_counter()
+    # the sampler flushes empty chunks, stop once the sender is done and all data or none for 2 s arrived
+    sent_bytes = packets * chunk_size * 8
+    while p is None or (p.is_alive() or time.perf_counter() - (last or started) < 2) and received_bytes < sent_bytes:
+        if not packet_sock.poll(100):
+            if p is None and time.perf_counter() - started > 30:
+                raise RuntimeError("UdpSampler did not start")
+            continue
+        name, descriptor, _ = packet_sock.recv_multipart()
+        if ring is None:
+            ring = PacketRing.attach(name.decode())
+        data, sequence = ring.read(descriptor)
+        if len(data) > 8:
+            last = time.perf_counter()
+            first = first or last
+            received_bytes += len(data) - 8
+        del data
+        ring.release(sequence)
+        if p is None:
+            # the first chunk shows that the sampler is bound and receiving
+            p = multiprocessing.Process(target=_send_datagrams, args=(packets, chunk_size, address))
+            p.start()
+            started = time.perf_counter()
     p.join()
-    print("sending finished")
-    stop = time.time()
+
     z_sock.send_string("SHUTDOWN")
     time.sleep(1)
-    z_sock.close()
     sampler.enable = False
+    sampler.join(2.0)
+    sampler.terminate()
+    z_sock.close(linger=0)
+    packet_sock.close()
+    if ring is not None:
+        ring.close()
+    return received_bytes, (last - first) if first is not None else 0.0
 
-    print(f"took {stop - start}s")
+
+def main():
+    """Measure the throughput reaching the packet processors with single datagram and batched receiving
+
+    Usage: python -m pymepix.processing.udpsampler [number of datagrams]
+    """
+    # Create the logger
+    import logging
+    import sys
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    chunk_size = 139
+    sent_bytes = packets * chunk_size * 8
+
+    for recv_batch in [1, 64]:
+        received_bytes, duration = benchmark(packets, recv_batch, chunk_size)
+        print(
+            f"recv_batch {recv_batch:3d}: {received_bytes * 1e-6 / (duration or float('nan')):8.1f} MB/s, "
+            f"{100 * received_bytes / sent_bytes:5.1f} % of the data received"
+        )
+        time.sleep(1)  # the port is released asynchronously
 
 
 if __name__ == "__main__":
@@ -25,6 +25,8 @@ from multiprocessing import Queue
 import pymepix.config.load_config as cfg
 from pymepix.core.log import Logger
 from pymepix.processing.acquisition import PixelPipeline
+from pymepix.processing.latency import LatencyTracker
+from pymepix.processing.transport import receive
 from .SPIDR.spidrcontroller import SPIDRController
 from .timepixdevice import TimepixDevice
 
@@ -78,12 +80,13 @@ class PymepixConnection(Logger):
     def data_thread(self):
         self.info("Starting data thread")
         while True:
-            value = self._data_queue.get()
+            value = receive(self._data_queue.get())
             self.debug("Popped value {}".format(value))
             if value is None:
                 break
 
-            data_type, data = value
+            # messages of pipelines with latency_tracing carry the trace of their chunk
+            data_type, data = self._latency.record(value)
             self._event_callback(data_type, data)
 
     def __init__(self, spidr_address="default", src_ip_port="default", pipeline_class=PixelPipeline):
@@ -97,6 +100,7 @@ class PymepixConnection(Logger):
         self._timepix_devices: list[TimepixDevice] = []
 
         self._data_queue = Queue()
+        self._latency = LatencyTracker()
         self._createTimepix(pipeline_class)
         self._spidr.setBiasSupplyEnable(True)
         self.biasVoltage = 50
@@ -106,6 +110,7 @@ class PymepixConnection(Logger):
         self._data_thread.start()
 
         self._running = False
+        self._udp_packets_at_start = 0
 
     @property
     def biasVoltage(self):
@@ -222,6 +227,8 @@ class PymepixConnection(Logger):
             self.info("Setting up {}".format(t.deviceName))
             t.setupDevice()
         self._spidr.restartTimers()
+        self._udp_packets_at_start = self._spidr.UdpPacketCounter
+        self._latency.reset()
         self._spidr.openShutter()
         for t in self._timepix_devices:
             self.info("Starting {}".format(t.deviceName))
@@ -254,6 +261,48 @@ class PymepixConnection(Logger):
     def isAcquiring(self):
         return self._running
 
+    @property
+    def udpStatistics(self):
+        """Counters of the UDP samplers of all devices, read from shared memory without disturbing the acquisition
+
+        Returns
+        --------
+        list of dict
+            see :class:`pymepix.processing.udp_statistics.UdpStatistics`
+        """
+        return [device.udpStatistics for device in self._timepix_devices]
+
+    @property
+    def latencyReport(self):
+        """Latency from the reception of the UDP chunks to the event callback by MessageType
+
+        Only filled if the pipeline was created with latency_tracing=True, e.g. with
+        pipeline_class=functools.partial(CentroidPipeline, latency_tracing=True).
+
+        Returns
+        --------
+        dict
+            see :class:`pymepix.processing.latency.LatencyTracker`
+        """
+        return self._latency.report()
+
+    def packetLoss(self):
+        """Compare the datagrams received by the samplers with the UDP packet counter of SPIDR
+
+        The SPIDR counter is read from the board, so this is more expensive than udpStatistics.
+
+        Returns
+        --------
+        dict
+            sent and received datagrams since the start of the acquisition, lost datagrams and the
+            fraction of lost datagrams
+        """
+        # the SPIDR register has 32 bits
+        sent = (self._spidr.UdpPacketCounter - self._udp_packets_at_start) % (1 << 32)
+        received = sum(statistics["datagrams"] for statistics in self.udpStatistics if statistics is not None)
+        lost = max(sent - received, 0)
+        return {"sent": sent, "received": received, "lost": lost, "loss": lost / sent if sent > 0 else 0.0}
+
     @property
     def numDevices(self):
         return self._num_timepix
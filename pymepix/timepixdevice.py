@@ -170,6 +170,14 @@ class TimepixDevice(Logger):
         """
         return self._acquisition_pipeline
 
+    @property
+    def udpStatistics(self):
+        """Counters of the UdpSampler of this device (see UdpStatistics), None if the pipeline has no sampler"""
+        statistics = getattr(self._acquisition_pipeline, "udp_statistics", None)
+        if statistics is None:
+            return None
+        return statistics.snapshot()
+
     def pauseHeartbeat(self):
         self._pause_timer = True
 
@@ -195,6 +203,18 @@ class TimepixDevice(Logger):
     def deviceName(self):
         return self.devIdToString()
 
+    @property
+    def pixelOffsetCoords(self):
+        """Position (x, y) of the chip in pixels in a detector of several chips
+
+        Used to merge the hits of the chips, see :class:`pymepix.processing.chip_merger.ChipMerger`
+        """
+        return self._pixel_offset_coords
+
+    @pixelOffsetCoords.setter
+    def pixelOffsetCoords(self, value):
+        self._pixel_offset_coords = tuple(value)
+
     def setEthernetFilter(self, eth_filter):
         """Sets the packet filter, usually set to 0xFFFF to all all packets"""
         eth_mask, cpu_mask = self._device.headerFilter
@@ -46,6 +46,11 @@ install_requires = [
     "tqdm",
 ]
 
+extras_require = {
+    "numba": ["numba"],
+    "compression": ["lz4", "zstandard"],
+}
+
 console_scripts = ["pymepix-acq=pymepix.main:main"]
 
 entry_points = {"console_scripts": console_scripts}
@@ -102,6 +107,7 @@ setup(
     provides=provides,
     requires=requires,
     install_requires=install_requires,
+    extras_require=extras_require,
     command_options={
         "build_sphinx": {
             "project": ("setup.py", name),
@@ -0,0 +1,89 @@
+"""Creation of synthetic Timepix3 raw files (start time header followed by 64-bit words)
+
+Triggers with clusters of pixels after each trigger, some noise pixels and heartbeat words (LSB and MSB)
+at a fixed period. Used to test the post-processing without the large recorded raw files.
+"""
+import numpy as np
+
+TICKS_PER_SECOND = 40_000_000
+START_LONGTIME = 2233861246990
+
+
+def pixel_word(col, row, tick, tot, ftoa=0):
+    coarse = tick & 0x3FFFFFFF
+    pix = (col & 1) * 4 + (row & 3)
+    data = ((coarse & 0x3FFF) << 14) | ((tot & 0x3FF) << 4) | (ftoa & 0xF)
+    return (
+        (0xB << 60)
+        | ((col & 0xFE) << 52)
+        | ((row & 0xFC) << 45)
+        | (pix << 44)
+        | (data << 16)
+        | ((coarse >> 14) & 0xFFFF)
+    )
+
+
+def trigger_word(tick, fine=1):
+    return (0x6F << 56) | ((tick & 0xFFFFFFFF) << 12) | (fine << 5)
+
+
+def heartbeat_words(tick):
+    return [(0x44 << 56) | ((tick & 0xFFFFFFFF) << 16), (0x45 << 56) | (((tick >> 32) & 0xFFFF) << 16)]
+
+
+def create_raw_words(duration=20.0, trigger_period=0.01, heartbeat_period=0.25, seed=0, jump_at=None):
+    """Returns the words (uint64) of a synthetic recording.
+
+    jump_at : float, optional
+        Time in seconds at which one heartbeat jumps forward, to cover the handling of time jumps
+    """
+    rng = np.random.default_rng(seed)
+    start = START_LONGTIME
+    end = start + int(duration * TICKS_PER_SECOND)
+    words = []  # (tick, order, word)
+
+    # pixels before the first heartbeat are expected to be dropped
+    for index in range(5):
+        words.append((start - 100 + index, 0, pixel_word(10, 10, start - 100 + index, 10)))
+
+    tick = start
+    while tick < end:
+        heartbeat = tick
+        if jump_at is not None and abs(tick - (start + jump_at * TICKS_PER_SECOND)) < heartbeat_period * TICKS_PER_SECOND / 2:
+            heartbeat += 0x20000000
+        words.extend((tick, 1, word) for word in heartbeat_words(heartbeat))
+        tick += int(heartbeat_period * TICKS_PER_SECOND)
+
+    tick = start + 1000
+    while tick < end:
+        words.append((tick, 2, trigger_word(tick, int(rng.integers(1, 13)))))
+        for _ in range(int(rng.integers(0, 4))):
+            col, row = rng.integers(3, 250, size=2)
+            cluster_tick = tick + int(rng.integers(100, 30_000))
+            for _ in range(int(rng.integers(2, 9))):
+                dcol, drow = rng.integers(-1, 2, size=2)
+                pixel_tick = cluster_tick + int(rng.integers(0, 3))
+                words.append(
+                    (
+                        pixel_tick,
+                        3,
+                        pixel_word(
+                            int(col + dcol), int(row + drow), pixel_tick, int(rng.integers(1, 200)), int(rng.integers(0, 16))
+                        ),
+                    )
+                )
+        if rng.random() < 0.3:
+            noise_tick = tick + int(rng.integers(0, int(trigger_period * TICKS_PER_SECOND)))
+            words.append((noise_tick, 3, pixel_word(int(rng.integers(0, 256)), int(rng.integers(0, 256)), noise_tick, 5)))
+        tick += int(trigger_period * TICKS_PER_SECOND)
+
+    words.sort(key=lambda word: (word[0], word[1]))
+    return np.array([word for _, _, word in words], dtype=np.uint64)
+
+
+def write_raw_file(file_name, words, start_time=1_600_000_000_000_000_000):
+    """Writes words with the 8 byte start time header as written by Raw2Disk"""
+    with open(file_name, "wb") as f:
+        f.write(start_time.to_bytes(8, "little"))
+        words.astype("<u8").tofile(f)
+    return file_name
@@ -0,0 +1,67 @@
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from pymepix.processing.basepipeline import BasePipelineObject
+from pymepix.processing.datatypes import MessageType
+
+
+class __Counting(BasePipelineObject):
+    def __init__(self, **kwargs):
+        super().__init__("Counting", **kwargs)
+        self.calls = []
+
+    def process(self, data_type=None, data=None):
+        self.calls.append((data_type, data))
+        return None, None
+
+
+def __events(first_shot):
+    shot = np.arange(first_shot, first_shot + 4)
+    return shot, shot + 10, shot + 20, shot * 1e-6, shot + 30
+
+
+def __run(batch_size, messages):
+    input_queue, output_queue = mp.Queue(), mp.Queue()
+    for message in messages:
+        input_queue.put(message)
+    input_queue.put(None)
+    time.sleep(0.1)
+    pipeline_object = __Counting(input_queue=input_queue, shared_output=output_queue, batch_size=batch_size)
+    pipeline_object.run()
+
+    outputs = []
+    try:
+        while True:
+            outputs.append(output_queue.get(timeout=0.5))
+    except queue.Empty:
+        pass
+    assert input_queue.get(timeout=1) is None
+    return pipeline_object.calls, outputs
+
+
+def test_batches_are_merged():
+    messages = [(MessageType.EventData, __events(4 * index)) for index in range(10)]
+    messages.insert(5, (MessageType.CloseFileCommand, "file"))
+    calls, outputs = __run(8, messages)
+
+    assert [data_type for data_type, _ in calls] == [
+        MessageType.EventData,
+        MessageType.CloseFileCommand,
+        MessageType.EventData,
+        MessageType.EventData,
+    ]
+    assert [data[0].shape[0] for data_type, data in calls if data_type == MessageType.EventData] == [20, 8, 12]
+    shots = np.concatenate([data[0] for data_type, data in calls if data_type == MessageType.EventData])
+    np.testing.assert_array_equal(shots, np.arange(40))
+    # the merged input is propagated
+    assert len(outputs) == 4
+
+
+def test_single_messages():
+    messages = [(MessageType.EventData, __events(4 * index)) for index in range(3)]
+    calls, outputs = __run(1, messages)
+    assert len(calls) == 3
+    assert len(outputs) == 3
@@ -0,0 +1,93 @@
+import socket
+
+import numpy as np
+import pytest
+
+from pymepix.processing.batch_receiver import BatchReceiver, DatagramReceiver, enable_drop_counter, recvmmsg_available
+from pymepix.processing.udp_statistics import UdpStatistics
+
+pytestmark = pytest.mark.skipif(not recvmmsg_available(), reason="recvmmsg is not available")
+
+
+@pytest.fixture
+def udp_sockets():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(0.2)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def test_datagrams_are_received_back_to_back(udp_sockets):
+    sender, receiver = udp_sockets
+    rng = np.random.default_rng(0)
+    datagrams = [rng.integers(0, 255, size, dtype=np.uint8).tobytes() for size in rng.integers(1, 1_000, 50)]
+    for datagram in datagrams:
+        sender.sendto(datagram, receiver.getsockname())
+
+    batch_receiver = BatchReceiver(receiver, batch_size=16, max_datagram_size=1_000)
+    buffer = bytearray(100_000)
+    received = 0
+    while received < sum(len(datagram) for datagram in datagrams):
+        received += batch_receiver.recv_into(memoryview(buffer)[received:])
+
+    assert bytes(buffer[:received]) == b"".join(datagrams)
+    assert batch_receiver.datagrams == len(datagrams)
+
+
+def test_timeout(udp_sockets):
+    _, receiver = udp_sockets
+    with pytest.raises(socket.timeout):
+        BatchReceiver(receiver).recv_into(bytearray(100_000))
+
+
+@pytest.mark.parametrize("receiver_class", [DatagramReceiver, BatchReceiver])
+def test_kernel_drops_are_counted(udp_sockets, receiver_class):
+    sender, receiver = udp_sockets
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4_096)
+    assert enable_drop_counter(receiver)
+    # overflow the receive buffer
+    for _ in range(1_000):
+        sender.sendto(bytes(1_000), receiver.getsockname())
+
+    datagram_receiver = receiver_class(receiver)
+    buffer = bytearray(1_000_000)
+    try:
+        while True:
+            datagram_receiver.recv_into(buffer)
+    except socket.timeout:
+        pass
+    # the counter is reported with the first datagram queued after the drops
+    sender.sendto(bytes(1_000), receiver.getsockname())
+    datagram_receiver.recv_into(buffer)
+    assert datagram_receiver.kernel_drops > 0
+    assert datagram_receiver.datagrams + datagram_receiver.kernel_drops == 1_001
+
+
+def test_statistics_are_shared():
+    statistics = UdpStatistics()
+    statistics.store([10, 8_000, 1, 2, 0, 3, 0, 8_000])
+    first = statistics.snapshot()
+    assert first["datagrams"] == 10
+    assert first["kernel_drops"] == 3
+
+    statistics.store([30, 24_000, 1, 4, 0, 3, 0, 24_000])
+    second = statistics.snapshot()
+    rates = UdpStatistics.rates(first, second)
+    assert rates["bytes_per_s"] == pytest.approx(800 * rates["datagrams_per_s"])
+
+    statistics.reset()
+    assert set(statistics.snapshot().values()) == {0}
+
+
+def test_without_drop_counter(udp_sockets):
+    sender, receiver = udp_sockets
+    for index in range(3):
+        sender.sendto(bytes([index]) * 10, receiver.getsockname())
+
+    datagram_receiver = DatagramReceiver(receiver, drop_counter=False)
+    buffer = bytearray(100)
+    assert [bytes(buffer[: datagram_receiver.recv_into(buffer)]) for _ in range(3)] == [bytes([index]) * 10 for index in range(3)]
+    assert (datagram_receiver.datagrams, datagram_receiver.kernel_drops) == (3, 0)
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import numpy as np
+
+from pymepix.processing.bounded_queue import BoundedQueue, OverflowPolicy
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.logic.centroid_calculator import CentroidCalculator
+from pymepix.processing.pipeline_centroid_calculator import PipelineCentroidCalculator
+from pymepix.processing.transport import SharedColumns, SharedMemoryTransport, receive
+
+
+def __events(shots=8, hits_per_shot=3):
+    shot = np.repeat(np.arange(shots), hits_per_shot)
+    x = np.tile(np.arange(hits_per_shot), shots) + 10
+    return shot, x, np.full_like(x, 10), np.full(shot.shape, 1e-6), np.full_like(x, 100)
+
+
+def __drain(bounded_queue, count):
+    return [bounded_queue.get(timeout=5) for _ in range(count)]
+
+
+def test_drop_newest():
+    bounded_queue = BoundedQueue(2, OverflowPolicy.DropNewest)
+    for index in range(5):
+        bounded_queue.put((MessageType.PixelData, index))
+    assert [data for _, data in __drain(bounded_queue, 2)] == [0, 1]
+    assert bounded_queue.dropped_messages == 3
+
+
+def test_drop_oldest():
+    bounded_queue = BoundedQueue(2, OverflowPolicy.DropOldest)
+    for index in range(5):
+        bounded_queue.put((MessageType.PixelData, index))
+    assert [data for _, data in __drain(bounded_queue, 2)] == [3, 4]
+    assert bounded_queue.dropped_messages == 3
+
+
+def test_decimate_triggers():
+    bounded_queue = BoundedQueue(2, OverflowPolicy.DecimateTriggers)
+    for _ in range(2):
+        bounded_queue.put((MessageType.EventData, __events()))
+
+    def consume_later():
+        time.sleep(0.2)
+        bounded_queue.get()
+
+    consumer = threading.Thread(target=consume_later)
+    consumer.start()
+    # blocks until the consumer took a message
+    bounded_queue.put((MessageType.EventData, __events()))
+    consumer.join()
+
+    assert bounded_queue.decimation == 2
+    assert bounded_queue.dropped_triggers == 4
+    (_, complete), (_, decimated) = __drain(bounded_queue, 2)
+    assert np.unique(complete[0]).tolist() == list(range(8))
+    assert np.unique(decimated[0]).tolist() == [0, 2, 4, 6]
+    assert decimated[1].shape[0] == 12
+
+
+def test_decimated_events_stay_in_shared_memory():
+    bounded_queue = BoundedQueue(1, OverflowPolicy.DecimateTriggers)
+    transport = SharedMemoryTransport(min_size=0)
+    bounded_queue.put((MessageType.EventData, transport.encode(__events())))
+    consumer = threading.Thread(target=lambda: (time.sleep(0.2), receive(bounded_queue.get())))
+    consumer.start()
+    bounded_queue.put((MessageType.EventData, transport.encode(__events())))
+    consumer.join()
+
+    assert bounded_queue.decimation == 2
+    value = bounded_queue.get(timeout=5)
+    assert isinstance(value[1], SharedColumns)
+    _, decimated = receive(value)
+    assert np.unique(decimated[0]).tolist() == [0, 2, 4, 6]
+
+
+def test_triggers_processed_is_adapted():
+    input_queue = BoundedQueue(4)
+    centroiding = PipelineCentroidCalculator(
+        centroid_calculator=CentroidCalculator(), input_queue=input_queue, max_triggers_processed=8
+    )
+    centroiding.pre_run()
+    for _ in range(3):
+        input_queue.put((MessageType.EventData, __events()))
+    time.sleep(0.1)
+
+    centroiding.process(MessageType.EventData, __events())
+    assert centroiding.centroid_calculator.triggers_processed == 2
+    centroiding.process(MessageType.EventData, __events())
+    assert centroiding.centroid_calculator.triggers_processed == 4
+
+    __drain(input_queue, 3)
+    centroiding.process(MessageType.EventData, __events())
+    assert centroiding.centroid_calculator.triggers_processed == 2
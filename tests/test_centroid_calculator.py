@@ -1,6 +1,7 @@
 import numpy as np
+import scipy.ndimage as nd
 
-from pymepix.processing.logic.centroid_calculator import CentroidCalculator
+from pymepix.processing.logic.centroid_calculator import CentroidCalculator, CentroidCalculatorPooled, ChunkSizeTuner
 
 """
 The purpose of this test is the validation of the implemented calculation of centroids. The implemented 
@@ -152,6 +153,151 @@ def test_process():
     expected_result = [1, 2], [0, 6], [0, 6], [0, 0], [1, 1], [1, 1], [6, 6]
     assertCentroidsEqual(expected_result, centroid_calculator.process((shot, x, y, tof, tot)))
 
+def test_calculate_centroid_properties_equal_ndimage():
+    """Compare with the former implementation based on scipy.ndimage. Both sum in the original order of
+    the points, still only the integer based columns are guaranteed to be exactly equal (see the docstring
+    of calculate_centroids_properties)."""
+    rng = np.random.default_rng(0)
+    size = 20_000
+    labels = rng.integers(1, 3_000, size)
+    shot = labels // 10
+    x = rng.integers(0, 256, size)
+    y = rng.integers(0, 256, size)
+    tof = rng.random(size) * 1e-6
+    tot = rng.integers(1, 20, size) * 25
+
+    expected = __calculate_centroids_properties_ndimage(shot, x, y, tof, tot, labels)
+    actual = CentroidCalculator().calculate_centroids_properties(shot, x, y, tof, tot, labels)
+    for index in [0, 5, 6]:
+        assert expected[index].dtype == actual[index].dtype
+        np.testing.assert_array_equal(expected[index], actual[index])
+    for index in [1, 2, 3, 4]:
+        np.testing.assert_allclose(expected[index], actual[index], rtol=1e-14, atol=1e-22)
+
+
+def test_process_multiple_chunks():
+    centroid_calculator = CentroidCalculator(chunk_size_limit=10)
+    shot = np.repeat(np.arange(20), 6)
+    x = np.tile([0, 0, 0, 1, 0, -1], 20) + np.repeat(np.arange(20), 6)
+    y = np.tile([0, 0, 1, 0, -1, 0], 20)
+    tof = np.zeros(shot.shape[0])
+    tot = np.ones(shot.shape[0])
+
+    centroids = centroid_calculator.process((shot, x, y, tof, tot))
+    assert centroids.shape == (7, 20)
+    np.testing.assert_array_equal(np.arange(20), centroids[0])
+    np.testing.assert_array_equal(np.arange(20), centroids[1])
+    np.testing.assert_array_equal(6, centroids[6])
+
+
+def test_calculate_centroid_properties_timewalk():
+    cent_timewalk_lut = np.arange(1, 11) * 1e-12
+    centroid_calculator = CentroidCalculator(cent_timewalk_lut=cent_timewalk_lut)
+    shot = np.array([1, 1, 2, 2])
+    x = np.array([0, 1, 5, 6])
+    y = np.array([0, 0, 5, 5])
+    tof = np.array([1e-6, 1e-6, 2e-6, 2e-6])
+    tot = np.array([50, 25, 75, 100])
+    label = np.array([1, 1, 2, 2])
+
+    centroids = centroid_calculator.calculate_centroids_properties(shot, x, y, tof, tot, label)
+    np.testing.assert_allclose([1e-6 - 2e-9, 2e-6 - 4e-9], centroids[3])
+
+
+def test_pooled_equals_sequential():
+    rng = np.random.default_rng(0)
+    centroid_calculator = CentroidCalculator(chunk_size_limit=500)
+    pooled_calculator = CentroidCalculatorPooled(2, chunk_size_limit=500)
+    pooled_calculator.pre_process()
+    try:
+        # the growing data sizes require larger shared memory blocks
+        for clusters in [10, 3_000, 20, 30_000]:
+            cluster_size = rng.integers(1, 8, clusters)
+            shot = np.repeat(rng.integers(0, clusters // 5 + 1, clusters), cluster_size)
+            x = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-1, 2, cluster_size.sum())
+            y = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-1, 2, cluster_size.sum())
+            tof = np.repeat(rng.random(clusters) * 1e-6, cluster_size) + rng.random(cluster_size.sum()) * 1e-8
+            tot = rng.integers(1, 100, cluster_size.sum()) * 25
+
+            expected = centroid_calculator.process((shot, x, y, tof, tot))
+            actual = pooled_calculator.process((shot, x, y, tof, tot))
+            np.testing.assert_array_equal(expected, actual)
+    finally:
+        pooled_calculator.post_process()
+
+
+def test_split_indices_equal_loop():
+    rng = np.random.default_rng(0)
+    for chunk_size_limit in [1, 10, 100, 6_500]:
+        centroid_calculator = CentroidCalculator(chunk_size_limit=chunk_size_limit)
+        for size in [0, 1, 50, 5_000, 50_000]:
+            shot = np.sort(rng.integers(0, 1 + size // 20, size))
+            expected = __calc_trig_chunks_split_indices_loop(shot, chunk_size_limit)
+            actual = centroid_calculator._CentroidCalculator__calc_trig_chunks_split_indices(shot)
+            np.testing.assert_array_equal(expected, actual)
+
+
+def test_chunk_size_tuner():
+    tuner = ChunkSizeTuner(start_limit=1_000, min_limit=500, max_limit=4_000, step=2)
+    # growing throughput keeps the direction
+    tuner.update(1_000, 1.0)
+    assert tuner.limit == 2_000
+    tuner.update(1_000, 0.5)
+    assert tuner.limit == 4_000
+    # dropping throughput reverses it, the limits are kept
+    tuner.update(1_000, 1.0)
+    assert tuner.limit == 2_000
+    for _ in range(3):
+        tuner.update(1_000, 10.0)
+    assert tuner.limit >= 500
+
+    # chunks are balanced between the workers
+    tuner = ChunkSizeTuner(start_limit=6_500, min_limit=500, chunks_per_worker=2)
+    assert tuner.chunk_size_limit(100_000, 1) == 6_500
+    assert tuner.chunk_size_limit(10_000, 4) == 1_250
+    assert tuner.chunk_size_limit(100, 4) == 500
+
+
+def test_adaptive_chunk_size():
+    centroid_calculator = CentroidCalculator(adaptive_chunk_size=True, chunk_size_limit=10)
+    shot = np.repeat(np.arange(20), 6)
+    x = np.tile([0, 0, 0, 1, 0, -1], 20) + np.repeat(np.arange(20), 6)
+    y = np.tile([0, 0, 1, 0, -1, 0], 20)
+    tof = np.zeros(shot.shape[0])
+    tot = np.ones(shot.shape[0])
+
+    for _ in range(3):
+        centroids = centroid_calculator.process((shot, x, y, tof, tot))
+        assert centroids.shape == (7, 20)
+    assert centroid_calculator.chunk_size_limit != 10
+
+
+def __calc_trig_chunks_split_indices_loop(shot, chunk_size_limit):
+    _, unique_trig_nr_indices, unique_trig_nr_counts = np.unique(shot, return_index=True, return_counts=True)
+
+    trigger_chunks = []
+    trigger_chunk_voxel_counter = 0
+    for index, unique_trig_nr_index in enumerate(unique_trig_nr_indices):
+        if trigger_chunk_voxel_counter < chunk_size_limit:
+            trigger_chunk_voxel_counter += unique_trig_nr_counts[index]
+        else:
+            trigger_chunks.append(unique_trig_nr_index)
+            trigger_chunk_voxel_counter = unique_trig_nr_counts[index]
+
+    return trigger_chunks
+
+
+def __calculate_centroids_properties_ndimage(shot, x, y, tof, tot, labels):
+    label_index, cluster_size = np.unique(labels, return_counts=True)
+    tot_max = np.array(nd.maximum_position(tot, labels=labels, index=label_index)).flatten()
+    tot_sum = nd.sum(tot, labels=labels, index=label_index)
+    tot_mean = nd.mean(tot, labels=labels, index=label_index)
+    cluster_x = np.array(nd.sum(x * tot, labels=labels, index=label_index) / tot_sum).flatten()
+    cluster_y = np.array(nd.sum(y * tot, labels=labels, index=label_index) / tot_sum).flatten()
+    cluster_tof = np.array(nd.sum(tof * tot, labels=labels, index=label_index) / tot_sum).flatten()
+    return shot[tot_max], cluster_x, cluster_y, cluster_tof, tot_mean, tot[tot_max], cluster_size
+
+
 def assertCentroidsEqual(expected, actual):
     for i in range(len(expected)):
         np.testing.assert_array_equal(expected[i], actual[i])
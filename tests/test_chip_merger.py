@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from pymepix.processing.chip_merger import ChipMerger, raw_file_hits
+
+from .synthetic_raw_data import START_LONGTIME, create_raw_words, write_raw_file
+
+
+def __blocks(toa, size):
+    toa = np.asarray(toa, dtype=np.float64)
+    for start in range(0, toa.shape[0], size):
+        part = toa[start : start + size]
+        yield np.zeros(part.shape[0], dtype=np.int64), np.ones(part.shape[0], dtype=np.int64), part, np.arange(part.shape[0])
+
+
+def test_merged_hits_are_ordered():
+    rng = np.random.default_rng(0)
+    chips = [np.sort(rng.uniform(0, 10, size)) for size in (1_000, 10, 500)]
+    # hits arriving slightly late
+    chips[2][100:102] = chips[2][100:102][::-1]
+    streams = [__blocks(chips[0], 64), __blocks(chips[1], 3), __blocks(chips[2], 50)]
+    blocks = list(ChipMerger(streams, offsets=[(0, 0), (256, 0), (0, 256)], max_disorder=0.5))
+
+    chip, x, y, toa, _ = (np.concatenate(column) for column in zip(*blocks))
+    assert len(blocks) > 1
+    np.testing.assert_array_equal(toa, np.sort(np.concatenate(chips)))
+    for index, hits in enumerate(chips):
+        assert np.count_nonzero(chip == index) == hits.shape[0]
+    np.testing.assert_array_equal(x[chip == 1], 256)
+    np.testing.assert_array_equal(y[chip == 2], 257)
+
+
+def test_offsets_of_all_chips():
+    with pytest.raises(ValueError):
+        ChipMerger([[], []], offsets=[(0, 0)])
+
+
+def test_raw_files(tmp_path):
+    files, expected = [], []
+    for seed in range(2):
+        words = create_raw_words(duration=12.0, seed=seed)
+        files.append(write_raw_file(str(tmp_path / "chip{}.raw".format(seed)), words))
+        first_heartbeat = np.flatnonzero(words >> np.uint64(56) == 0x45)[0]
+        pixels = words[first_heartbeat:][words[first_heartbeat:] >> np.uint64(60) == 0xB]
+        expected.append(pixels.shape[0])
+
+    blocks = list(ChipMerger([raw_file_hits(file_name, block_size=2_000) for file_name in files]))
+    chip, _, _, toa, _ = (np.concatenate(column) for column in zip(*blocks))
+    assert [np.count_nonzero(chip == index) for index in range(2)] == expected
+    assert np.all(np.diff(toa) >= 0)
+    assert START_LONGTIME * 25e-9 <= toa[0] and toa[-1] < START_LONGTIME * 25e-9 + 13.0
@@ -0,0 +1,65 @@
+import numpy as np
+
+from pymepix.processing.logic.column_buffer import ColumnBuffer
+from pymepix.processing.logic.packet_processor import PacketProcessor
+
+
+def test_append_grows_and_keeps_order():
+    buffer = ColumnBuffer((np.int64, np.float64), capacity=4)
+    for start in range(0, 100, 10):
+        values = np.arange(start, start + 10)
+        buffer.append(values, values * 0.5)
+
+    assert len(buffer) == 100
+    assert buffer.capacity >= 100
+    np.testing.assert_array_equal(np.arange(100), buffer.column(0))
+    np.testing.assert_array_equal(np.arange(100) * 0.5, buffer.column(1))
+
+
+def test_consume_reclaims_space():
+    buffer = ColumnBuffer((np.int64,), capacity=16)
+    buffer.append(np.arange(12))
+    buffer.consume(10)
+    buffer.append(np.arange(12, 16))
+    buffer.append(np.arange(16, 18))
+
+    # the live rows were moved to the front instead of growing the storage
+    assert buffer.capacity == 16
+    np.testing.assert_array_equal(np.arange(10, 18), buffer.column(0))
+
+
+def test_keep_and_take():
+    buffer = ColumnBuffer((np.int64, np.int64))
+    buffer.append(np.arange(10), np.arange(10, 20))
+
+    taken = buffer.take(buffer.column(0) % 2 == 0)
+    np.testing.assert_array_equal([0, 2, 4, 6, 8], taken[0])
+    np.testing.assert_array_equal([10, 12, 14, 16, 18], taken[1])
+
+    buffer.keep(buffer.column(0) >= 7)
+    np.testing.assert_array_equal([7, 8, 9], buffer.column(0))
+    np.testing.assert_array_equal([17, 18, 19], buffer.column(1))
+
+    # taken rows are copies and not affected by later changes of the buffer
+    buffer.append(np.arange(100), np.arange(100))
+    np.testing.assert_array_equal([0, 2, 4, 6, 8], taken[0])
+
+
+def test_packet_processor_carry_over():
+    packet_processor = PacketProcessor(handle_events=True)
+    packet_processor._trigger_buffer.append(np.array([1.0, 2.0, 3.0, 4.0]))
+    packet_processor._pixel_buffer.append(
+        np.array([1, 2, 3, 4, 5]),
+        np.array([1, 2, 3, 4, 5]),
+        np.array([0.5, 1.5, 2.5, 3.5, 4.5]),
+        np.array([25, 25, 25, 25, 25]),
+    )
+
+    event_data, timestamps = packet_processor.find_events_fast()
+
+    np.testing.assert_array_equal([0, 1], event_data[0])
+    np.testing.assert_array_equal([2, 3], event_data[1])
+    np.testing.assert_array_almost_equal([0.5, 0.5], event_data[3])
+    # the last two triggers and all pixels after the last used trigger are carried over
+    np.testing.assert_array_equal([3.0, 4.0], packet_processor._trigger_buffer.column(0))
+    np.testing.assert_array_equal([4, 5], packet_processor._pixel_buffer.column(0))
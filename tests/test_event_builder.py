@@ -0,0 +1,72 @@
+import queue
+
+import numpy as np
+
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.logic.packet_processor import PacketProcessor
+from pymepix.processing.pipeline_event_builder import PipelineEventBuilder
+
+from .synthetic_raw_data import START_LONGTIME, create_raw_words
+
+
+def __chunks(size=100):
+    words = create_raw_words(duration=4.0)
+    return [np.append(words[start : start + size], np.uint64(START_LONGTIME)).tobytes() for start in range(0, words.shape[0], size)]
+
+
+def __concatenate(events):
+    return [np.concatenate(columns) for columns in zip(*events)]
+
+
+def __build_events(messages, max_pending=1_000):
+    output = queue.Queue()
+    builder = PipelineEventBuilder(
+        packet_processor=PacketProcessor(event_window=(0.0, 1.0)), max_pending=max_pending, shared_output=output
+    )
+    builder.pre_run()
+    for message in messages:
+        builder.process(MessageType.DecodedData, message)
+    data_type, event_data = builder.post_run()
+    assert data_type == MessageType.EventData
+
+    events, pixels = [], []
+    while not output.empty():
+        data_type, data = output.get()
+        (events if data_type == MessageType.EventData else pixels).append(data)
+    events.append(event_data)
+    return builder, events, pixels
+
+
+def test_events_of_unordered_chunks():
+    chunks = __chunks()
+    sequential = PacketProcessor(event_window=(0.0, 1.0))
+    expected_events, expected_pixels = [], []
+    for chunk in chunks:
+        event_data, pixel_data, _ = sequential.process(chunk)
+        if event_data is not None:
+            expected_events.append(event_data)
+        if pixel_data is not None:
+            expected_pixels.append(pixel_data)
+    expected_events.append(sequential.post_process()[0])
+
+    decoder = PacketProcessor(event_window=(0.0, 1.0))
+    messages = [(sequence, *decoder.decode(chunk)) for sequence, chunk in enumerate(chunks)]
+    np.random.default_rng(0).shuffle(messages)
+    builder, events, pixels = __build_events(messages)
+
+    assert builder.skipped_chunks == 0
+    for column, expected_column in zip(__concatenate(events), __concatenate(expected_events)):
+        np.testing.assert_array_equal(column, expected_column)
+    for column, expected_column in zip(__concatenate(pixels), __concatenate(expected_pixels)):
+        np.testing.assert_array_equal(column, expected_column)
+
+
+def test_missing_chunk_is_skipped():
+    decoder = PacketProcessor(event_window=(0.0, 1.0))
+    messages = [(sequence, *decoder.decode(chunk)) for sequence, chunk in enumerate(__chunks())]
+    del messages[3]
+    builder, events, _ = __build_events(messages, max_pending=10)
+    assert builder.skipped_chunks == 1
+    # the trigger numbers continue after the gap
+    event_numbers = __concatenate(events)[0]
+    assert np.all(np.diff(event_numbers) >= 0)
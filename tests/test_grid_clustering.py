@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from pymepix.processing.logic.centroid_calculator import CentroidCalculator
+from pymepix.processing.logic.grid_clustering import grid_dbscan
+
+"""The grid clustering has to give exactly the labels of DBSCAN on the features used by the CentroidCalculator.
+Dense random data with integer multiples of the time unit covers distances equal to epsilon, hits in the
+same pixel and border points in reach of several clusters."""
+
+
+def __create_dense_data(seed, size):
+    rng = np.random.default_rng(seed)
+    shot = rng.integers(0, 3, size)
+    x = rng.integers(-3, 15, size)
+    y = rng.integers(0, 15, size)
+    tof = rng.integers(0, 20, size) * 1e-7
+    return shot, x, y, tof
+
+
+@pytest.mark.parametrize("epsilon, min_samples", [(1, 1), (1.5, 3), (2, 3), (2, 5), (3, 4)])
+def test_labels_equal_dbscan(epsilon, min_samples):
+    for seed in range(10):
+        shot, x, y, tof = __create_dense_data(seed, 500)
+        expected = DBSCAN(eps=epsilon, min_samples=min_samples, n_jobs=1).fit(
+            np.column_stack((shot * epsilon * 1_000, x, y, tof * 1e7))
+        )
+        np.testing.assert_array_equal(expected.labels_, grid_dbscan(shot, x, y, tof, epsilon, min_samples, 1e7))
+
+
+def test_empty_input():
+    empty = np.empty(0)
+    assert grid_dbscan(empty, empty, empty, empty, 2, 3, 1e7).shape == (0,)
+
+
+def test_centroids_equal_dbscan():
+    rng = np.random.default_rng(0)
+    clusters = 300
+    cluster_size = rng.integers(1, 10, clusters)
+    shot = np.repeat(rng.integers(0, 20, clusters), cluster_size)
+    x = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-1, 2, cluster_size.sum())
+    y = np.repeat(rng.integers(0, 256, clusters), cluster_size) + rng.integers(-1, 2, cluster_size.sum())
+    tof = np.repeat(rng.random(clusters) * 1e-6, cluster_size) + rng.random(cluster_size.sum()) * 1e-8
+    tot = rng.integers(1, 100, cluster_size.sum()) * 25
+
+    expected = CentroidCalculator().process((shot, x, y, tof, tot))
+    actual = CentroidCalculator(clustering="grid").process((shot, x, y, tof, tot))
+    for expected_column, actual_column in zip(expected, actual):
+        np.testing.assert_array_equal(expected_column, actual_column)
+
+
+def test_unknown_clustering():
+    with pytest.raises(ValueError):
+        CentroidCalculator(clustering="optics")
@@ -0,0 +1,59 @@
+import h5py
+import numpy as np
+
+from pymepix.processing.hdf5writer import Hdf5Writer
+
+
+def __create_batch(rng, size):
+    raw = (
+        np.sort(rng.integers(0, 1000, size)),
+        rng.integers(0, 256, size),
+        rng.integers(0, 256, size),
+        rng.random(size) * 1e-5,
+        rng.integers(1, 100, size) * 25,
+    )
+    centroids = np.stack([rng.random(size // 4) for _ in range(7)])
+    timestamps = (np.unique(raw[0]), np.unique(raw[0]).astype(np.uint64) * 1000)
+    return raw, centroids, timestamps
+
+
+def test_batches_are_written_in_order(tmp_path):
+    rng = np.random.default_rng(0)
+    batches = [__create_batch(rng, size) for size in [100, 0, 57, 1000, 3]]
+    file_name = tmp_path / "output.hdf5"
+
+    with Hdf5Writer(file_name, buffer_size=150, chunk_size=64) as writer:
+        for raw, centroids, timestamps in batches:
+            writer.write(raw, centroids, timestamps)
+
+    with h5py.File(file_name, "r") as f:
+        for index, (key, dtype) in enumerate(
+            [("trigger nr", np.uint64), ("x", np.uint8), ("y", np.uint8), ("tof", np.float64), ("tot", np.uint32)]
+        ):
+            assert f["raw"][key].dtype == dtype
+            assert f["raw"][key].chunks == (64,)
+            np.testing.assert_array_equal(
+                np.concatenate([batch[0][index] for batch in batches]).astype(dtype), f["raw"][key][()]
+            )
+        for index, key in enumerate(["trigger nr", "x", "y", "tof", "tot avg", "tot max", "clustersize"]):
+            np.testing.assert_array_equal(np.concatenate([batch[1][index] for batch in batches]), f["centroided"][key][()])
+        np.testing.assert_array_equal(
+            np.concatenate([batch[2][1] for batch in batches]), f["timing/timepix/timestamp"][()]
+        )
+        assert f["timing"].attrs["description"] == "timing information from TimePix and facility"
+        assert f["timing/timepix/timestamp"].attrs["unit"] == "ns"
+        assert f["centroided/tot max"].attrs["description"] == "maximum of time above threshold in cluster"
+
+
+def test_compression(tmp_path):
+    rng = np.random.default_rng(1)
+    raw, centroids, timestamps = __create_batch(rng, 10_000)
+    file_name = tmp_path / "output.hdf5"
+
+    with Hdf5Writer(file_name, compression="gzip", compression_opts=4) as writer:
+        writer.write(raw=raw)
+
+    with h5py.File(file_name, "r") as f:
+        assert list(f.keys()) == ["raw"]
+        assert f["raw/tof"].compression == "gzip"
+        np.testing.assert_array_equal(raw[3], f["raw/tof"][()])
@@ -0,0 +1,60 @@
+import queue
+
+import numpy as np
+import pytest
+
+from pymepix.processing.basepipeline import _merge
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.latency import LatencyTracker
+from pymepix.processing.pipeline_event_builder import PipelineEventBuilder
+from pymepix.processing.logic.packet_processor import PacketProcessor
+
+from .synthetic_raw_data import START_LONGTIME, create_raw_words
+
+
+def test_report_per_message_type():
+    tracker = LatencyTracker(window=100)
+    for sequence in range(200):
+        tracker.add(MessageType.EventData, (sequence, 0.0), now=1e-3 * (sequence % 100))
+    tracker.add(MessageType.CentroidData, (0, 1.0), now=1.5)
+
+    report = tracker.report()
+    assert report["EventData"]["count"] == 200
+    assert report["EventData"]["p50"] == pytest.approx(0.0495)
+    assert report["EventData"]["max"] == pytest.approx(0.099)
+    assert report["CentroidData"] == {"count": 1, "p50": 0.5, "p99": 0.5, "max": 0.5}
+
+    # untraced messages are passed on unchanged
+    assert tracker.record((MessageType.PixelData, "data")) == (MessageType.PixelData, "data")
+    tracker.reset()
+    assert tracker.report() == {}
+
+
+def test_merged_messages_keep_oldest_trace():
+    shot = np.arange(4)
+    messages = [(MessageType.EventData, (shot + 4 * index, shot), (index, 10.0 + index)) for index in range(3)]
+    merged = _merge(messages)
+    assert len(merged) == 1
+    assert merged[0][2] == (0, 10.0)
+    np.testing.assert_array_equal(merged[0][1][0], np.arange(12))
+
+
+def test_event_builder_traces_chunks():
+    words = create_raw_words(duration=4.0)
+    chunks = [np.append(words[start : start + 100], np.uint64(START_LONGTIME)).tobytes() for start in range(0, 2_000, 100)]
+    decoder = PacketProcessor(event_window=(0.0, 1.0))
+    output = queue.Queue()
+    builder = PipelineEventBuilder(packet_processor=PacketProcessor(event_window=(0.0, 1.0)), shared_output=output, trace=True)
+    builder.pre_run()
+    for sequence in reversed(range(len(chunks))):
+        builder.input_received(trace=(sequence, float(sequence)))
+        builder.process(MessageType.DecodedData, (sequence, *decoder.decode(chunks[sequence])))
+
+    sequences = []
+    while not output.empty():
+        data_type, _, (sequence, receive_time) = output.get()
+        assert receive_time == sequence
+        if data_type == MessageType.PixelData:
+            sequences.append(sequence)
+    assert sequences == sorted(sequences)
+    assert len(sequences) > 1
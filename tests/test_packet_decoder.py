@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from pymepix.processing.logic.packet_decoder import _decode_packet, fused_decoder_available
+from pymepix.processing.logic.packet_processor import PacketProcessor, PixelOrientation
+
+LONGTIME = 2233861246990
+
+
+def __create_packets(size, seed=0):
+    """Random words with pixel, trigger and heartbeat headers"""
+    rng = np.random.default_rng(seed)
+    headers = rng.choice(
+        np.array([0xA0, 0xB0, 0x4F, 0x6F, 0x44, 0x45, 0x71], dtype=np.uint64), size=size
+    )
+    payload = rng.integers(0, 2 ** 56, size=size, dtype=np.uint64)
+    packets = (headers << np.uint64(56)) | payload
+    # hit all fine time values of the triggers including 0
+    packets[headers == 0x6F] &= ~np.uint64(0xF << 5)
+    packets[headers == 0x6F] |= rng.integers(0, 13, size=np.sum(headers == 0x6F), dtype=np.uint64) << np.uint64(5)
+    return packets
+
+
+def __decode_numpy(packet_processor, packets, longtime):
+    header = ((packets & 0xF000000000000000) >> 60) & 0xF
+    subheader = ((packets & 0x0F00000000000000) >> 56) & 0xF
+    pixels = packets[(header == 0xA) | (header == 0xB)]
+    triggers = packets[((header == 0x4) | (header == 0x6)) & (subheader == 0xF)]
+    pixel_data = packet_processor.process_pixels(np.int64(pixels), longtime)
+    coarsetime = np.int64(triggers) >> 12 & 0xFFFFFFFF
+    coarsetime = packet_processor.correct_global_time(coarsetime, longtime)
+    tmpfine = (np.int64(triggers) >> 5) & 0xF
+    tmpfine = ((tmpfine - 1) << 9) // 12
+    trigtime_fine = (np.int64(triggers) & 0x0000000000000E00) | (tmpfine & 0x00000000000001FF)
+    trigger_data = coarsetime * 25e-9 + trigtime_fine * (25.0 / 4096) * 1e-9
+    return pixel_data, trigger_data
+
+
+@pytest.mark.parametrize("orientation", list(PixelOrientation))
+def test_kernel_matches_numpy(orientation):
+    packets = __create_packets(2_000)
+    timewalk_lut = np.linspace(0.0, 1e-9, 1023)
+    packet_processor = PacketProcessor(
+        handle_events=False, orientation=orientation, position_offset=(3, 7), timewalk_lut=timewalk_lut
+    )
+
+    size = packets.shape[0]
+    x, y, tot = (np.empty(size, dtype=np.int64) for _ in range(3))
+    toa, triggers = (np.empty(size, dtype=np.float64) for _ in range(2))
+    pixel_count, trigger_count = _decode_packet(
+        packets.view(np.int64), LONGTIME, int(orientation), 3, 7, timewalk_lut, x, y, toa, tot, triggers
+    )
+
+    (x_orig, y_orig, toa_orig, tot_orig), triggers_orig = __decode_numpy(packet_processor, packets, LONGTIME)
+    np.testing.assert_array_equal(x_orig, x[:pixel_count])
+    np.testing.assert_array_equal(y_orig, y[:pixel_count])
+    np.testing.assert_array_equal(toa_orig, toa[:pixel_count])
+    np.testing.assert_array_equal(tot_orig, tot[:pixel_count])
+    np.testing.assert_array_equal(triggers_orig, triggers[:trigger_count])
+
+
+@pytest.mark.skipif(not fused_decoder_available(), reason="Numba is not installed")
+def test_fused_packet_processor_matches_numpy():
+    packets = __create_packets(200_000, seed=1)
+    data = np.append(packets, np.uint64(LONGTIME)).tobytes()
+
+    fused = PacketProcessor(handle_events=False, fused_decoder=True)
+    numpy_processor = PacketProcessor(handle_events=False)
+
+    _, pixels_fused, _ = fused.process(data)
+    _, pixels_numpy, _ = numpy_processor.process(data)
+    for fused_column, numpy_column in zip(pixels_fused, pixels_numpy):
+        assert fused_column.dtype == numpy_column.dtype
+        np.testing.assert_array_equal(numpy_column, fused_column)
@@ -0,0 +1,73 @@
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+from pymepix.processing.packet_ring import PacketRing
+
+
+def __consume(name, descriptors, results):
+    ring = PacketRing.attach(name)
+    while True:
+        descriptor = descriptors.get()
+        if descriptor is None:
+            break
+        data, sequence = ring.read(descriptor)
+        results.put((sequence, np.frombuffer(data, dtype=np.uint64).sum()))
+        del data
+        ring.release(sequence)
+    ring.close()
+
+
+def test_slots_are_reused_after_release():
+    ring = PacketRing.create(slots=2, slot_size=64)
+    try:
+        descriptors = []
+        for sequence in range(2):
+            slot = ring.acquire(sequence)
+            slot[:8] = np.uint64(sequence + 10).tobytes()
+            del slot
+            descriptors.append(ring.publish(sequence, 8))
+        # both slots are in use
+        assert ring.acquire(2, timeout=0.01) is None
+
+        data, sequence = ring.read(descriptors[0])
+        assert sequence == 0
+        assert np.frombuffer(data, dtype=np.uint64)[0] == 10
+        del data
+        ring.release(0)
+        assert ring.acquire(2) is not None
+        assert ring.acquire(3, timeout=0.01) is None
+
+        ring.publish(2, 8)
+        with pytest.raises(RuntimeError):
+            ring.read(descriptors[0])
+    finally:
+        ring.close()
+
+
+def test_consumer_processes():
+    ring = PacketRing.create(slots=4, slot_size=8 * 100)
+    descriptors = mp.Queue()
+    results = mp.Queue()
+    consumers = [mp.Process(target=__consume, args=(ring.name, descriptors, results)) for _ in range(2)]
+    for consumer in consumers:
+        consumer.start()
+
+    chunks = 50
+    for sequence in range(chunks):
+        slot = ring.acquire(sequence, timeout=10)
+        assert slot is not None
+        values = np.frombuffer(slot, dtype=np.uint64, count=100)
+        values[:] = np.arange(100) + sequence
+        del values
+        descriptors.put(ring.publish(sequence, 8 * 100))
+
+    received = dict(results.get(timeout=10) for _ in range(chunks))
+    for _ in consumers:
+        descriptors.put(None)
+    for consumer in consumers:
+        consumer.join()
+    ring.close()
+
+    assert received == {sequence: np.arange(100).sum() + 100 * sequence for sequence in range(chunks)}
@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+import pytest
+
+from pymepix.processing.raw_compression import (
+    CompressedRawFile,
+    RawCompressor,
+    available_codecs,
+    is_compressed,
+    open_raw,
+    raw_size,
+    shuffle,
+    unshuffle,
+)
+from pymepix.processing.raw_writer import RawFileWriter
+
+from .synthetic_raw_data import create_raw_words
+
+
+def test_shuffle():
+    data = np.arange(8 * 5 + 3, dtype=np.uint8).tobytes()
+    shuffled = shuffle(data)
+    assert shuffled[:5] == bytes(range(0, 40, 8))
+    assert shuffled[-3:] == data[-3:]
+    assert unshuffle(shuffled) == data
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+@pytest.mark.parametrize("shuffled", [False, True])
+def test_random_access(tmp_path, codec, shuffled):
+    data = np.uint64(1_600_000_000_000_000_000).tobytes() + create_raw_words(duration=2.0).tobytes() + b"\x01"
+    file_name = str(tmp_path / "raw.bin")
+    with RawFileWriter(file_name, buffer_size=4_096, compression=codec, shuffle=shuffled) as writer:
+        for start in range(0, len(data), 1_000):
+            writer.write(data[start : start + 1_000])
+    assert writer.statistics["raw_bytes"] == len(data)
+    assert writer.statistics["ratio"] > 1
+
+    assert is_compressed(file_name)
+    assert raw_size(file_name) == len(data)
+    with open_raw(file_name) as f:
+        assert f.read() == data
+    with CompressedRawFile(file_name) as f:
+        for position in (10_000, 4_090, 0, len(data) - 5):
+            f.seek(position)
+            assert f.read(100) == data[position : position + 100]
+        f.seek(-8, io.SEEK_END)
+        assert f.read() == data[-8:]
+
+
+def test_plain_file(tmp_path):
+    file_name = tmp_path / "raw.bin"
+    file_name.write_bytes(b"plain raw data")
+    assert not is_compressed(str(file_name))
+    with open_raw(str(file_name)) as f:
+        assert f.read() == b"plain raw data"
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        RawCompressor("brotli")
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from pymepix.processing.raw_index import HeartbeatIndex, heartbeat_index_file_name
+
+from .synthetic_raw_data import START_LONGTIME, TICKS_PER_SECOND, create_raw_words, write_raw_file
+
+
+def __per_word_index(words):
+    offsets, longtimes, triggers, boundaries = [], [], [], []
+    lsb, trigger_count, last_push = 0, 0, None
+    chunk_triggers, chunk_pixels, chunk_entry = 0, False, 0
+    for offset, word in enumerate(words.tolist()):
+        header, subheader = word >> 60, (word >> 56) & 0xF
+        if header in (0xA, 0xB):
+            chunk_pixels = last_push is not None
+        if header not in (0x4, 0x6):
+            continue
+        if subheader == 0x4:
+            lsb = (word & 0x0000FFFFFFFF0000) >> 16
+        elif subheader == 0x5:
+            longtime = ((word & 0x00000000FFFF0000) << 16) | lsb
+            push = last_push is not None and (longtime - last_push) * 25e-9 > 5.0
+            if last_push is None or push:
+                last_push = longtime
+            if push:
+                # the PacketProcessor drops the triggers of a chunk without pixels
+                if chunk_pixels:
+                    trigger_count += chunk_triggers
+                else:
+                    triggers[chunk_entry:] = [trigger_count] * (len(triggers) - chunk_entry)
+                chunk_triggers, chunk_pixels, chunk_entry = 0, False, len(triggers) + 1
+            offsets.append(offset)
+            longtimes.append(longtime)
+            triggers.append(trigger_count + chunk_triggers)
+            boundaries.append(push or len(offsets) == 1)
+        elif subheader == 0xF and last_push is not None:
+            chunk_triggers += 1
+    return offsets, longtimes, triggers, boundaries
+
+
+def test_index_equals_per_word_scanning(tmp_path):
+    words = create_raw_words(duration=30.0)
+    # triggers before the first heartbeat are not counted
+    words = np.concatenate((words[words >> np.uint64(60) == 0x6][:3], words))
+    # no pixels from 10 s to 20 s, so at least one chunk has only triggers
+    pixels = np.flatnonzero((words >> np.uint64(60) == 0xA) | (words >> np.uint64(60) == 0xB))
+    words = np.delete(words, pixels[(pixels >= words.shape[0] // 3) & (pixels < words.shape[0] * 2 // 3)])
+    raw_file = write_raw_file(str(tmp_path / "run.raw"), words)
+
+    index = HeartbeatIndex.build(raw_file, block_size=333)
+    offsets, longtimes, triggers, boundaries = __per_word_index(words)
+    np.testing.assert_array_equal(index.offsets, offsets)
+    np.testing.assert_array_equal(index.longtimes, longtimes)
+    np.testing.assert_array_equal(index.triggers, triggers)
+    np.testing.assert_array_equal(index.boundaries, boundaries)
+    assert index.longtimes[0] == START_LONGTIME
+    assert index.triggers[-1] < np.count_nonzero(words >> np.uint64(60) == 0x6) - 3
+
+    # the range starts at the boundary before the heartbeat before the start
+    first_word, stop_word, longtime, trigger_count = index.time_range(7.0, 8.0)
+    begin = np.searchsorted(index.offsets, first_word)
+    assert index.boundaries[begin] and longtime < START_LONGTIME + 7 * TICKS_PER_SECOND
+    before_start = np.searchsorted(index.longtimes, START_LONGTIME + 7 * TICKS_PER_SECOND)
+    assert not index.boundaries[begin + 1 : before_start].any()
+    assert index.longtimes[np.searchsorted(index.offsets, stop_word) - 1] > START_LONGTIME + 8 * TICKS_PER_SECOND
+    first_word, stop_word, longtime, trigger_count = index.trigger_range(100, 200)
+    assert trigger_count <= 100
+    assert index.time_range(start=100.0)[1] is None
+
+
+def test_sidecar(tmp_path):
+    raw_file = write_raw_file(str(tmp_path / "run.raw"), create_raw_words(duration=2.0))
+    index = HeartbeatIndex.load(raw_file)
+    assert os.path.exists(heartbeat_index_file_name(raw_file))
+    np.testing.assert_array_equal(HeartbeatIndex.load(raw_file).offsets, index.offsets)
+
+    # the index of a changed file is built again
+    write_raw_file(raw_file, create_raw_words(duration=1.0))
+    os.utime(heartbeat_index_file_name(raw_file), (0, 0))
+    assert len(HeartbeatIndex.load(raw_file)) < len(index)
@@ -0,0 +1,144 @@
+import glob
+import time
+
+import numpy as np
+import pytest
+import zmq
+
+from pymepix.processing.raw_segments import (
+    SegmentIndex,
+    SegmentedRawFile,
+    load_segment_indices,
+    segment_file_name,
+    select_segments,
+)
+from pymepix.processing.rawtodisk import Raw2Disk
+
+from .synthetic_raw_data import START_LONGTIME, TICKS_PER_SECOND, create_raw_words, heartbeat_words
+
+
+def __write_segments(file_name, words, splits):
+    indices = []
+    heartbeat_lsb = None
+    for segment, part in enumerate(np.split(words, splits)):
+        segment_name = segment_file_name(file_name, segment)
+        with open(segment_name, "wb") as f:
+            f.write(np.uint64(segment).tobytes())
+            f.write(part.tobytes())
+        index = SegmentIndex(segment_name, segment, segment, heartbeat_lsb)
+        # passed in pieces as by Raw2Disk
+        for piece in np.array_split(part, 3):
+            index.update(piece.tobytes())
+        index.save()
+        heartbeat_lsb = index.heartbeat_lsb
+        indices.append(index)
+    return indices
+
+
+def test_heartbeats_split_between_segments(tmp_path):
+    words = np.array(heartbeat_words(START_LONGTIME) + heartbeat_words(START_LONGTIME + 1_000), dtype=np.uint64)
+    # the second MSB word is in another segment than its LSB word
+    first, second = __write_segments(str(tmp_path / "run.raw"), words, [3])
+    assert (first.first_longtime, first.last_longtime, first.heartbeats) == (START_LONGTIME, START_LONGTIME, 1)
+    assert (second.first_longtime, second.last_longtime, second.heartbeats) == (START_LONGTIME + 1_000,) * 2 + (1,)
+
+
+def test_segments_of_time_range(tmp_path):
+    words = create_raw_words(duration=4.0)
+    file_name = str(tmp_path / "run.raw")
+    indices = __write_segments(file_name, words, [1_000, 2_000, 3_000])
+    (tmp_path / "run_notes.raw").write_bytes(b"")
+
+    loaded = load_segment_indices(file_name)
+    assert [index["file"] for index in loaded] == [segment_file_name(file_name, segment) for segment in range(4)]
+    assert sum(index["triggers"] for index in loaded) == 400
+    assert sum(index["words"] for index in loaded) == words.shape[0]
+    assert loaded[1] == dict(indices[1].to_dict(), file=segment_file_name(file_name, 1))
+
+    assert len(select_segments(file_name)) == 4
+    middle = (loaded[1]["first_longtime"] + loaded[1]["last_longtime"]) // 2
+    assert select_segments(file_name, middle, middle + 1) == [segment_file_name(file_name, 1)]
+    assert select_segments(file_name, START_LONGTIME + 10 * TICKS_PER_SECOND) == [segment_file_name(file_name, 3)]
+    assert select_segments(file_name, stop=START_LONGTIME - 1) == []
+
+
+def __heartbeat_longtimes(words):
+    """Position and longtime of each MSB heartbeat word with a preceding LSB word"""
+    header = words >> np.uint64(60)
+    subheader = (words >> np.uint64(56)) & np.uint64(0xF)
+    lsb_indices = np.flatnonzero((header == 0x4) & (subheader == 0x4))
+    msb_indices = np.flatnonzero((header == 0x4) & (subheader == 0x5))
+    msb_indices = msb_indices[msb_indices > lsb_indices[0]]
+    lsb = (words[lsb_indices[np.searchsorted(lsb_indices, msb_indices) - 1]] & np.uint64(0x0000FFFFFFFF0000)) >> np.uint64(16)
+    return msb_indices, ((words[msb_indices] & np.uint64(0x00000000FFFF0000)) << np.uint64(16)) | lsb
+
+
+def __record(file_name, words, pieces, pause=0.0, **kwargs):
+    """Write words with Raw2Disk in pieces, driven as by TimepixDevice"""
+    z_sock = zmq.Context.instance().socket(zmq.PAIR)
+    port = z_sock.bind_to_random_port("tcp://127.0.0.1")
+    write2disk = Raw2Disk(preallocate=0, control_address="tcp://127.0.0.1:{}".format(port), **kwargs)
+    try:
+        z_sock.send_string(file_name)
+        assert z_sock.recv_string() == "OPENED"
+        assert z_sock.recv_string() == file_name
+        for piece in np.array_split(words, pieces):
+            write2disk.write(piece.tobytes())
+            time.sleep(pause)
+        write2disk.my_sock.send(b"EOF")
+        assert z_sock.recv_string() == "CLOSED"
+    finally:
+        z_sock.send_string("SHUTDOWN")
+        write2disk.write_thr.join()
+        z_sock.close(linger=0)
+
+
+@pytest.mark.parametrize("limit", [{"segment_size": 8_000}, {"segment_time": 0.3}])
+def test_raw2disk_segments(tmp_path, limit):
+    words = create_raw_words(duration=4.0)
+    file_name = str(tmp_path / "run.raw")
+    started = time.time_ns()
+    __record(file_name, words, 40, pause=0.05 if "segment_time" in limit else 0.0, **limit)
+
+    indices = load_segment_indices(file_name)
+    segment_files = [segment_file_name(file_name, segment) for segment in range(len(indices))]
+    assert len(indices) > 2
+    assert sorted(glob.glob(str(tmp_path / "*.raw"))) == segment_files
+    assert [index["file"] for index in indices] == segment_files
+
+    # each segment starts with its own start time header
+    start_times = [int(np.fromfile(segment, dtype="<u8", count=1)[0]) for segment in segment_files]
+    assert start_times == [index["start_time_ns"] for index in indices]
+    assert started <= start_times[0] and start_times == sorted(start_times) and start_times[-1] <= time.time_ns()
+
+    parts = [np.fromfile(segment, dtype="<u8")[1:] for segment in segment_files]
+    np.testing.assert_array_equal(np.concatenate(parts), words)
+    assert [index["words"] for index in indices] == [part.shape[0] for part in parts]
+    if "segment_size" in limit:
+        assert all(part.nbytes >= limit["segment_size"] for part in parts[:-1])
+
+    # the first and last heartbeat of each segment, the LSB word can be in the previous segment
+    positions, longtimes = __heartbeat_longtimes(words)
+    segment_of_heartbeat = np.searchsorted(np.cumsum([part.shape[0] for part in parts]), positions, side="right")
+    for segment, index in enumerate(indices):
+        in_segment = longtimes[segment_of_heartbeat == segment].tolist() or [None]
+        assert (index["first_longtime"], index["last_longtime"]) == (in_segment[0], in_segment[-1])
+        assert index["heartbeats"] == np.count_nonzero(segment_of_heartbeat == segment)
+
+
+def test_segmented_raw_file(tmp_path):
+    words = create_raw_words(duration=2.0)
+    file_name = str(tmp_path / "run.raw")
+    __write_segments(file_name, words, [1, 500, 501])
+
+    segment_files = [index["file"] for index in load_segment_indices(file_name)]
+    # the first segment is before the first heartbeat, the third one has no heartbeat
+    assert select_segments(file_name) == segment_files[1:]
+    after_second = load_segment_indices(file_name)[1]["last_longtime"] + 1
+    assert segment_files[2] in select_segments(file_name, after_second, after_second)
+    with SegmentedRawFile(segment_files) as f:
+        assert f.size == 8 + words.nbytes
+        # the header of the first segment, the words of all segments
+        assert np.frombuffer(f.read(), dtype="<u8").tolist() == [0] + words.tolist()
+        f.seek(8 + 499 * 8)
+        assert np.frombuffer(f.read(3 * 8), dtype="<u8").tolist() == words[499:502].tolist()
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from pymepix.processing.raw_writer import RawFileWriter
+
+
+@pytest.mark.parametrize("direct", [False, True])
+def test_messages_are_written_in_order(tmp_path, direct):
+    rng = np.random.default_rng(0)
+    messages = [rng.integers(0, 255, size, dtype=np.uint8).tobytes() for size in rng.integers(1, 20_000, 200)]
+    file_name = tmp_path / "raw.bin"
+    with RawFileWriter(str(file_name), buffer_size=8_192, preallocate=1 << 20, direct=direct) as writer:
+        for message in messages:
+            writer.write(message)
+        writer.write(memoryview(np.arange(10, dtype=np.uint64)))
+
+    expected = b"".join(messages) + np.arange(10, dtype=np.uint64).tobytes()
+    assert file_name.read_bytes() == expected
+    statistics = writer.statistics
+    assert statistics["bytes"] == len(expected)
+    assert statistics["mb_per_s"] > 0
+
+
+def test_empty_file(tmp_path):
+    file_name = tmp_path / "raw.bin"
+    RawFileWriter(str(file_name)).close()
+    assert file_name.read_bytes() == b""
@@ -0,0 +1,169 @@
+import h5py
+import numpy as np
+import pytest
+
+from pymepix.processing.raw_segments import segment_file_name
+from pymepix.processing.raw_writer import RawFileWriter
+from pymepix.processing.rawfilesampler import RawFileSampler
+from tests.synthetic_raw_data import create_raw_words, write_raw_file
+
+"""The vectorized scanning of the raw file is verified against the original word-by-word scanning
+(PerWordRawFileSampler). Both have to produce identical HDF5 files."""
+
+
+class PerWordRawFileSampler(RawFileSampler):
+    """Reference implementation handling every word of the raw file individually"""
+
+    def run(self):
+        self.pre_run()
+        buffer = []
+        for pixdata in np.fromfile(self._filename, dtype="<u8").tolist():
+            header = ((pixdata & 0xF000000000000000) >> 60) & 0xF
+            should_push = False
+            if header == 0xA or header == 0xB:
+                if self._longtime != -1:
+                    buffer.append(pixdata)
+            elif header == 0x4 or header == 0x6:
+                subheader = ((pixdata & 0x0F00000000000000) >> 56) & 0xF
+                if subheader == 0xF:
+                    if self._longtime != -1:
+                        buffer.append(pixdata)
+                elif subheader == 0x4:
+                    self._longtime_lsb = (pixdata & 0x0000FFFFFFFF0000) >> 16
+                elif subheader == 0x5:
+                    should_push = self.handle_msb_time(pixdata)
+
+            if should_push and len(buffer) > 0:
+                self._packet_buffer = [np.array(buffer, dtype=np.uint64)]
+                self.push_data()
+                buffer = []
+
+        if len(buffer) > 0:
+            self._packet_buffer = [np.array(buffer, dtype=np.uint64)]
+            self.push_data()
+        self.post_run()
+
+
+def assert_hdf5_equal(expected_file, actual_file):
+    with h5py.File(expected_file, "r") as expected, h5py.File(actual_file, "r") as actual:
+        expected_items, actual_items = {}, {}
+        expected.visititems(expected_items.__setitem__)
+        actual.visititems(actual_items.__setitem__)
+        assert expected_items.keys() == actual_items.keys()
+        for name, expected_item in expected_items.items():
+            actual_item = actual_items[name]
+            assert dict(expected_item.attrs) == dict(actual_item.attrs)
+            if isinstance(expected_item, h5py.Dataset):
+                assert expected_item.dtype == actual_item.dtype
+                np.testing.assert_array_equal(expected_item[()], actual_item[()])
+
+
+@pytest.fixture(scope="module")
+def raw_files(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("raw")
+    raw_file = write_raw_file(folder / "synthetic.raw", create_raw_words(duration=40.0, jump_at=25.0))
+    reference_file = folder / "reference.hdf5"
+    PerWordRawFileSampler(raw_file, reference_file).run()
+    with h5py.File(reference_file, "r") as f:
+        assert f["centroided/x"].shape[0] > 0
+    return raw_file, reference_file
+
+
+@pytest.mark.parametrize("block_size", [1, 5, 1_000, 1 << 22])
+def test_block_scanning_equals_per_word_scanning(raw_files, tmp_path, block_size):
+    raw_file, reference_file = raw_files
+    output_file = tmp_path / "output.hdf5"
+    RawFileSampler(raw_file, output_file, block_size=block_size).run()
+
+    assert_hdf5_equal(reference_file, output_file)
+
+
+def test_streaming_ignores_incomplete_word_and_reports_progress(raw_files, tmp_path):
+    raw_file, reference_file = raw_files
+    truncated_file = tmp_path / "truncated.raw"
+    truncated_file.write_bytes(raw_file.read_bytes() + b"\x01\x02\x03")
+    output_file = tmp_path / "output.hdf5"
+    progress = []
+    RawFileSampler(truncated_file, output_file, progress_callback=progress.append, block_size=10_000).run()
+
+    assert_hdf5_equal(reference_file, output_file)
+    assert progress == sorted(progress)
+    assert progress[-1] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("number_of_processes, block_size", [(2, 1 << 22), (3, 1_000)])
+def test_parallel_processing_equals_sequential_processing(raw_files, tmp_path, number_of_processes, block_size):
+    raw_file, reference_file = raw_files
+    output_file = tmp_path / "output.hdf5"
+    progress = []
+    RawFileSampler(
+        raw_file, output_file, number_of_processes, progress_callback=progress.append, block_size=block_size
+    ).run()
+
+    assert_hdf5_equal(reference_file, output_file)
+    assert progress[-1] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("number_of_processes", [None, 2])
+def test_compressed_file(raw_files, tmp_path, number_of_processes):
+    raw_file, reference_file = raw_files
+    compressed_file = tmp_path / "compressed.raw"
+    data = raw_file.read_bytes()
+    with RawFileWriter(str(compressed_file), buffer_size=50_000, compression="auto") as writer:
+        writer.write(data)
+    assert compressed_file.stat().st_size < len(data)
+
+    output_file = tmp_path / "output.hdf5"
+    RawFileSampler(compressed_file, output_file, number_of_processes, block_size=10_000).run()
+    assert_hdf5_equal(reference_file, output_file)
+
+
+def assert_trigger_range_equal(reference_file, output_file, first_trigger, stop_trigger):
+    with h5py.File(reference_file, "r") as expected, h5py.File(output_file, "r") as actual:
+        for group in ("raw", "centroided"):
+            expected_in_range = (expected[group]["trigger nr"][()] >= first_trigger) & (expected[group]["trigger nr"][()] < stop_trigger)
+            actual_in_range = (actual[group]["trigger nr"][()] >= first_trigger) & (actual[group]["trigger nr"][()] < stop_trigger)
+            assert 0 < actual[group]["trigger nr"].shape[0] < expected[group]["trigger nr"].shape[0]
+            for name in expected[group]:
+                np.testing.assert_array_equal(expected[group][name][()][expected_in_range], actual[group][name][()][actual_in_range])
+
+
+def test_trigger_range(raw_files, tmp_path):
+    raw_file, reference_file = raw_files
+    output_file = tmp_path / "output.hdf5"
+    RawFileSampler(raw_file, output_file).run_range(first_trigger=1_000, stop_trigger=1_500)
+    assert_trigger_range_equal(reference_file, output_file, 1_000, 1_500)
+
+
+def test_trigger_range_after_chunks_without_pixels(tmp_path):
+    words = create_raw_words(duration=40.0)
+    # no pixels from 12 s to 24 s, the PacketProcessor drops the triggers of the chunks in between
+    pixels = np.flatnonzero((words >> np.uint64(60) == 0xA) | (words >> np.uint64(60) == 0xB))
+    words = np.delete(words, pixels[(pixels >= words.shape[0] * 3 // 10) & (pixels < words.shape[0] * 6 // 10)])
+    raw_file = write_raw_file(tmp_path / "synthetic.raw", words)
+    reference_file = tmp_path / "reference.hdf5"
+    RawFileSampler(raw_file, reference_file).run()
+    with h5py.File(reference_file, "r") as f:
+        # at least one chunk of more than 5 s with 100 triggers per second
+        assert f["raw/trigger nr"][-1] < np.count_nonzero(words >> np.uint64(60) == 0x6) - 500
+
+    output_file = tmp_path / "output.hdf5"
+    RawFileSampler(raw_file, output_file).run_range(first_trigger=2_000, stop_trigger=2_400)
+    assert_trigger_range_equal(reference_file, output_file, 2_000, 2_400)
+
+
+@pytest.mark.parametrize("number_of_processes", [None, 2])
+def test_segment_files(raw_files, tmp_path, number_of_processes):
+    raw_file, reference_file = raw_files
+    header, words = raw_file.read_bytes()[:8], np.fromfile(raw_file, dtype="<u8")[1:]
+    segment_files = []
+    for segment, part in enumerate(np.array_split(words, [1_000, 20_000, 20_001, 50_000])):
+        segment_files.append(str(tmp_path / segment_file_name("run.raw", segment)))
+        # only the start time header of the first segment is used
+        start_time = header if segment == 0 else np.uint64(segment).tobytes()
+        with RawFileWriter(segment_files[-1], buffer_size=50_000, compression="auto" if segment == 1 else None) as writer:
+            writer.write(start_time + part.tobytes())
+
+    output_file = tmp_path / "output.hdf5"
+    RawFileSampler(segment_files, output_file, number_of_processes, block_size=10_000).run()
+    assert_hdf5_equal(reference_file, output_file)
@@ -0,0 +1,89 @@
+import csv
+import json
+import time
+from multiprocessing import Queue
+
+import numpy as np
+import pytest
+
+from pymepix.processing.baseacquisition import AcquisitionPipeline
+from pymepix.processing.basepipeline import BasePipelineObject
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.stage_metrics import StageMetrics
+
+
+class Source(BasePipelineObject):
+    def __init__(self, **kwargs):
+        super().__init__("Source", **kwargs)
+
+    def process(self, data_type=None, data=None):
+        time.sleep(0.001)
+        self.input_received()
+        return MessageType.PixelData, (np.zeros(100, dtype=np.int64),)
+
+
+class Sink(BasePipelineObject):
+    def __init__(self, **kwargs):
+        super().__init__("Sink", propogate_input=False, **kwargs)
+
+    def process(self, data_type=None, data=None):
+        time.sleep(0.002)
+        return None, None
+
+
+def test_histogram_and_rates():
+    metrics = StageMetrics()
+    start = time.perf_counter_ns()
+    for duration in (300_000, 300_000, 300_000, 3_000_000):
+        metrics.record(start - duration, nbytes=10)
+    metrics.store()
+    first = metrics.snapshot()
+    assert first["messages_in"] == 4
+    assert first["bytes_in"] == 40
+    assert sum(first["histogram"]) == 4
+    assert StageMetrics.quantile(first, 0.5) == 512e-6
+    assert StageMetrics.quantile(first, 1.0) >= 3e-3
+
+    time.sleep(0.01)
+    metrics.record(time.perf_counter_ns(), nbytes=10)
+    metrics.store()
+    rates = StageMetrics.rates(first, metrics.snapshot())
+    assert rates["messages_in_per_s"] > 0
+    assert rates["bytes_in_per_s"] == pytest.approx(rates["messages_in_per_s"] * 10)
+
+
+def test_pipeline_metrics(tmp_path):
+    pipeline = AcquisitionPipeline("Test", Queue())
+    pipeline.addStage(0, Source)
+    pipeline.addStage(1, Sink, num_processes=2)
+    csv_file, json_file = str(tmp_path / "metrics.csv"), str(tmp_path / "metrics.json")
+    pipeline.start()
+    pipeline.startMetricsDump(json_file, interval=0.2)
+    time.sleep(1.0)
+    pipeline.stopMetricsDump()
+    pipeline.startMetricsDump(csv_file, interval=0.2)
+    pipeline.stop()
+    pipeline.stopMetricsDump()
+
+    metrics = pipeline.getMetrics()
+    assert [(row["stage"], row["process"], row["name"]) for row in metrics] == [
+        (0, 0, "Source"),
+        (1, 0, "Sink"),
+        (1, 1, "Sink"),
+    ]
+    source, sinks = metrics[0], metrics[1:]
+    assert source["messages_out"] > 100
+    assert source["bytes_out"] == 800 * source["messages_out"]
+    # the sleep before input_received is not counted
+    assert source["mean_process_time"] < 1e-3
+    assert sum(sink["messages_in"] for sink in sinks) > 100
+    assert all(sink["mean_process_time"] > 2e-3 for sink in sinks)
+
+    with open(json_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) >= 4
+    assert len(lines[-1]["metrics"]) == 3
+    with open(csv_file, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[-1]["name"] == "Sink"
+    assert "histogram_20" in rows[-1]
@@ -0,0 +1,66 @@
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pytest
+
+from pymepix.processing.datatypes import MessageType
+from pymepix.processing.transport import QueueTransport, SharedColumns, SharedMemoryTransport, discard, receive
+
+
+def __columns(size):
+    rng = np.random.default_rng(size)
+    return rng.integers(0, 256, size), rng.integers(0, 256, size).astype(np.uint8), rng.random(size)
+
+
+def __produce(queue, transport, size):
+    queue.put((MessageType.EventData, transport.encode(__columns(size))))
+    queue.put((MessageType.DecodedData, transport.encode((7, __columns(size), np.arange(3.0)))))
+
+
+@pytest.mark.parametrize("transport", [QueueTransport(), SharedMemoryTransport()])
+def test_columns_between_processes(transport):
+    queue = mp.Queue()
+    producer = mp.Process(target=__produce, args=(queue, transport, 100_000))
+    producer.start()
+    data_type, columns = receive(queue.get(timeout=10))
+    data_type_decoded, (sequence, decoded, triggers) = receive(queue.get(timeout=10))
+    producer.join()
+
+    assert data_type == MessageType.EventData
+    assert data_type_decoded == MessageType.DecodedData
+    assert sequence == 7
+    np.testing.assert_array_equal(triggers, np.arange(3.0))
+    for received in (columns, decoded):
+        for column, expected in zip(received, __columns(100_000)):
+            assert column.dtype == expected.dtype
+            np.testing.assert_array_equal(column, expected)
+
+
+def test_shared_memory_is_freed():
+    transport = SharedMemoryTransport(min_size=1_000)
+    small = transport.encode(__columns(10))
+    assert isinstance(small[0], np.ndarray)
+
+    descriptor = transport.encode(__columns(1_000))
+    assert isinstance(descriptor, SharedColumns)
+    path = os.path.join("/dev/shm", descriptor.name)
+    if not os.path.exists(path):
+        pytest.skip("Shared memory is not mapped to /dev/shm")
+    _, columns = receive((MessageType.PixelData, descriptor))
+    # unlinked, the data stays valid while the arrays exist
+    assert not os.path.exists(path)
+    np.testing.assert_array_equal(columns[2], __columns(1_000)[2])
+    # unmapped with the last array
+    first = columns[0]
+    del columns
+    with open("/proc/self/maps") as f:
+        assert descriptor.name in f.read()
+    np.testing.assert_array_equal(first, __columns(1_000)[0])
+    del first
+    with open("/proc/self/maps") as f:
+        assert descriptor.name not in f.read()
+
+    descriptor = transport.encode(__columns(1_000))
+    discard((MessageType.PixelData, descriptor))
+    assert not os.path.exists(os.path.join("/dev/shm", descriptor.name))
@@ -0,0 +1,23 @@
+import socket
+
+from pymepix.processing.udpsampler import benchmark
+
+
+def __free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_benchmark_receives_all_datagrams(tmp_path):
+    # runs the loop of the throughput benchmark, it has to follow the frames sent by the sampler
+    packets, chunk_size = 200, 139
+    received_bytes, _ = benchmark(
+        packets,
+        recv_batch=1,
+        chunk_size=chunk_size,
+        address=("127.0.0.1", __free_port(socket.SOCK_DGRAM)),
+        packet_address="ipc://{}".format(tmp_path / "packets"),
+        control_address="tcp://127.0.0.1:{}".format(__free_port(socket.SOCK_STREAM)),
+    )
+    assert received_bytes == packets * chunk_size * 8
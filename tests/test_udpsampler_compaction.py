@@ -0,0 +1,50 @@
+import numpy as np
+
+from pymepix.processing.udpsampler import compact_chunk
+
+
+def __word(header, subheader=0, payload=0):
+    return (header << 60) | (subheader << 56) | payload
+
+
+def __lsb(time):
+    return __word(0x4, 0x4, (time & 0xFFFFFFFF) << 16)
+
+
+def __msb(time):
+    return __word(0x4, 0x5, ((time >> 32) & 0xFFFF) << 16)
+
+
+def test_only_pixels_and_triggers_are_kept():
+    pixels = [__word(0xB, payload=index) for index in range(3)]
+    trigger = __word(0x6, 0xF, 42)
+    words = [pixels[0], __word(0x7, 0x1), __lsb(5), pixels[1], trigger, __word(0x4, 0xE), pixels[2]]
+    buffer = bytearray(np.array(words + [0xFFFF], dtype=np.uint64).tobytes())
+
+    size, longtime, heartbeat_lsb = compact_chunk(buffer, 8 * len(words))
+
+    assert size == 8 * 4
+    assert np.frombuffer(buffer, dtype=np.uint64, count=4).tolist() == [pixels[0], pixels[1], trigger, pixels[2]]
+    assert longtime is None
+    assert heartbeat_lsb == 5
+
+
+def test_longtime_from_heartbeats():
+    time = 0x1234_5678_9ABC
+    words = [__lsb(time), __word(0xB), __msb(time), __lsb(time + 100)]
+    buffer = bytearray(np.array(words, dtype=np.uint64).tobytes())
+    size, longtime, heartbeat_lsb = compact_chunk(buffer, len(buffer))
+    assert size == 8
+    assert longtime == time
+    assert heartbeat_lsb == (time + 100) & 0xFFFFFFFF
+
+    # the LSB word of the next MSB word was in the previous chunk
+    next_time = (time + 100) | (0x1235 << 32)
+    buffer = bytearray(np.array([__word(0xA), __msb(next_time)], dtype=np.uint64).tobytes())
+    _, longtime, _ = compact_chunk(buffer, len(buffer), heartbeat_lsb)
+    assert longtime == next_time
+
+    # without any LSB word the time is unknown
+    _, longtime, heartbeat_lsb = compact_chunk(buffer, len(buffer))
+    assert longtime is None
+    assert heartbeat_lsb is None